@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import os
+
+
+class CatalogFingerprints:
+    """
+    Fingerprints of every catalog table on every segment: the row count and
+    an order independent hash (the sum of per-row md5 hashes), both computed
+    on the server.  The fingerprints of the last clean gpcheckcat run are
+    kept in a file so that the next run only needs to cross check catalog
+    tables that changed since.
+    """
+
+    # Columns that are known to differ between segments are left out, the
+    # same as in the cross consistency checks.
+    fingerprint_query = """
+        SELECT gp_segment_id AS segid, count(*) AS numrows,
+               coalesce(sum(('x' || substr(md5(textin(record_out(ROW({columns})))), 1, 16))::bit(64)::bigint), 0)::text AS hash
+        FROM pg_catalog.{catalog}
+        GROUP BY gp_segment_id
+        UNION ALL
+        SELECT gp_segment_id AS segid, count(*) AS numrows,
+               coalesce(sum(('x' || substr(md5(textin(record_out(ROW({columns})))), 1, 16))::bit(64)::bigint), 0)::text AS hash
+        FROM gp_dist_random('pg_catalog.{catalog}')
+        GROUP BY gp_segment_id
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.previous = {}  # catname -> {segid: (numrows, hash)}
+        self.current = {}
+
+    def get_fingerprint_query(self, catname, columns):
+        return self.fingerprint_query.format(catalog=catname, columns=', '.join(columns))
+
+    def compute(self, db_connection, catalog_tables):
+        for cat in catalog_tables:
+            if cat.isMasterOnly():
+                continue
+            catname = cat.getTableName()
+            qry = self.get_fingerprint_query(catname, cat.getTableColumns())
+            fingerprint = {}
+            for (segid, numrows, hash) in db_connection.query(qry).getresult():
+                fingerprint[int(segid)] = (int(numrows), str(hash))
+            self.current[catname] = fingerprint
+
+    def is_changed(self, catname):
+        """
+        True unless the table has the same fingerprint on every segment as
+        in the last clean run.
+        """
+        if catname not in self.current:
+            return True
+        return self.current[catname] != self.previous.get(catname)
+
+    def get_changed_tables(self):
+        return sorted(catname for catname in self.current if self.is_changed(catname))
+
+    def load(self):
+        self.previous = {}
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename) as fp:
+            for line in fp:
+                fields = line.split()
+                if len(fields) != 4:
+                    continue
+                (catname, segid, numrows, hash) = fields
+                self.previous.setdefault(catname, {})[int(segid)] = (int(numrows), hash)
+
+    def save(self):
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        # write to a temporary file first so an interrupted run never
+        # leaves a partial baseline behind
+        tmpname = self.filename + '.tmp'
+        with open(tmpname, 'w') as fp:
+            for catname in sorted(self.current):
+                for segid, (numrows, hash) in sorted(self.current[catname].items()):
+                    fp.write('%s %d %d %s\n' % (catname, segid, numrows, hash))
+        os.rename(tmpname, self.filename)
+        self.previous = dict(self.current)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import cPickle
+import heapq
+import os
+import tempfile
+
+# Number of entries a SpillList keeps in memory before writing them out
+SPILL_THRESHOLD = 50000
+
+
+class SpillList:
+    """
+    An append only list of strings that keeps at most max_in_memory entries
+    in memory.  Whenever that many have been added they are sorted and
+    written out as a run to a temporary file; sorted_unique() then merges
+    the runs back so repair scripts can be written without holding every
+    statement in memory.
+    """
+
+    def __init__(self, max_in_memory=SPILL_THRESHOLD, tmpdir=None):
+        self.max_in_memory = max_in_memory
+        self.tmpdir = tmpdir
+        self.entries = []
+        self.runs = []
+        self.count = 0
+
+    def append(self, entry):
+        self.entries.append(entry)
+        self.count += 1
+        if len(self.entries) >= self.max_in_memory:
+            self._spill()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return self.sorted_unique()
+
+    def _spill(self):
+        fd, filename = tempfile.mkstemp(prefix='gpcheckcat_spill_', dir=self.tmpdir)
+        with os.fdopen(fd, 'wb') as fp:
+            for entry in sorted(set(self.entries)):
+                cPickle.dump(entry, fp, cPickle.HIGHEST_PROTOCOL)
+        self.runs.append(filename)
+        self.entries = []
+
+    def _read_run(self, filename):
+        with open(filename, 'rb') as fp:
+            while True:
+                try:
+                    yield cPickle.load(fp)
+                except EOFError:
+                    return
+
+    def sorted_unique(self):
+        runs = [self._read_run(filename) for filename in self.runs]
+        runs.append(iter(sorted(set(self.entries))))
+        return merge_sorted_unique(*runs)
+
+    def close(self):
+        for filename in self.runs:
+            if os.path.exists(filename):
+                os.remove(filename)
+        self.runs = []
+        self.entries = []
+        self.count = 0
+
+
+def merge_sorted_unique(*iterables):
+    """
+    Merge sorted iterables into one sorted stream without duplicates.
+    """
+    last = None
+    first = True
+    for entry in heapq.merge(*iterables):
+        if first or entry != last:
+            yield entry
+        first = False
+        last = entry
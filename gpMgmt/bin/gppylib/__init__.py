@@ -4,3 +4,9 @@
 from os.path import abspath as _abspath
 __path__[0] = _abspath(__path__[0])
 
+
+# GP_IMPORT_PROFILE=1 reports the time spent importing each module at exit
+import os as _os
+if _os.environ.get('GP_IMPORT_PROFILE'):
+    from gppylib.gpimport import profile_imports as _profile_imports
+    _profile_imports()
@@ -17,23 +17,30 @@ for executing this set of commands.
 '''
 
 from Queue import  Queue,Empty
-from threading import Thread
+from threading import Thread, Lock, BoundedSemaphore, Condition
 
 
 import os
+import shutil
 import signal
 import subprocess
 import sys
+import tempfile
 import time
 
 from gppylib import gplog
 from gppylib import gpsubprocess
-from pygresql.pg import DB
+from gppylib.gpimport import lazy_import
 
 # paramiko prints deprecation warnings which are ugly to the end-user
 import warnings
 warnings.simplefilter('ignore', DeprecationWarning)
-import paramiko, getpass
+import getpass
+
+# Only needed by some commands; see gppylib.gpimport
+paramiko = lazy_import('paramiko')
+uuid = lazy_import('uuid')
+_pg = lazy_import('pygresql.pg')
 
 
 logger=gplog.get_default_logger()
@@ -46,29 +53,63 @@ SRC_GPPATH=". %s/greenplum_path.sh;" % GPHOME
 SSH_MAX_RETRY=10
 # Delay before retrying ssh connection, in seconds
 SSH_RETRY_DELAY=.5
+# Maximum number of commands multiplexed at once over one host's ssh control
+# connection.  Matches the sshd default for MaxSessions.
+SSH_MAX_SESSIONS_PER_HOST=10
+# Seconds an unused ssh control connection is kept open before it is evicted.
+SSH_CONTROL_PERSIST=60
+# Maximum number of REMOTE commands fused into a single ssh invocation.
+MAX_FUSED_COMMANDS=32
 
 
 class WorkerPool(object):
-    """TODO:"""
+    """
+    Runs Commands on a fixed set of worker threads.
+
+    With fuseRemoteCommands=True, REMOTE commands queued for the same host are
+    held back and run together as one ssh invocation (see FusedRemoteCommand)
+    when the pool is joined or maxFusedCommands of them are pending.  The
+    individual commands still get their own results and show up individually
+    in the completed queue.
+
+    Completion is signalled rather than polled: as_completed() yields commands
+    as workers finish them, wait_for_completion() returns as soon as nothing
+    is outstanding and an optional callback is invoked for every finished
+    command.  With maxQueued > 0, addCommand() blocks while that many commands
+    are outstanding.
+    """
     
-    def __init__(self,numWorkers=16,items=None):        
+    def __init__(self,numWorkers=16,items=None,fuseRemoteCommands=False,maxFusedCommands=MAX_FUSED_COMMANDS,
+                 maxQueued=0,completionCallback=None):
         self.workers=[]
         self.work_queue=Queue()
         self.completed_queue=Queue()
         self.num_assigned=0
+        self.num_pending=0      # assigned but not yet finished
+        self.maxQueued=maxQueued
+        self.completionCallback=completionCallback
+        self.completed_cond=Condition()
+        self.fuseRemoteCommands=fuseRemoteCommands
+        self.maxFusedCommands=maxFusedCommands
+        self.fuseLock=Lock()
+        self.pendingFused={}   # host -> [cmd]
         if items is not None:
             for item in items:                
                 self.work_queue.put(item)
                 self.num_assigned += 1
+                self.num_pending += 1
             
         for i in range(0,numWorkers):
-            w = Worker("worker%d" % i,self)
+            w = self.createWorker("worker%d" % i)
             self.workers.append(w)
             w.start()
         self.numWorkers = numWorkers
         self.logger = logger
      
     ###
+    def createWorker(self,name):
+        return Worker(name,self)
+
     def getNumWorkers(self):
        return self.numWorkers
 
@@ -76,19 +117,143 @@ class WorkerPool(object):
         return self.work_queue.get(block=True,timeout=timeout)
     
     def addFinishedWorkItem(self,command):
-        self.completed_queue.put(command)    
+        if isinstance(command, FusedRemoteCommand):
+            finished = command.commands
+        else:
+            finished = [command]
+        for cmd in finished:
+            self.completed_queue.put(cmd)
+            if self.completionCallback is not None:
+                try:
+                    self.completionCallback(cmd)
+                except Exception, e:
+                    self.logger.exception(e)
+        self.completed_cond.acquire()
+        try:
+            self.num_pending -= len(finished)
+            self.completed_cond.notifyAll()
+        finally:
+            self.completed_cond.release()
         self.work_queue.task_done()
     
     
     def addCommand(self,cmd):   
         self.logger.debug("Adding cmd to work_queue: %s" % cmd.cmdStr) 
-        self.work_queue.put(cmd)
+        if self.maxQueued > 0:
+            self._waitForQueueSpace()
+        self.completed_cond.acquire()
+        try:
+            self.num_pending += 1
+        finally:
+            self.completed_cond.release()
         self.num_assigned += 1
+        if self.fuseRemoteCommands and FusedRemoteCommand.canFuse(cmd):
+            self.fuseLock.acquire()
+            try:
+                pending = self.pendingFused.setdefault(cmd.remoteHost, [])
+                pending.append(cmd)
+                if len(pending) >= self.maxFusedCommands:
+                    self._queueFused(cmd.remoteHost)
+            finally:
+                self.fuseLock.release()
+            return
+        self.work_queue.put(cmd)
+
+    def flushFusedCommands(self):
+        """ queues all REMOTE commands held back for fusion """
+        self.fuseLock.acquire()
+        try:
+            for host in self.pendingFused.keys():
+                self._queueFused(host)
+        finally:
+            self.fuseLock.release()
+
+    def _waitForQueueSpace(self):
+        self.completed_cond.acquire()
+        try:
+            if self.num_pending < self.maxQueued:
+                return
+        finally:
+            self.completed_cond.release()
+        # commands held back for fusion have to run before anything can finish
+        self.flushFusedCommands()
+        self.completed_cond.acquire()
+        try:
+            while self.num_pending >= self.maxQueued:
+                self.completed_cond.wait()
+        finally:
+            self.completed_cond.release()
+
+    def wait_for_completion(self, timeout=None):
+        """ waits until every assigned command has finished or timeout seconds
+        have passed; returns True if nothing is outstanding """
+        self.flushFusedCommands()
+        deadline = None if timeout is None else time.time() + timeout
+        self.completed_cond.acquire()
+        try:
+            while self.num_pending > 0:
+                if deadline is None:
+                    # Condition.wait() without a timeout cannot be interrupted by ^C
+                    self.completed_cond.wait(1)
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.completed_cond.wait(remaining)
+            return self.num_pending == 0
+        finally:
+            self.completed_cond.release()
+
+    def as_completed(self, timeout=None):
+        """ yields commands as they finish until no assigned command is
+        outstanding.  The yielded commands are taken off the completed queue.
+        Stops early if no command finished within timeout seconds. """
+        self.flushFusedCommands()
+        while True:
+            try:
+                yield self.completed_queue.get(False)
+                continue
+            except Empty:
+                pass
+            self.completed_cond.acquire()
+            try:
+                if self.completed_queue.empty():
+                    if self.num_pending == 0:
+                        return
+                    start = time.time()
+                    self.completed_cond.wait(1 if timeout is None else min(timeout, 1))
+                    if timeout is not None and self.completed_queue.empty():
+                        timeout -= time.time() - start
+                        if timeout <= 0:
+                            return
+            finally:
+                self.completed_cond.release()
+
+    def _queueFused(self, host):
+        cmds = self.pendingFused.pop(host)
+        if len(cmds) == 1:
+            self.work_queue.put(cmds[0])
+        else:
+            self.work_queue.put(FusedRemoteCommand(host, cmds))
     
+    def _wait_for_completed_count(self, command_count, timeout):
+        """ waits up to timeout seconds, returning early once command_count
+        commands are in the completed queue """
+        deadline = time.time() + timeout
+        self.completed_cond.acquire()
+        try:
+            while self.completed_queue.qsize() < command_count:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.completed_cond.wait(remaining)
+            return self.completed_queue.qsize()
+        finally:
+            self.completed_cond.release()
+
     def wait_and_printdots(self,command_count,quiet=True):
-        while self.completed_queue.qsize() < command_count:
-            time.sleep(1)
-            
+        self.flushFusedCommands()
+        while self._wait_for_completed_count(command_count, 1) < command_count:
             if not quiet:
                 sys.stdout.write(".")
                 sys.stdout.flush()
@@ -97,17 +262,19 @@ class WorkerPool(object):
         self.join()
         
     def print_progress(self, command_count):
+        self.flushFusedCommands()
+        num_completed = self.completed_queue.qsize()
         while True:
-            num_completed = self.completed_queue.qsize()
             num_completed_percentage = 0
             if command_count:
                 num_completed_percentage = float(num_completed) / command_count
             logger.info('%0.2f%% of jobs completed' % (num_completed_percentage * 100))
             if num_completed >= command_count:
                 return
-            time.sleep(10)
+            num_completed = self._wait_for_completed_count(command_count, 10)
     
     def join(self):
+        self.flushFusedCommands()
         self.work_queue.join()
         return True
     
@@ -147,8 +314,12 @@ class WorkerPool(object):
         
 
     def isDone(self):
-        #TODO: not sure that qsize() is safe
-        return (self.num_assigned == self.completed_queue.qsize())
+        self.flushFusedCommands()
+        self.completed_cond.acquire()
+        try:
+            return self.num_pending == 0
+        finally:
+            self.completed_cond.release()
         
     
     def haltWork(self):
@@ -300,8 +471,20 @@ class CommandResult():
         self.stderr=stderr
         self.completed=completed
         self.halt=halt
+        self.start_time=None    # set by Command.run(), seconds since the epoch
+        self.end_time=None
         pass
 
+    def set_timing(self,start_time,end_time):
+        self.start_time=start_time
+        self.end_time=end_time
+
+    def get_elapsed_time(self):
+        """ seconds the command took to run, or None if not timed """
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
     def printResult(self):
         res = "cmd had rc=%d completed=%s halted=%s\n  stdout='%s'\n  " \
             "stderr='%s'" % (self.rc,str(self.completed), str(self.halt), self.stdout, self.stderr)
@@ -352,6 +535,7 @@ RMI=3
 NAKED=4
 
 gExecutionContextFactory = None
+gRemoteSessionPool = None
 
 #
 # @param factory needs to have a createExecutionContext(self, execution_context_id, remoteHost, stdin, nakedExecutionInfo) function
@@ -360,6 +544,17 @@ def setExecutionContextFactory(factory):
     global gExecutionContextFactory
     gExecutionContextFactory = factory
 
+#
+# @param pool a RemoteSessionPool shared by all REMOTE commands, or None to
+#        go back to one ssh connection per command
+#
+def setRemoteSessionPool(pool):
+    global gRemoteSessionPool
+    gRemoteSessionPool = pool
+
+def getRemoteSessionPool():
+    return gRemoteSessionPool
+
 def createExecutionContext(execution_context_id,remoteHost,stdin, nakedExecutionInfo=None):
     if gExecutionContextFactory is not None:
         return gExecutionContextFactory.createExecutionContext(execution_context_id, remoteHost, stdin)
@@ -368,6 +563,8 @@ def createExecutionContext(execution_context_id,remoteHost,stdin, nakedExecution
     elif execution_context_id == REMOTE:
         if remoteHost is None:
             raise Exception("Programmer Error.  Specified REMOTE execution context but didn't provide a remoteHost")
+        if gRemoteSessionPool is not None:
+            return PooledRemoteExecutionContext(remoteHost,stdin,gRemoteSessionPool)
         return RemoteExecutionContext(remoteHost,stdin)
     elif execution_context_id == RMI:
         return RMIExecutionContext()
@@ -647,7 +844,7 @@ class RemoteExecutionContext(LocalExecutionContext):
 
         # Escape " for remote execution otherwise it interferes with ssh
         cmd.cmdStr = cmd.cmdStr.replace('"', '\\"')
-        cmd.cmdStr="ssh -o 'StrictHostKeyChecking no' %s \"%s %s\"" % (self.targetHost,SRC_GPPATH,cmd.cmdStr)
+        cmd.cmdStr="ssh -o 'StrictHostKeyChecking no' %s%s \"%s %s\"" % (self.getSshOptions(),self.targetHost,SRC_GPPATH,cmd.cmdStr)
         LocalExecutionContext.execute(self,cmd)
         if (cmd.get_results().stderr.startswith('ssh_exchange_identification: Connection closed by remote host')):
             self.__retry(cmd)
@@ -660,6 +857,169 @@ class RemoteExecutionContext(LocalExecutionContext):
         LocalExecutionContext.execute(self, cmd)
         if (cmd.get_results().stderr.startswith('ssh_exchange_identification: Connection closed by remote host')):
             self.__retry(cmd, count + 1)
+
+    def getSshOptions(self):
+        """ extra ssh options (with a trailing space) placed before the target host """
+        return ''
+
+
+class RemoteSessionPool(object):
+    """ Keeps one multiplexed ssh control connection (ControlMaster) per host so
+    that REMOTE commands issued by any WorkerPool worker reuse an established
+    connection instead of doing a full ssh handshake each time.
+
+    At most max_sessions commands run concurrently over a host's connection;
+    further commands for that host wait for a free session.  A connection that
+    has been unused for idle_timeout seconds is closed by ssh (ControlPersist)
+    and forgotten here, so the next command to that host establishes it again.
+
+    Install with setRemoteSessionPool() and close() when done.
+    """
+
+    def __init__(self, max_sessions=SSH_MAX_SESSIONS_PER_HOST, idle_timeout=SSH_CONTROL_PERSIST, control_dir=None):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.control_dir = control_dir
+        self.owns_control_dir = False
+        if self.control_dir is None:
+            # unix socket paths are limited to ~100 characters, keep this short
+            self.control_dir = tempfile.mkdtemp(prefix='gpcm-', dir='/tmp')
+            self.owns_control_dir = True
+        self.lock = Lock()
+        self.sessions = {}
+        self.handshakes = 0
+        self.handshakes_saved = 0
+        self.evictions = 0
+
+    def getControlPath(self, host):
+        return os.path.join(self.control_dir, '%r@%h:%p')
+
+    def getSshOptions(self, host):
+        return "-o ControlMaster=auto -o 'ControlPath=%s' -o ControlPersist=%d " % \
+               (self.getControlPath(host), self.idle_timeout)
+
+    def acquire(self, host):
+        """ blocks until a session on host is available and returns it, to be
+        given back with release() """
+        self.lock.acquire()
+        try:
+            self._evict_idle(time.time())
+            session = self.sessions.get(host)
+            if session is None:
+                session = _HostSession(host, self.max_sessions)
+                self.sessions[host] = session
+            # counts the commands waiting for a session too, so that the
+            # session is not evicted before they are done with it
+            session.active += 1
+        finally:
+            self.lock.release()
+
+        session.slots.acquire()
+
+        self.lock.acquire()
+        try:
+            session.last_used = time.time()
+            if session.established:
+                self.handshakes_saved += 1
+            else:
+                self.handshakes += 1
+        finally:
+            self.lock.release()
+        return session
+
+    def release(self, session, results=None):
+        """ gives back a session returned by acquire(), noting whether the
+        control connection is usable for the next command """
+        # ssh exits with 255 when it could not connect, but so may the
+        # remote command: only then ask the control connection itself
+        if results is not None and results.rc != 255:
+            established = True
+        else:
+            established = self.checkControlConnection(session.host)
+
+        self.lock.acquire()
+        try:
+            session.active -= 1
+            session.last_used = time.time()
+            session.established = established
+        finally:
+            self.lock.release()
+        session.slots.release()
+
+    def checkControlConnection(self, host):
+        """ returns True if the control connection to host is up """
+        devnull = open(os.devnull, 'w')
+        try:
+            rc = subprocess.call(['ssh', '-o', 'ControlPath=%s' % self.getControlPath(host), '-O', 'check', host],
+                                 stdout=devnull, stderr=devnull, close_fds=True)
+        finally:
+            devnull.close()
+        return rc == 0
+
+    def _evict_idle(self, now):
+        for host, session in self.sessions.items():
+            if session.active == 0 and now - session.last_used > self.idle_timeout:
+                del self.sessions[host]
+                if session.established:
+                    self.evictions += 1
+
+    def get_metrics(self):
+        self.lock.acquire()
+        try:
+            return {'hosts': len(self.sessions),
+                    'handshakes': self.handshakes,
+                    'handshakes_saved': self.handshakes_saved,
+                    'evictions': self.evictions}
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """ closes all control connections """
+        self.lock.acquire()
+        try:
+            hosts = [host for host, session in self.sessions.items() if session.established]
+            self.sessions = {}
+        finally:
+            self.lock.release()
+
+        devnull = open(os.devnull, 'w')
+        try:
+            for host in hosts:
+                subprocess.call(['ssh', '-o', 'ControlPath=%s' % self.getControlPath(host), '-O', 'exit', host],
+                                stdout=devnull, stderr=devnull, close_fds=True)
+        finally:
+            devnull.close()
+
+        if self.owns_control_dir:
+            shutil.rmtree(self.control_dir, ignore_errors=True)
+        logger.debug("RemoteSessionPool closed: %s" % self.get_metrics())
+
+
+class _HostSession(object):
+    def __init__(self, host, max_sessions):
+        self.host = host
+        self.slots = BoundedSemaphore(max_sessions)
+        self.active = 0
+        self.established = False
+        self.last_used = time.time()
+
+
+class PooledRemoteExecutionContext(RemoteExecutionContext):
+    """ RemoteExecutionContext that runs over the control connection of a RemoteSessionPool """
+
+    def __init__(self,targetHost,stdin,pool):
+        RemoteExecutionContext.__init__(self, targetHost, stdin)
+        self.pool = pool
+
+    def getSshOptions(self):
+        return self.pool.getSshOptions(self.targetHost)
+
+    def execute(self,cmd):
+        session = self.pool.acquire(self.targetHost)
+        try:
+            RemoteExecutionContext.execute(self, cmd)
+        finally:
+            self.pool.release(session, cmd.get_results())
         
         
 class RMIExecutionContext(ExecutionContext):
@@ -693,12 +1053,15 @@ class Command:
         
 
     def run(self,validateAfter=False):
+        start_time = time.time()
         faultPoint = os.getenv('GP_COMMAND_FAULT_POINT')
         if not faultPoint or (self.name and not self.name.startswith(faultPoint)):
             self.exec_context.execute(self)
         else:
             # simulate error
             self.results = CommandResult(1,'Fault Injection','Fault Injection' ,False,True)
+        if self.results is not None:
+            self.results.set_timing(start_time, time.time())
         
         if validateAfter:
             self.validate()
@@ -741,6 +1104,88 @@ class Command:
             raise ExecutionError("non-zero rc: %d" % self.results.rc, self)
         
 
+class FusedRemoteCommand(Command):
+    """ Runs several REMOTE commands for one host over a single ssh invocation.
+
+    Each command runs in its own subshell with stdin from /dev/null; its stdout,
+    stderr and exit code are written back between delimiter lines and split
+    into the CommandResult of the original command.  The command strings go
+    through the same quoting as in RemoteExecutionContext, so anything that
+    works as a REMOTE Command works here.
+    """
+
+    def __init__(self, remoteHost, commands):
+        self.commands = commands
+        self.marker = 'GPFUSE_%s' % uuid.uuid4().hex
+        Command.__init__(self, 'fused commands on %s' % remoteHost, self._buildCmdStr(),
+                         ctxt=REMOTE, remoteHost=remoteHost)
+        self.propagate_env_map = {}
+
+    @staticmethod
+    def canFuse(cmd):
+        """ True for plain REMOTE commands without stdin or a custom run() """
+        ctxt = cmd.exec_context
+        if not isinstance(ctxt, RemoteExecutionContext) or ctxt.stdin:
+            return False
+        if cmd.__class__.run.im_func is not Command.run.im_func:
+            return False
+        faultPoint = os.getenv('GP_COMMAND_FAULT_POINT')
+        if faultPoint and cmd.name and cmd.name.startswith(faultPoint):
+            return False
+        return True
+
+    def _buildCmdStr(self):
+        # $ is escaped since the string ends up inside double quotes locally
+        parts = ["__gpfuse=\\$(mktemp -d /tmp/gpfuse.XXXXXX) || exit 255"]
+        for i, cmd in enumerate(self.commands):
+            cmdStr = cmd.cmdStr
+            for k, v in cmd.exec_context.__class__.propagate_env_map.iteritems():
+                cmdStr = "%s=%s %s" % (k, v, cmdStr)
+            for k, v in cmd.propagate_env_map.iteritems():
+                cmdStr = "%s=%s %s" % (k, v, cmdStr)
+            parts.append("(\n%s\n) > \\$__gpfuse/out 2> \\$__gpfuse/err < /dev/null" % cmdStr)
+            parts.append("__gpfuse_rc=\\$?")
+            parts.append("echo %s BEGIN %d; cat \\$__gpfuse/out; echo" % (self.marker, i))
+            parts.append("echo %s STDERR %d; cat \\$__gpfuse/err; echo" % (self.marker, i))
+            parts.append("echo %s END %d \\$__gpfuse_rc" % (self.marker, i))
+        parts.append("rm -rf \\$__gpfuse")
+        return '; '.join(parts)
+
+    def run(self, validateAfter=False):
+        start_time = time.time()
+        self.exec_context.execute(self)
+        self._splitResults()
+        end_time = time.time()
+        for cmd in [self] + self.commands:
+            cmd.get_results().set_timing(start_time, end_time)
+        if validateAfter:
+            self.validate()
+
+    def _splitResults(self):
+        results = self.get_results()
+        stdout = results.stdout
+        pos = 0
+        for i, cmd in enumerate(self.commands):
+            begin = '%s BEGIN %d\n' % (self.marker, i)
+            stderr = '\n%s STDERR %d\n' % (self.marker, i)
+            end = '\n%s END %d ' % (self.marker, i)
+
+            b = stdout.find(begin, pos)
+            e = stdout.find(stderr, b)
+            r = stdout.find(end, e)
+            eol = stdout.find('\n', r + len(end))
+            if b < 0 or e < 0 or r < 0 or eol < 0:
+                # the remote script did not get to this command
+                cmd.set_results(CommandResult(results.rc if results.rc else 1, '', results.stderr,
+                                              False, results.halt))
+                continue
+            pos = eol
+            cmd.set_results(CommandResult(int(stdout[r + len(end):eol]),
+                                          stdout[b + len(begin):e],
+                                          stdout[e + len(stderr):r],
+                                          results.completed, results.halt))
+
+
 class SQLCommand(Command):
     """Base class for commands that execute SQL statements.  Classes
     that inherit from SQLCOmmand should set cancel_conn to the pygresql 
@@ -765,7 +1210,7 @@ class SQLCommand(Command):
         
         # if self.conn is not set we cannot cancel.
         if self.cancel_conn:
-            DB(self.cancel_conn).cancel()
+            _pg.DB(self.cancel_conn).cancel()
     
     
 def run_remote_commands(name, commands):
@@ -6,18 +6,21 @@
 """
 TODO: docs!
 """
-import os, pickle, base64, time
+import os, pickle, base64, time, pipes
 
 from gppylib.gplog import *
-from gppylib.db import dbconn
-from gppylib.db import catalog
-from gppylib import gparray
 from base import *
 from unix import *
-import pg
-from gppylib import pgconf
+from gppylib.gpimport import lazy_import
 from gppylib.utils import writeLinesToFile, createFromSingleHostFile, shellEscape
 
+# The catalog access layer is only needed by some commands; see gppylib.gpimport
+dbconn = lazy_import('gppylib.db.dbconn')
+catalog = lazy_import('gppylib.db.catalog')
+gparray = lazy_import('gppylib.gparray')
+pgconf = lazy_import('gppylib.pgconf')
+pg = lazy_import('gppylib.commands.pg')
+
 
 logger = get_default_logger()
 
@@ -1301,6 +1304,33 @@ class GpLogFilter(Command):
         cmd.run(validateAfter=True)
         return "".join(cmd.get_results().stdout).split("\r\n")
 
+
+#-----------------------------------------------
+class GpLogFilterToFile(Command):
+    """
+    Runs gplogfilter over the pg_log files of an instance on a remote host
+    and writes its output to a local file.  Only the selected log entries
+    are shipped back, compressed if args include -z.
+
+    semaphore, if given, is held while the command runs, to limit the
+    number of commands running against the same host.
+    """
+    def __init__(self, name, args, datadir, outfile, remoteHost, semaphore=None):
+        self.semaphore = semaphore
+        remoteCmd = '%s $GPHOME/bin/gplogfilter %s %s/pg_log/*' % (SRC_GPPATH,
+                                                                   ' '.join(pipes.quote(a) for a in args),
+                                                                   pipes.quote(datadir))
+        cmdStr = "ssh -o 'StrictHostKeyChecking no' %s %s > %s" % (remoteHost, pipes.quote(remoteCmd),
+                                                                   pipes.quote(outfile))
+        Command.__init__(self, name, cmdStr, LOCAL)
+        self.remoteHost = remoteHost
+
+    def run(self, validateAfter=False):
+        if self.semaphore is None:
+            return Command.run(self, validateAfter)
+        with self.semaphore:
+            return Command.run(self, validateAfter)
+
 #-----------------------------------------------
 def distribute_tarball(queue,list,tarball):
         logger.debug("distributeTarBall start")
@@ -3,8 +3,11 @@
 # Copyright (c) Greenplum Inc 2012. All Rights Reserved. 
 #
 
+import threading
 import unittest2 as unittest
-from gppylib.commands.base import Command, WorkerPool
+from gppylib.commands.base import Command, WorkerPool, CommandResult, RemoteSessionPool, \
+        PooledRemoteExecutionContext, RemoteExecutionContext, setRemoteSessionPool, REMOTE, \
+        FusedRemoteCommand, LocalExecutionContext
 from mock import patch
 
 class WorkerPoolTestCase(unittest.TestCase):
@@ -28,3 +31,214 @@ class WorkerPoolTestCase(unittest.TestCase):
         w.join()
         self.assertTrue(mock1.called_with('0.00% of jobs completed'))
         w.haltWork()
+
+
+class RemoteSessionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = RemoteSessionPool(control_dir='/tmp/cm')
+
+    def tearDown(self):
+        setRemoteSessionPool(None)
+
+    def test_handshakes_saved(self):
+        session = self.pool.acquire('sdw1')
+        self.pool.release(session, CommandResult(0, '', '', True, False))
+        session = self.pool.acquire('sdw1')
+        self.pool.release(session, CommandResult(1, '', '', True, False))
+        session = self.pool.acquire('sdw2')
+        self.pool.release(session, CommandResult(0, '', '', True, False))
+        metrics = self.pool.get_metrics()
+        self.assertEqual(metrics['handshakes'], 2)
+        self.assertEqual(metrics['handshakes_saved'], 1)
+
+    @patch('gppylib.commands.base.RemoteSessionPool.checkControlConnection', return_value=False)
+    def test_connection_failure_needs_new_handshake(self, mock_check):
+        session = self.pool.acquire('sdw1')
+        self.pool.release(session, CommandResult(255, '', 'ssh: connect to host sdw1', True, False))
+        session = self.pool.acquire('sdw1')
+        self.pool.release(session, CommandResult(0, '', '', True, False))
+        self.assertEqual(self.pool.get_metrics()['handshakes'], 2)
+        mock_check.assert_called_once_with('sdw1')
+
+    @patch('gppylib.commands.base.RemoteSessionPool.checkControlConnection', return_value=True)
+    def test_command_exit_255_keeps_connection(self, mock_check):
+        session = self.pool.acquire('sdw1')
+        self.pool.release(session, CommandResult(255, '', '', True, False))
+        self.assertTrue(self.pool.sessions['sdw1'].established)
+        session = self.pool.acquire('sdw1')
+        self.pool.release(session, CommandResult(0, '', '', True, False))
+        self.assertEqual(self.pool.get_metrics()['handshakes_saved'], 1)
+
+    def test_idle_eviction(self):
+        self.pool.idle_timeout = 0
+        session = self.pool.acquire('sdw1')
+        self.pool.release(session, CommandResult(0, '', '', True, False))
+        self.pool.sessions['sdw1'].last_used -= 1
+        session = self.pool.acquire('sdw1')
+        self.pool.release(session, CommandResult(0, '', '', True, False))
+        metrics = self.pool.get_metrics()
+        self.assertEqual(metrics['evictions'], 1)
+        self.assertEqual(metrics['handshakes'], 2)
+
+    def test_no_eviction_between_acquire_and_release(self):
+        self.pool.idle_timeout = 10
+        session = self.pool.acquire('sdw1')
+        self.pool.release(session, CommandResult(0, '', '', True, False))
+
+        # the session goes idle and another worker's command evicts the idle
+        # sessions while this one waits for a session on sdw1
+        slots = session.slots
+        class EvictingSlots(object):
+            def acquire(slf):
+                session.last_used -= 20
+                other = threading.Thread(target=lambda: self.pool.release(self.pool.acquire('sdw2'),
+                                                                          CommandResult(0, '', '', True, False)))
+                other.start()
+                other.join()
+                slots.acquire()
+            def release(slf):
+                slots.release()
+        session.slots = EvictingSlots()
+
+        self.assertTrue(self.pool.acquire('sdw1') is session)
+        self.assertTrue(self.pool.sessions['sdw1'] is session)
+        self.pool.release(session, CommandResult(0, '', '', True, False))
+        self.assertEqual(session.active, 0)
+        self.assertEqual(self.pool.get_metrics()['evictions'], 0)
+
+    def test_release_after_close(self):
+        session = self.pool.acquire('sdw1')
+        with patch('gppylib.commands.base.subprocess.call'):
+            self.pool.close()
+        self.pool.release(session, CommandResult(0, '', '', True, False))
+        self.assertEqual(session.active, 0)
+        self.assertEqual(self.pool.sessions, {})
+
+    @patch('gppylib.commands.base.LocalExecutionContext.execute')
+    def test_pooled_command(self, mock_execute):
+        setRemoteSessionPool(self.pool)
+        cmd = Command('dummy', 'ls', ctxt=REMOTE, remoteHost='sdw1')
+        self.assertTrue(isinstance(cmd.exec_context, PooledRemoteExecutionContext))
+        mock_execute.side_effect = lambda ctxt, c: c.set_results(CommandResult(0, '', '', True, False))
+        cmd.run()
+        self.assertIn("-o ControlMaster=auto -o 'ControlPath=/tmp/cm/%r@%h:%p'", cmd.cmdStr)
+        self.assertEqual(self.pool.sessions['sdw1'].active, 0)
+        self.assertTrue(self.pool.sessions['sdw1'].established)
+
+    def test_unpooled_command(self):
+        cmd = Command('dummy', 'ls', ctxt=REMOTE, remoteHost='sdw1')
+        self.assertFalse(isinstance(cmd.exec_context, PooledRemoteExecutionContext))
+        self.assertTrue(isinstance(cmd.exec_context, RemoteExecutionContext))
+
+
+def run_locally(ctxt, cmd):
+    """ stands in for ssh by running the quoted remote command string with bash """
+    cmd.cmdStr = cmd.cmdStr.replace('"', '\\"')
+    cmd.cmdStr = 'bash -c "%s"' % cmd.cmdStr
+    LocalExecutionContext.execute(ctxt, cmd)
+
+
+class FusedRemoteCommandTestCase(unittest.TestCase):
+
+    @patch('gppylib.commands.base.RemoteExecutionContext.execute', run_locally)
+    def test_results_are_split(self):
+        c1 = Command('echo', 'echo "hello world"', ctxt=REMOTE, remoteHost='sdw1')
+        c2 = Command('fail', 'echo oops >&2; exit 3', ctxt=REMOTE, remoteHost='sdw1')
+        c3 = Command('no newline', 'printf \'a\\nb\'', ctxt=REMOTE, remoteHost='sdw1')
+        c4 = Command('escaped', 'echo \\$HOME | wc -c', ctxt=REMOTE, remoteHost='sdw1')
+        fused = FusedRemoteCommand('sdw1', [c1, c2, c3, c4])
+        fused.run()
+        self.assertEqual(c1.get_results().rc, 0)
+        self.assertEqual(c1.get_results().stdout, 'hello world\n')
+        self.assertEqual(c2.get_results().rc, 3)
+        self.assertEqual(c2.get_results().stdout, '')
+        self.assertEqual(c2.get_results().stderr, 'oops\n')
+        self.assertEqual(c3.get_results().stdout, 'a\nb')
+        self.assertEqual(c4.get_results().stdout.strip(), '6')
+
+    @patch('gppylib.commands.base.LocalExecutionContext.execute')
+    def test_ssh_failure(self, mock_execute):
+        mock_execute.side_effect = lambda ctxt, c: c.set_results(CommandResult(255, '', 'connection refused', True, False))
+        c1 = Command('echo', 'echo 1', ctxt=REMOTE, remoteHost='sdw1')
+        c2 = Command('echo', 'echo 2', ctxt=REMOTE, remoteHost='sdw1')
+        FusedRemoteCommand('sdw1', [c1, c2]).run()
+        self.assertEqual(c1.get_results().rc, 255)
+        self.assertEqual(c2.get_results().stderr, 'connection refused')
+        self.assertFalse(c2.was_successful())
+
+    def test_can_fuse(self):
+        self.assertTrue(FusedRemoteCommand.canFuse(Command('echo', 'echo 1', ctxt=REMOTE, remoteHost='sdw1')))
+        self.assertFalse(FusedRemoteCommand.canFuse(Command('echo', 'echo 1')))
+        self.assertFalse(FusedRemoteCommand.canFuse(Command('echo', 'cat', ctxt=REMOTE, remoteHost='sdw1', stdin='x')))
+
+    @patch('gppylib.commands.base.RemoteExecutionContext.execute', run_locally)
+    def test_pool_fuses_per_host(self):
+        w = WorkerPool(numWorkers=2, fuseRemoteCommands=True)
+        cmds = [Command('echo', 'echo %s %d' % (host, i), ctxt=REMOTE, remoteHost=host)
+                for host in ['sdw1', 'sdw2'] for i in range(3)]
+        cmds.append(Command('local', 'echo local'))
+        for cmd in cmds:
+            w.addCommand(cmd)
+        w.join()
+        completed = w.getCompletedItems()
+        w.haltWork()
+        self.assertEqual(len(completed), 7)
+        for cmd in cmds[:-1]:
+            self.assertEqual(cmd.get_results().stdout, cmd.cmdStr[5:] + '\n')
+        self.assertEqual(cmds[-1].get_results().stdout, 'local\n')
+
+
+class WorkerPoolCompletionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool:
+            self.pool.haltWork()
+            self.pool.joinWorkers()
+
+    def test_as_completed(self):
+        self.pool = WorkerPool(numWorkers=4)
+        cmds = [Command('sleep', 'sleep 0.%d' % i) for i in [3, 0, 1]]
+        for cmd in cmds:
+            self.pool.addCommand(cmd)
+        done = list(self.pool.as_completed())
+        self.assertEqual(done[0], cmds[1])
+        self.assertEqual(done[-1], cmds[0])
+        self.assertTrue(self.pool.isDone())
+        self.assertEqual(self.pool.completed_queue.qsize(), 0)
+
+    def test_as_completed_nothing_assigned(self):
+        self.pool = WorkerPool(numWorkers=1)
+        self.assertEqual(list(self.pool.as_completed()), [])
+
+    def test_wait_for_completion_timeout(self):
+        self.pool = WorkerPool(numWorkers=1)
+        self.pool.addCommand(Command('sleep', 'sleep 1'))
+        self.assertFalse(self.pool.wait_for_completion(0.1))
+        self.assertTrue(self.pool.wait_for_completion())
+
+    def test_completion_callback(self):
+        finished = []
+        self.pool = WorkerPool(numWorkers=2, completionCallback=finished.append)
+        cmds = [Command('echo', 'echo %d' % i) for i in range(3)]
+        for cmd in cmds:
+            self.pool.addCommand(cmd)
+        self.pool.join()
+        self.assertEqual(sorted(finished), sorted(cmds))
+
+    def test_max_queued(self):
+        self.pool = WorkerPool(numWorkers=1, maxQueued=2)
+        for i in range(5):
+            self.pool.addCommand(Command('echo', 'echo %d' % i))
+            self.assertTrue(self.pool.num_pending <= 2)
+        self.pool.join()
+        self.assertEqual(len(self.pool.getCompletedItems()), 5)
+
+    def test_command_timing(self):
+        cmd = Command('sleep', 'sleep 0.2')
+        cmd.run()
+        self.assertTrue(cmd.get_results().get_elapsed_time() >= 0.2)
+        self.assertTrue(cmd.get_results().start_time <= cmd.get_results().end_time)
@@ -159,3 +159,11 @@ class GpTestCase(unittest.TestCase):
     @patch('gppylib.commands.gp.Command.run', return_value=CommandResult(0, "", "", True, False))
     def test_get_postmaster_pid_locally_empty(self, mock1):
         self.assertEqual(get_postmaster_pid_locally('/tmp'), -1)
+
+    def test_gplogfilter_to_file(self):
+        cmd = gp.GpLogFilterToFile('filter', ['-q', "--match=it's"], '/data/primary/gpseg 0', '/tmp/out dir/dbid_2.gz', 'sdw1')
+        self.assertTrue(cmd.cmdStr.startswith("ssh -o 'StrictHostKeyChecking no' sdw1 '"))
+        self.assertTrue(cmd.cmdStr.endswith(" > '/tmp/out dir/dbid_2.gz'"))
+        self.assertTrue("gplogfilter -q '\"'\"'--match=it'\"'\"'\"'\"'\"'\"'\"'\"'s'\"'\"' "
+                        "'\"'\"'/data/primary/gpseg 0'\"'\"'/pg_log/*'" in cmd.cmdStr)
+        self.assertEqual(cmd.remoteHost, 'sdw1')
@@ -8,7 +8,6 @@ Set of Classes for executing unix commands.
 
 """
 import os
-import psutil
 import platform
 import socket
 import sys
@@ -16,6 +15,9 @@ import signal
 
 from gppylib.gplog import *
 from gppylib.commands.base import *
+from gppylib.gpimport import lazy_import
+
+psutil = lazy_import('psutil')
 
 
 logger = gplog.get_default_logger()
@@ -16,13 +16,18 @@
 # ============================================================================
 from datetime import date
 import copy
+import os
+import pickle
 import traceback
 
 from gppylib.utils import checkNotNone, checkIsInt
 from gppylib    import gplog
-from gppylib.db import dbconn
 from gppylib.gpversion import GpVersion
 from gppylib.commands.unix import *
+from gppylib.gpimport import lazy_import
+
+# Only needed to read the configuration from the catalog; see gppylib.gpimport
+dbconn = lazy_import('gppylib.db.dbconn')
 
 
 SYSTEM_FILESPACE = 3052        # oid of the system filespace
@@ -126,6 +131,14 @@ MASTER_CONTENT_ID = -1
 def getFaultStrategyLabel(strategy):
     return FAULT_STRATEGY_LABELS[strategy]
 
+# Replaced whenever an attribute that GpArray indexes is changed through the
+# GpDB or Segment interfaces, invalidating the indexes of every GpArray
+_configurationVersion = object()
+
+def _configurationChanged():
+    global _configurationVersion
+    _configurationVersion = object()
+
 class InvalidSegmentConfiguration(Exception):
     """Exception raised when an invalid gparray configuration is
     read from gp_segment_configuration or an attempt to save an 
@@ -602,12 +615,14 @@ class GpDB:
     def setSegmentDbId(self, dbId):
         checkNotNone("dbId", dbId)
         self.dbid = dbId
+        _configurationChanged()
 
     def setSegmentContentId(self, contentId):
         checkNotNone("contentId", contentId)
         if contentId < -1:
             raise Exception("Invalid content id %s" % contentId)
         self.content = contentId
+        _configurationChanged()
 
     def setSegmentRole(self, role):
         checkNotNone("role", role)
@@ -616,6 +631,7 @@ class GpDB:
             raise Exception("Invalid role '%s'" % role)
 
         self.role = role
+        _configurationChanged()
 
     def setSegmentPreferredRole(self, preferredRole):
         checkNotNone("preferredRole", preferredRole)
@@ -624,6 +640,7 @@ class GpDB:
             raise Exception("Invalid preferredRole '%s'" % preferredRole)
 
         self.preferred_role = preferredRole
+        _configurationChanged()
 
     def setSegmentMode(self, mode):
         checkNotNone("mode", mode)
@@ -640,6 +657,7 @@ class GpDB:
             raise Exception("Invalid status '%s'" % status)
 
         self.status = status
+        _configurationChanged()
 
     def setSegmentPort(self, port):
         checkNotNone("port", port)
@@ -655,6 +673,7 @@ class GpDB:
     def setSegmentHostName(self, hostName):
         # None is allowed -- don't check
         self.hostname = hostName
+        _configurationChanged()
 
     def setSegmentAddress(self, address):
         # None is allowed -- don't check
@@ -730,9 +749,11 @@ class Segment:
     # --------------------------------------------------------------------
     def addPrimary(self,segDB):
         self.primaryDB=segDB
+        _configurationChanged()
     
     def addMirror(self,segDB):
         self.mirrorDBs.append(segDB)
+        _configurationChanged()
 
     # --------------------------------------------------------------------    
     def get_dbs(self):
@@ -1156,6 +1177,81 @@ class GpFilespaceObj:
 
 
 
+# ============================================================================
+class GpArrayIndex:
+    """
+    Lookup tables over the master, standby and segments of a GpArray, so
+    that tools querying the array once per segment do not rescan it on every
+    call.  Built on first use and rebuilt once the configuration changed; see
+    GpArray.getIndex.  Expansion segments are not indexed.
+    """
+
+    # --------------------------------------------------------------------
+    def __init__(self, gparray):
+        self.version = _configurationVersion
+        self.segments = gparray.segments
+        self.numSegments = len(gparray.segments)
+        self.master = gparray.master
+        self.standbyMaster = gparray.standbyMaster
+
+        self.segDbs = []            # in the order of GpArray.getSegDbList()
+        self.dbIdToSegDb = {}
+        self.dbIdToSegment = {}
+        self.contentToSegDbs = {}
+        self.hostToSegDbs = {}
+        self.roleToSegDbs = {}      # current role
+        self.preferredRoleToSegDbs = {}
+        self.statusToSegDbs = {}
+        self.hostAndPreferredRoleToSegDbs = {}
+        self.__dbIdToPeer = None
+
+        for seg in gparray.segments:
+            for db in seg.get_dbs():
+                self.segDbs.append(db)
+                self.dbIdToSegDb[db.getSegmentDbId()] = db
+                self.dbIdToSegment[db.getSegmentDbId()] = seg
+                self.contentToSegDbs.setdefault(db.getSegmentContentId(), []).append(db)
+                self.hostToSegDbs.setdefault(db.getSegmentHostName(), []).append(db)
+                self.roleToSegDbs.setdefault(db.getSegmentRole(), []).append(db)
+                self.preferredRoleToSegDbs.setdefault(db.getSegmentPreferredRole(), []).append(db)
+                self.statusToSegDbs.setdefault(db.getSegmentStatus(), []).append(db)
+                key = (db.getSegmentHostName(), db.getSegmentPreferredRole())
+                self.hostAndPreferredRoleToSegDbs.setdefault(key, []).append(db)
+
+        # master and standby first, even if they share a host
+        self.hostList = [gparray.master.getSegmentHostName()]
+        if gparray.standbyMaster:
+            self.hostList.append(gparray.standbyMaster.getSegmentHostName())
+        self.hosts = set(self.hostList)
+        for db in self.segDbs:
+            if db.getSegmentHostName() not in self.hosts:
+                self.hosts.add(db.getSegmentHostName())
+                self.hostList.append(db.getSegmentHostName())
+
+    # --------------------------------------------------------------------
+    def isCurrent(self, gparray):
+        return (self.version is _configurationVersion and
+                self.segments is gparray.segments and
+                self.numSegments == len(gparray.segments) and
+                self.master is gparray.master and
+                self.standbyMaster is gparray.standbyMaster)
+
+    # --------------------------------------------------------------------
+    def getDbIdToPeerMap(self):
+        if self.__dbIdToPeer is None:
+            result = {}
+            for contentId, arr in self.contentToSegDbs.iteritems():
+                if len(arr) == 1:
+                    pass
+                elif len(arr) != 2:
+                    raise Exception("Content %s has more than two segments"% contentId)
+                else:
+                    result[arr[0].getSegmentDbId()] = arr[1]
+                    result[arr[1].getSegmentDbId()] = arr[0]
+            self.__dbIdToPeer = result
+        return self.__dbIdToPeer
+
+
 # ============================================================================
 class GpArray:
     """ 
@@ -1199,6 +1295,8 @@ class GpArray:
         self.san_mount_by_dbid = {}
         self.san_mounts = {}
 
+        self.__index = None
+
         self.setFilespaces([])
 
         for segdb in segments:
@@ -1249,6 +1347,17 @@ class GpArray:
         else:
             seg.addMirror(segdb)
 
+    # --------------------------------------------------------------------
+    def getIndex(self):
+        """
+        Returns the GpArrayIndex of the array, rebuilding it if the segments
+        were changed since it was built.  Changes must go through the GpDB
+        setters or addSegmentDb() to be noticed.
+        """
+        if self.__index is None or not self.__index.isCurrent(self):
+            self.__index = GpArrayIndex(self)
+        return self.__index
+
     # --------------------------------------------------------------------
     def isStandardArray(self):
         """
@@ -1332,15 +1441,42 @@ class GpArray:
     def initFromCatalog(dbURL, utility=False):
         """
         Factory method, initializes a GpArray from provided database URL
+
+        The catalog rows are kept in a snapshot under the master data
+        directory and reused while the configuration marker of the
+        catalog still matches; see readConfigurationSnapshot.
         """
 
         conn = dbconn.connect(dbURL, utility)
+        try:
+            # Get the version from the database:
+            version_str = None
+            for row in dbconn.execSQL(conn, "SELECT version()"):
+                version_str = row[0]
+            version = GpVersion(version_str)
+
+            if (version.getVersionRelease() in ("3.0", "3.1", "3.2", "3.3") or
+                getConfigurationSnapshotFile() is None):
+                rows = GpArray.__fetchCatalogRows(conn, version)
+            else:
+                marker = (dbURL.pghost, dbURL.pgport, version_str,
+                          dbconn.execSQLForSingleton(conn, CONFIGURATION_MARKER_SQL))
+                rows = readConfigurationSnapshot(marker)
+                if rows is None:
+                    rows = GpArray.__fetchCatalogRows(conn, version)
+                    writeConfigurationSnapshot(marker, rows)
+        finally:
+            conn.close()
 
-        # Get the version from the database:
-        version_str = None
-        for row in dbconn.execSQL(conn, "SELECT version()"):
-            version_str = row[0]
-        version = GpVersion(version_str)
+        return GpArray.__initFromCatalogRows(version, rows)
+
+    # --------------------------------------------------------------------
+    @staticmethod
+    def __fetchCatalogRows(conn, version):
+        """
+        Returns the catalog rows a GpArray is built from, as a dictionary
+        of lists of tuples
+        """
 
         if version.getVersionRelease() in ("3.0", "3.1", "3.2", "3.3"):
 
@@ -1379,7 +1515,7 @@ class GpArray:
             san_rows = []
 
             # no filespace support in older releases.
-            filespaceArr = []
+            filespaceRows = []
 
         else:
 
@@ -1417,18 +1553,41 @@ class GpArray:
                 FROM pg_filespace
                 ORDER BY fsname;
             ''')
-            filespaceArr = [GpFilespaceObj(fsRow[0], fsRow[1]) for fsRow in filespaceRows]
 
+        # The catalog directories of the databases are derived from the
+        # filespace locations in config_rows
+        database_rows = dbconn.execSQL(conn, '''
+            SELECT db.oid, db.dattablespace, ts.spcfsoid
+            FROM pg_database db
+            JOIN pg_tablespace ts on (db.dattablespace = ts.oid)
+            ORDER BY db.oid
+        ''')
+
+        return {'strategy': [tuple(row) for row in strategy_rows],
+                'config': [tuple(row) for row in config_rows],
+                'san_segs': [tuple(row) for row in san_segs_rows],
+                'san': [tuple(row) for row in san_rows],
+                'filespaces': [tuple(row) for row in filespaceRows],
+                'databases': [tuple(row) for row in database_rows]}
+
+    # --------------------------------------------------------------------
+    @staticmethod
+    def __initFromCatalogRows(version, rows):
+        """
+        Builds the GpArray from the rows returned by __fetchCatalogRows
+        """
 
         # Todo: add checks that all segments should have the same filespaces?
         recoveredSegmentDbids = []
         segments = []
         seg = None
-        for row in config_rows:
+        locations = {}
+        for row in rows['config']:
 
             # Extract fields from the row
             (dbid, content, role, preferred_role, mode, status, hostname, 
              address, port, replicationPort, fsoid, fslocation) = row
+            locations[(dbid, fsoid)] = fslocation
 
             # If we have segments which have recovered, record them.
             if preferred_role != role and content >= 0:
@@ -1445,44 +1604,29 @@ class GpArray:
                 seg = GpDB(content, preferred_role, dbid, role, mode, status, 
                            hostname, address, port, fslocation, replicationPort)
                 segments.append(seg)
-        
-        datcatloc = dbconn.execSQL(conn, '''
-            select fsloc.dbid, fsloc.fselocation || '/' ||
-                   case when db.dattablespace = 1663
-                      then 'base'
-                      else db.dattablespace::text
-                   end || '/'||db.oid as catloc
-            from pg_Database db, pg_tablespace ts,
-                 (SELECT dbid, fs.oid, fselocation
-                  FROM pg_catalog.gp_segment_configuration
-                  JOIN pg_catalog.pg_filespace_entry on (dbid = fsedbid)
-                  JOIN pg_catalog.pg_filespace fs on (fsefsoid = fs.oid)) fsloc
-                  where db.dattablespace = ts.oid
-                  and ts.spcfsoid = fsloc.oid''')
-        conn.close()
-        catlocmap = {}
-        for row in datcatloc:
-            if catlocmap.has_key(row[0]):
-                catlocmap[row[0]].append(row[1])
-            else:
-                catlocmap[row[0]] = [row[1]]
+
         for seg in segments:
-            seg.catdirs = catlocmap[seg.dbid]
+            seg.catdirs = []
+            for (dboid, tablespace, fsoid) in rows['databases']:
+                location = locations.get((seg.dbid, fsoid))
+                if location is not None:
+                    seg.catdirs.append('%s/%s/%s' % (location, 'base' if tablespace == 1663 else tablespace, dboid))
 
         origSegments = [seg.copy() for seg in segments]
         
-        if strategy_rows.rowcount == 0:
+        strategy_rows = rows['strategy']
+        if len(strategy_rows) == 0:
             raise Exception("Database does not contain gp_fault_strategy entry")
-        if strategy_rows.rowcount > 1:
+        if len(strategy_rows) > 1:
             raise Exception("Database does too many gp_fault_strategy entries")
-        strategy = strategy_rows.fetchone()[0]
+        strategy = strategy_rows[0][0]
 
         array = GpArray(segments, origSegments, strategy)
         array.__version = version
         array.recoveredSegmentDbids = recoveredSegmentDbids
         array.setFaultStrategy(strategy)
-        array.setSanConfig(san_rows, san_segs_rows)
-        array.setFilespaces(filespaceArr)
+        array.setSanConfig(rows['san'], rows['san_segs'])
+        array.setFilespaces([GpFilespaceObj(fsRow[0], fsRow[1]) for fsRow in rows['filespaces']])
         
         return array
 
@@ -1674,17 +1818,14 @@ class GpArray:
         """
         Return a list of all Hosts that make up the array
         """
-        hostList = []
-        hostList.append(self.master.getSegmentHostName())
-        if self.standbyMaster:
-            hostList.append(self.standbyMaster.getSegmentHostName())
-            
-        dbList = self.getDbList(includeExpansionSegs = includeExpansionSegs)
-        for db in dbList:
-            if db.getSegmentHostName() in hostList:
-                continue
-            else:
-                hostList.append(db.getSegmentHostName())
+        index = self.getIndex()
+        hostList = list(index.hostList)
+        if includeExpansionSegs:
+            hosts = set(index.hosts)
+            for db in self.getExpansionSegDbList():
+                if db.getSegmentHostName() not in hosts:
+                    hosts.add(db.getSegmentHostName())
+                    hostList.append(db.getSegmentHostName())
         return hostList
            
 
@@ -1692,35 +1833,22 @@ class GpArray:
         """
         Returns a map that maps a dbid to the peer segment for that dbid
         """
-        contentIdToSegments = {}
-        for seg in self.getSegDbList():
-            arr = contentIdToSegments.get(seg.getSegmentContentId())
-            if arr is None:
-                arr = []
-                contentIdToSegments[seg.getSegmentContentId()] = arr
-            arr.append(seg)
+        return dict(self.getIndex().getDbIdToPeerMap())
 
-        result = {}
-        for contentId, arr in contentIdToSegments.iteritems():
-            if len(arr) == 1:
-                pass
-            elif len(arr) != 2:
-                raise Exception("Content %s has more than two segments"% contentId)
-            else:
-                result[arr[0].getSegmentDbId()] = arr[1]
-                result[arr[1].getSegmentDbId()] = arr[0]
-        return result
+    # --------------------------------------------------------------------
+    def getSegDbPeer(self, db):
+        """
+        Returns the peer segment of db, or None if it has none
+        """
+        return self.getIndex().getDbIdToPeerMap().get(db.getSegmentDbId())
 
 
     # --------------------------------------------------------------------    
     def getSegDbList(self, includeExpansionSegs=False):
         """Return a list of all GpDb objects for all segments in the array"""
-        dbs=[]
-        for seg in self.segments:
-            dbs.extend(seg.get_dbs())
+        dbs = list(self.getIndex().segDbs)
         if includeExpansionSegs:
-            for seg in self.expansionSegments:
-                dbs.extend(seg.get_dbs()) 
+            dbs.extend(self.getExpansionSegDbList())
         return dbs
 
 
@@ -1729,10 +1857,44 @@ class GpArray:
         """
         Return a map of all GpDb objects that make up the array.
         """
-        dbsMap = {}
-        for db in self.getSegDbList():
-            dbsMap[db.getSegmentDbId()] = db
-        return dbsMap
+        return dict(self.getIndex().dbIdToSegDb)
+
+    # --------------------------------------------------------------------
+    def getSegDbByDbId(self, dbid):
+        """
+        Returns the segment GpDB with the given dbid, or None
+        """
+        return self.getIndex().dbIdToSegDb.get(dbid)
+
+    # --------------------------------------------------------------------
+    def getSegDbsByContentId(self, content):
+        """
+        Returns the segment GpDBs with the given content id
+        """
+        return list(self.getIndex().contentToSegDbs.get(content, []))
+
+    # --------------------------------------------------------------------
+    def getSegDbsByHostName(self, hostname):
+        """
+        Returns the segment GpDBs on the given host
+        """
+        return list(self.getIndex().hostToSegDbs.get(hostname, []))
+
+    # --------------------------------------------------------------------
+    def getSegDbsByRole(self, role, current_role=True):
+        """
+        Returns the segment GpDBs with the given current (or preferred) role
+        """
+        index = self.getIndex()
+        roleToSegDbs = index.roleToSegDbs if current_role else index.preferredRoleToSegDbs
+        return list(roleToSegDbs.get(role, []))
+
+    # --------------------------------------------------------------------
+    def getSegDbsByStatus(self, status):
+        """
+        Returns the segment GpDBs with the given status
+        """
+        return list(self.getIndex().statusToSegDbs.get(status, []))
 
     # --------------------------------------------------------------------
     def getExpansionSegDbList(self):
@@ -1745,11 +1907,7 @@ class GpArray:
 
     # --------------------------------------------------------------------    
     def getSegmentContainingDb(self, db):
-        for seg in self.segments:
-            for segDb in seg.get_dbs():
-                if db.getSegmentDbId() == segDb.getSegmentDbId():
-                    return seg
-        return None
+        return self.getIndex().dbIdToSegment.get(db.getSegmentDbId())
 
     # --------------------------------------------------------------------    
     def getExpansionSegmentContainingDb(self, db):
@@ -2004,21 +2162,11 @@ class GpArray:
 
     # --------------------------------------------------------------------
     def get_list_of_primary_segments_on_host(self, hostname):
-        retValue = []
-        
-        for db in self.getDbList():
-            if db.isSegmentPrimary(False) == True and db.getSegmentHostName() == hostname:
-                retValue.append(db)
-        return retValue
+        return list(self.getIndex().hostAndPreferredRoleToSegDbs.get((hostname, ROLE_PRIMARY), []))
 
     # --------------------------------------------------------------------
     def get_list_of_mirror_segments_on_host(self, hostname):
-        retValue = []
-        
-        for db in self.getDbList():
-            if db.isSegmentMirror(False) == True and db.getSegmentHostName() == hostname:
-                retValue.append(db)
-        return retValue
+        return list(self.getIndex().hostAndPreferredRoleToSegDbs.get((hostname, ROLE_MIRROR), []))
                
     # --------------------------------------------------------------------
     def get_primary_root_datadirs(self):
@@ -2543,6 +2691,110 @@ class GpArray:
         self.__strategyLoadedFromDb = strategy
 
 
+# ============================================================================
+# Configuration snapshot
+#
+# GpArray.initFromCatalog keeps the catalog rows it builds the array from in
+# a snapshot under the master data directory, along with the marker of the
+# configuration they were read with.  The marker is a checksum the master
+# computes over all those catalog rows, so a snapshot is used only while it
+# is identical to what the catalog would return.  Setting
+# GP_GPARRAY_SNAPSHOT=0 in the environment disables the snapshot.
+# ============================================================================
+
+CONFIGURATION_SNAPSHOT_FILE = 'gparray.snapshot'
+CONFIGURATION_SNAPSHOT_FORMAT = 1
+
+CONFIGURATION_MARKER_SQL = '''
+    SELECT md5(array_to_string(ARRAY(
+        SELECT 'c' || textin(record_out(c)) FROM pg_catalog.gp_segment_configuration c
+        UNION ALL
+        SELECT 'e' || textin(record_out(e)) FROM pg_catalog.pg_filespace_entry e
+        UNION ALL
+        SELECT 'f' || textin(oidout(f.oid)) || ' ' || textin(record_out(f)) FROM pg_catalog.pg_filespace f
+        UNION ALL
+        SELECT 'd' || textin(oidout(d.oid)) || ' ' || textin(oidout(d.dattablespace)) FROM pg_catalog.pg_database d
+        UNION ALL
+        SELECT 't' || textin(oidout(t.oid)) || ' ' || textin(oidout(t.spcfsoid)) FROM pg_catalog.pg_tablespace t
+        UNION ALL
+        SELECT 's' || textin(record_out(s)) FROM pg_catalog.gp_fault_strategy s
+        UNION ALL
+        SELECT 'm' || textin(record_out(m)) FROM pg_catalog.gp_san_configuration m
+        ORDER BY 1), ';'))
+'''
+
+# (marker, rows) of the last snapshot read or written by this process
+_configurationSnapshot = None
+
+def getConfigurationSnapshotFile():
+    """
+    Returns the path of the configuration snapshot, or None if the snapshot
+    is disabled or MASTER_DATA_DIRECTORY is not set
+    """
+    if os.environ.get('GP_GPARRAY_SNAPSHOT') == '0':
+        return None
+    master_datadir = os.environ.get('MASTER_DATA_DIRECTORY')
+    if not master_datadir:
+        return None
+    return os.path.join(master_datadir, CONFIGURATION_SNAPSHOT_FILE)
+
+def readConfigurationSnapshot(marker):
+    """
+    Returns the catalog rows of the configuration snapshot if it was taken
+    with the given marker, otherwise None
+    """
+    global _configurationSnapshot
+    path = getConfigurationSnapshotFile()
+    if path is None:
+        return None
+    if _configurationSnapshot is not None and _configurationSnapshot[0] == marker:
+        return _configurationSnapshot[1]
+    try:
+        f = open(path, 'rb')
+        try:
+            snapshot = pickle.load(f)
+        finally:
+            f.close()
+    except IOError:
+        return None
+    except Exception, e:
+        logger.debug('Ignoring unreadable configuration snapshot %s: %s' % (path, e))
+        return None
+    if snapshot.get('format') != CONFIGURATION_SNAPSHOT_FORMAT or snapshot.get('marker') != marker:
+        logger.debug('Configuration snapshot %s is out of date' % path)
+        return None
+    logger.debug('Using configuration snapshot %s' % path)
+    _configurationSnapshot = (marker, snapshot['rows'])
+    return snapshot['rows']
+
+def writeConfigurationSnapshot(marker, rows):
+    """
+    Replaces the configuration snapshot.  Failing to write it, e.g. when the
+    master data directory is not writable, is not an error.
+    """
+    global _configurationSnapshot
+    path = getConfigurationSnapshotFile()
+    if path is None:
+        return
+    _configurationSnapshot = (marker, rows)
+    tmp = '%s.%d' % (path, os.getpid())
+    try:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        f = os.fdopen(fd, 'wb')
+        try:
+            pickle.dump({'format': CONFIGURATION_SNAPSHOT_FORMAT, 'marker': marker, 'rows': rows},
+                        f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(tmp, path)
+    except Exception, e:
+        logger.debug('Could not write configuration snapshot %s: %s' % (path, e))
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
 def get_segment_hosts(master_port):
     """
     """
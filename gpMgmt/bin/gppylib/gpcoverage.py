@@ -5,15 +5,18 @@ needed.  It also includes a method for generating the HTML reports.
 
 import os
 import random
-import figleaf
 import pickle
 from glob import glob
 from gppylib import gplog
+from gppylib.gpimport import lazy_import
 from gppylib.commands.base import Command, LOCAL, REMOTE, ExecutionContext, RemoteExecutionContext, WorkerPool
 from gppylib.commands.unix import RemoveFiles, Scp
 from gppylib.operations import Operation
 from gppylib.operations.unix import ListFiles, ListRemoteFiles, MakeDir
 
+# Only needed when coverage is enabled; see gppylib.gpimport
+figleaf = lazy_import('figleaf')
+
 logger = gplog.get_default_logger()
 COVERAGE_FILENAME = 'cover.out'
 
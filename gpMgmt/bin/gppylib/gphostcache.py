@@ -13,19 +13,32 @@ example:  sdw1-1, sdw1-2, sdw1-3, and sdw1-4 are all located
           on sdw1.
           
 The results of this collapsing will be stored in a file: 
-~/.gphostcache with entries of the form:
+~/.gphostcache with entries of the form interface:hostname:time,
+where time is when the interface was looked up:
 
-sdw1-1:sdw1
-sdw1-2:sdw1
-sdw1-3:sdw1
+sdw1-1:sdw1:1476748800
+sdw1-2:sdw1:1476748800
+sdw1-3:sdw1:1476748800
+
+Entries expire after HOSTCACHE_TTL seconds.  An interface that could not
+be resolved is recorded with an empty hostname and is not looked up again
+for HOSTCACHE_NEGATIVE_TTL seconds.  Entries without a time, as written
+by older releases, are as old as the file.
 
 A big complication here is that we want to group all of the 
 segment databases for sdw1-1 thru sdw1-4 together but we can't
 use the name returned by `hostname` as its not guaranteed to
 have a trusted ssh environment setup for it.  
 
+Before running `hostname` over ssh, an interface is resolved locally:
+an address of this host is on this host, and an interface with the same
+address as a known hostname, or whose address maps back to one, is on
+that host.
 '''
+import fcntl
 import os
+import socket
+import time
 
 from gppylib import gparray
 from gppylib.commands import base
@@ -36,8 +49,150 @@ FILEDIR=os.path.expanduser("~")
 FILENAME=".gphostcache"
 CACHEFILE=FILEDIR + "/" + FILENAME
 
+HOSTCACHE_TTL = 7 * 24 * 60 * 60        # seconds an interface lookup is valid
+HOSTCACHE_NEGATIVE_TTL = 10 * 60        # seconds a failed lookup is not retried
+
 logger = gplog.get_default_logger()
 
+
+def readHostCacheFile():
+    """
+    Returns the entries of the hostcache file as a dictionary
+    interface -> (hostname, time looked up), with None as the hostname of
+    interfaces which could not be resolved.  Expired entries are left out.
+    """
+    entries = {}
+    if not os.path.isfile(CACHEFILE):
+        return entries
+
+    try:
+        now = time.time()
+        mtime = os.path.getmtime(CACHEFILE)
+        for line in readAllLinesFromFile(CACHEFILE, stripLines=True, skipEmptyLines=True):
+            if line[0] == '#': # okay check because empty lines are skipped
+                continue
+
+            arr = line.rsplit(':', 2)
+            if len(arr) == 3 and arr[2].isdigit():
+                (interface, hostname, stamp) = (arr[0].strip(), arr[1].strip() or None, int(arr[2]))
+            else:
+                arr = line.split(':')
+                if len(arr) != 2 or len(arr[1].strip()) == 0:
+                    continue
+                (interface, hostname, stamp) = (arr[0].strip(), arr[1].strip(), mtime)
+            if len(interface) == 0:
+                continue
+
+            ttl = HOSTCACHE_TTL if hostname else HOSTCACHE_NEGATIVE_TTL
+            if now - stamp < ttl:
+                entries[interface] = (hostname, stamp)
+    except Exception, e:
+        logger.warn("Error reading file '%s': %s" % (CACHEFILE, str(e)))
+    return entries
+
+
+def updateHostCacheFile(updates):
+    """
+    Merges updates, a dictionary interface -> (hostname, time looked up),
+    into the hostcache file.  The file is locked while it is read and
+    replaced, so tools looking up interfaces at the same time don't lose
+    each other's entries, and readers only ever see a complete file.
+    """
+    lockfd = None
+    tmpfile = "%s.%d" % (CACHEFILE, os.getpid())
+    try:
+        lockfd = os.open(CACHEFILE + ".lock", os.O_WRONLY | os.O_CREAT, 0600)
+        fcntl.flock(lockfd, fcntl.LOCK_EX)
+
+        entries = readHostCacheFile()
+        entries.update(updates)
+
+        fp = open(tmpfile, 'w')
+        try:
+            for interface in sorted(entries.keys()):
+                (hostname, stamp) = entries[interface]
+                fp.write("%s:%s:%d\n" % (interface, hostname or '', stamp))
+        finally:
+            fp.close()
+        os.rename(tmpfile, CACHEFILE)
+    except Exception, e:
+        logger.warn(str(e))
+        logger.warn("Failed to write file '%s'" % CACHEFILE)
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+    finally:
+        if lockfd is not None:
+            os.close(lockfd)
+
+
+def isLocalAddress(address):
+    """
+    Returns True if address is an address of this host
+    """
+    try:
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            sock.bind((address, 0))
+        finally:
+            sock.close()
+        return True
+    except socket.error:
+        return False
+
+
+class LocalHostNameResolver:
+    """
+    Tells the hostname of an interface from name resolution alone, when it
+    can be trusted to be what `hostname` would return on that interface.
+    """
+
+    def __init__(self, knownHostNames):
+        self.knownHostNames = set(knownHostNames)
+        self.__addressToHostName = None
+
+    def __getAddresses(self, name):
+        try:
+            return set(info[4][0] for info in socket.getaddrinfo(name, None))
+        except socket.error:
+            return set()
+
+    def __getAddressToHostName(self):
+        if self.__addressToHostName is None:
+            self.__addressToHostName = {}
+            for hostname in self.knownHostNames:
+                for address in self.__getAddresses(hostname):
+                    self.__addressToHostName.setdefault(address, hostname)
+        return self.__addressToHostName
+
+    def resolve(self, interface):
+        """
+        Returns the hostname of interface, or None if it needs to be asked
+        """
+        addresses = self.__getAddresses(interface)
+        if len(addresses) == 0:
+            return None
+
+        for address in addresses:
+            if isLocalAddress(address):
+                return socket.gethostname()
+
+        for address in addresses:
+            try:
+                (name, aliases, ips) = socket.gethostbyaddr(address)
+            except socket.error:
+                continue
+            for name in [name] + aliases:
+                if name in self.knownHostNames:
+                    return name
+
+        addressToHostName = self.__getAddressToHostName()
+        for address in addresses:
+            if address in addressToHostName:
+                return addressToHostName[address]
+        return None
+
+
 class GpHost:
     def __init__(self, hostname):
         self.hostname = hostname
@@ -58,18 +213,12 @@ class GpInterfaceToHostNameCache:
         self.__hostCache={}         # interface -> hostname
 
         # Read the .gphostcache file if it exists
-        if os.path.isfile(CACHEFILE):
-            try:
-                for line in readAllLinesFromFile(CACHEFILE, stripLines=True, skipEmptyLines=True):
-                    if line[0] == '#': # okay check because empty lines are skipped
-                        continue
-
-                    arr = line.split(':')
-                    if len(arr) == 2 and len(arr[0]) > 0 and len(arr[1]) > 0:
-                        (interface, hostname) = arr
-                        self.__hostCache[interface.strip()]=hostname.strip()
-            except Exception, e:
-                logger.warn("Error reading file '%s': %s" % (CACHEFILE, str(e)))
+        unresolvable = set()
+        for (interface, (hostname, stamp)) in readHostCacheFile().iteritems():
+            if hostname is None:
+                unresolvable.add(interface)
+            else:
+                self.__hostCache[interface] = hostname
 
         #
         # check to see which values are inconsistent with the cache and need lookup again
@@ -100,14 +249,29 @@ class GpInterfaceToHostNameCache:
         for i in inconsistent:
             self.__hostCache[i] = None
 
-        # Lookup any hostnames that we don't have answers for:
+        # Lookup any hostnames that we don't have answers for, locally if
+        # possible and otherwise by asking the host:
+        updates={}                  # interface -> (hostname, time looked up)
+        resolver = LocalHostNameResolver([h for h in self.__hostCache.values() if h])
         pending_cmds={}
         for interface in self.__hostCache:
-            if self.__hostCache[interface] is None:
-                logger.debug("hostname lookup for %s" % interface)
-                cmd=unix.Hostname('host lookup', ctxt=base.REMOTE, remoteHost=interface)
-                pool.addCommand(cmd)
-                pending_cmds[interface] = cmd
+            if self.__hostCache[interface] is not None:
+                continue
+            if interface in unresolvable:
+                logger.warn("Failed to resolve hostname for %s recently, not retrying" % interface)
+                continue
+
+            hostname = resolver.resolve(interface)
+            if hostname is not None:
+                logger.debug("hostname for %s resolved locally: %s" % (interface, hostname))
+                self.__hostCache[interface] = hostname
+                updates[interface] = (hostname, time.time())
+                continue
+
+            logger.debug("hostname lookup for %s" % interface)
+            cmd=unix.Hostname('host lookup', ctxt=base.REMOTE, remoteHost=interface)
+            pool.addCommand(cmd)
+            pending_cmds[interface] = cmd
 
         # Fetch the results out of the WorkerPool
         if len(pending_cmds) > 0:
@@ -119,29 +283,23 @@ class GpInterfaceToHostNameCache:
                 # Make sure the command completed successfully
                 if cmd.get_results().rc != 0:
                     logger.warn("Failed to resolve hostname for %s" % interface)
+                    updates[interface] = (None, time.time())
                     continue
 
                 self.__hostCache[interface] = cmd.get_hostname()
+                updates[interface] = (self.__hostCache[interface], time.time())
 
             pool.empty_completed_items()
 
-        # Try to update the hostcache file if we executed any hostname commands
-        if len(pending_cmds) > 0:
-            try:
-                fp = open(CACHEFILE, 'w')
-
-                for interface in sorted(self.__hostCache.keys()):
-                    hostname = self.__hostCache[interface]
-
-                    # skip any dangling references we still have
-                    if not hostname:
-                        continue
-                    fp.write("%s:%s\n" % (interface, hostname))
-
-                fp.close()
-            except Exception, e:
-                logger.warn(str(e))
-                logger.warn("Failed to write file '%s'" % CACHEFILE)
+        # Try to update the hostcache file if we looked up any interfaces,
+        # along with the answers we were given for the other interfaces
+        if len(updates) > 0:
+            for i in range(len(interfacesToLookup)):
+                interface = interfacesToLookup[i]
+                hostname = currentHostNameAnswersForInterfaces[i]
+                if hostname is not None and interface not in updates:
+                    updates[interface] = (hostname, time.time())
+            updateHostCacheFile(updates)
 
 
     #
@@ -262,50 +420,58 @@ class GpHostCache:
         
         pool.join()
         cmds=pool.getCompletedItems()
+        pool.empty_completed_items()
 
+        # Look for commands that failed to ping
+        failed_hosts=[]
         for cmd in cmds:
-            # Look for commands that failed to ping
-            if not cmd.was_successful() != 0:
+            if not cmd.was_successful():
                 hostname=cmd.hostToPing
                 logger.warning("Ping to host: '%s' FAILED" % hostname)
                 logger.debug("  ping details: %s" % cmd)
+                failed_hosts.append(hostname)
+
+        # Ping the interfaces of all the segments on the failed hosts at once
+        alternate_cmds={}           # address -> Ping
+        for hostname in failed_hosts:
+            for db in self.get_host(hostname).dbs:
+                address = db.getSegmentAddress()
+                if address not in alternate_cmds:
+                    alternate_cmds[address] = unix.Ping("dbid: %d" % db.getSegmentDbId(), address)
+                    pool.addCommand(alternate_cmds[address])
+
+        if len(alternate_cmds) > 0:
+            pool.join()
+            pool.empty_completed_items()
+
+        for hostname in failed_hosts:
+            gphost=self.get_host(hostname)
+            dblist=gphost.dbs
                 
-                gphost=self.get_host(hostname)
-                dblist=gphost.dbs
-                
-                alternateHost=None
-                
-                for db in dblist:
-                    dbid = db.getSegmentDbId()
-                    address = db.getSegmentAddress()
-
-                    # It would be nice to handle these through a pool,
-                    # but it is both a little difficult and not the
-                    # expected case.
-                    pingCmd = unix.Ping("dbid: %d" % dbid, address)
-                    pingCmd.run()
-                    if pingCmd.get_results().rc == 0:
-                        alternateHost=address
-                        logger.warning("alternate host: '%s' => '%s'" % 
-                                       (hostname, address))
-                        break
-                    else:
-                        logger.warning("Ping to host: '%s' FAILED" % hostname)
-                        logger.debug("  ping details: %s" % pingCmd)
+            alternateHost=None
                 
-                if alternateHost:
-                    gphost.hostname=alternateHost                    
+            for db in dblist:
+                pingCmd = alternate_cmds[db.getSegmentAddress()]
+                if pingCmd.get_results().rc == 0:
+                    alternateHost=db.getSegmentAddress()
+                    logger.warning("alternate host: '%s' => '%s'" % 
+                                   (hostname, alternateHost))
+                    break
                 else:
-                    # no interface to reach any of the segments, append all
-                    # segments to the list of failed segments
-                    failed_segs.extend(dblist)
-
-                    # Removing the failed host from the cache.
-                    #
-                    # This seems a bit draconian, but that is what all callers
-                    # of this function seem to want.
-                    del self.gphost_map[hostname]
+                    logger.warning("Ping to host: '%s' FAILED" % hostname)
+                    logger.debug("  ping details: %s" % pingCmd)
+                
+            if alternateHost:
+                gphost.hostname=alternateHost                    
+            else:
+                # no interface to reach any of the segments, append all
+                # segments to the list of failed segments
+                failed_segs.extend(dblist)
+
+                # Removing the failed host from the cache.
+                #
+                # This seems a bit draconian, but that is what all callers
+                # of this function seem to want.
+                del self.gphost_map[hostname]
 
-        pool.empty_completed_items()
-        
         return failed_segs
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#
+# Copyright (c) Greenplum Inc 2008. All Rights Reserved.
+#
+"""
+Import helpers to keep the startup of the management utilities cheap.
+
+lazy_import() returns a stand-in for a module that is imported only when
+one of its attributes is first used, so rarely used subsystems (paramiko,
+yaml, psutil, the catalog access layer...) are not paid for by every tool:
+
+    paramiko = lazy_import('paramiko')
+
+With GP_IMPORT_PROFILE set in the environment, gppylib installs an
+ImportProfiler as soon as it is imported, which reports the time spent
+importing every module on stderr when the program exits:
+
+    GP_IMPORT_PROFILE=1 gpstate -s
+"""
+
+import __builtin__
+import sys
+import time
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for the module of the same name until one of its attributes
+    is used.  Setting or deleting attributes (e.g. mock.patch) also goes to
+    the real module.
+    """
+
+    def __init__(self, name):
+        types.ModuleType.__init__(self, name)
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            __import__(self.__name__)
+            module = sys.modules[self.__name__]
+            self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._load(), name)
+
+    def __repr__(self):
+        return "<lazy module '%s'>" % self.__name__
+
+
+def lazy_import(name):
+    """
+    Returns the module name if it is already imported, otherwise a
+    LazyModule importing it on first use.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+class ImportProfiler(object):
+    """
+    Times every module import done through __import__.  The report lists the
+    modules in import order, nested under the module importing them, with the
+    time spent in the module itself and in total including the modules it
+    imported, in the format of python 3's -X importtime.
+    """
+
+    def __init__(self, out=None):
+        self.out = out or sys.stderr
+        self.records = []   # [name, depth, self seconds, cumulative seconds]
+        self.depth = 0
+        self.children = [0.0]
+        self.original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=None, level=-1):
+        loaded = len(sys.modules)
+        label = name
+        if fromlist:
+            label = '%s (%s)' % (name or '.', ', '.join(fromlist))
+        record = [label, self.depth, 0.0, 0.0]
+        index = len(self.records)
+        self.records.append(record)
+        self.depth += 1
+        self.children.append(0.0)
+        start = time.time()
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.time() - start
+            self.depth -= 1
+            children = self.children.pop()
+            if len(sys.modules) == loaded:
+                # nothing was imported, just a lookup; its nested records
+                # are empty lookups as well
+                del self.records[index:]
+            else:
+                record[2] = elapsed - children
+                record[3] = elapsed
+                self.children[-1] += elapsed
+
+    def install(self):
+        self.original_import = __builtin__.__import__
+        __builtin__.__import__ = self._import
+
+    def uninstall(self):
+        if self.original_import is not None:
+            __builtin__.__import__ = self.original_import
+            self.original_import = None
+
+    def report(self):
+        self.out.write('import time: self [us] | cumulative | imported package\n')
+        for (name, depth, self_time, cumulative) in self.records:
+            self.out.write('import time: %9d | %10d | %s%s\n'
+                           % (self_time * 1e6, cumulative * 1e6, '  ' * depth, name))
+        self.out.flush()
+
+
+def profile_imports():
+    """
+    Installs an ImportProfiler reporting when the program exits.
+    """
+    import atexit
+    profiler = ImportProfiler()
+    profiler.install()
+    atexit.register(profiler.report)
+    return profiler
@@ -124,6 +124,9 @@ class OptChecker(Option):
     def filterAction(self, dest, opt, value, values, parser, Filter, *args):
         filterlist = values.ensure_value(dest, [])
         filterlist.append(filterize(Filter, value, *args))
+        # Keep the filters' arguments, so they can be passed on to
+        # another process (e.g. gplogfilter --cluster)
+        values.ensure_value(dest + '_args', []).append((Filter, value))
     
     def brief_help(self, dest, opt, value, values, parser, Filter, *args):
         OptionParser.print_help(parser,None)
@@ -19,6 +19,7 @@ Module contents:
     GroupByTimestamp() - group lines with same timestamp
     Ungroup() - decompose groups into lines
     EnumerateUngroup() - number the groups and decompose into lines
+    MergeByTimestamp() - merge streams of groups in timestamp order
 
     ---- Pattern matching filters
     MatchRegex() - select lines or groups in which a regular expr is matched
@@ -26,6 +27,15 @@ Module contents:
     MatchInFirstLine() - select groups in which regex has a match in first line
     NoMatchInFirstLine() - select groups in which regex doesn't match in first line
 
+    ---- Seeking by timestamp
+    SeekTimestamp() - binary search a log file for a timestamp
+    SeekTimestampIndex() - skip to a timestamp using a timestamp index
+    ReadTimestampIndex() - read the timestamp index of a gzip log file
+    WriteTimestampIndex() - build the timestamp index of a gzip log file
+    StopAtTimestamp() - stop reading a log file after a timestamp
+    SeekTimestampRange() - position a log file for a begin/end interval
+    SplitLogFile() - split a log file into chunks where the timestamp changes
+
     ---- Slicing filters
     Slice() - select items in Pythonesque slice of stream[begin:end]
     FirstNItems() - select the first n items of a stream
@@ -42,7 +52,9 @@ Module contents:
     spiffInterval() - get begin/end datetime given any subset of begin/end/duration
 """
 
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+import heapq
+import os
 import re
 import sys
 import time
@@ -52,6 +64,22 @@ timestampPattern = re.compile(r'\d\d\d\d-\d\d-\d\d \d\d:\d\d:\d\d(\.\d*)?')
 # in a GPDB log file.  The timestamp format is: YYYY-MM-DD HH:MM:SS[.frac]
 # A timezone specifier may follow the timestamp, but we ignore that.
 
+# Log entries written by different processes are not strictly ordered by
+# timestamp.  Seeking by timestamp allows for entries this much out of order.
+SEEK_SLACK = timedelta(minutes=1)
+
+# The binary search stops once fewer bytes than this are left to search.
+SEEK_MIN_SPAN = 64 * 1024
+
+# Uncompressed bytes between two entries of a timestamp index.
+INDEX_INTERVAL = 16 * 1024 * 1024
+
+# Approximate size of the chunks a log file is split into by SplitLogFile.
+SPLIT_CHUNK_SIZE = 32 * 1024 * 1024
+
+TIMESTAMP_INDEX_SUFFIX = '.tsidx'
+TIMESTAMP_INDEX_HEADER = 'gplogfilter timestamp index 1'
+
 
 def FilterLogEntries(iterable,
                      msgfile=sys.stderr,
@@ -483,6 +511,35 @@ def EnumerateUngroup(iterable):
         i += 1
 
 
+def MergeByTimestamp(iterables):
+    """
+    Generator which merges several streams of groups, each in timestamp
+    order, into a single stream in timestamp order.  Yields pairs (i, g)
+    where g is a group taken from the i'th stream.  Groups having the same
+    timestamp are yielded in the order of the streams.
+
+    MergeByTimestamp(iterables) -> iterator
+        iterables -- a sequence of iterables, such as the iterators
+            returned by GroupByTimestamp().  Each item returned by their
+            next() method must be a group (a sequence of strings where the
+            timestamp, if any, is at the beginning of the first string).
+    """
+    def keyed(i, iterable):
+        n = 0
+        for group in iterable:
+            stamp = ''
+            if len(group) > 0:
+                tsmatch = timestampPattern.match(group[0])
+                if tsmatch:
+                    stamp = tsmatch.group(0)
+            yield stamp, i, n, group
+            n += 1
+
+    for stamp, i, n, group in heapq.merge(*[keyed(i, iterable)
+                                            for i, iterable in enumerate(iterables)]):
+        yield i, group
+
+
 #-------------------------------------------------------------------------
 
 def TimestampInBounds(iterable, begin, end):
@@ -561,6 +618,247 @@ def TimestampInBounds(iterable, begin, end):
         item = source.next()
 
 
+#--------------------------- Seeking by Timestamp ---------------------------
+
+def _seekStamp(dt):
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _nextTimestamp(fileIn, offset):
+    """
+    Return (timestamp, offset) of the first timestamped line starting at
+    or after the given byte offset, or (None, offset of end of file).
+    """
+    fileIn.seek(offset)
+    if offset > 0:
+        fileIn.readline()            # skip the rest of a partial line
+    while True:
+        pos = fileIn.tell()
+        line = fileIn.readline()
+        if not line:
+            return None, pos
+        tsmatch = timestampPattern.match(line)
+        if tsmatch:
+            return tsmatch.group(0), pos
+
+
+def _nextGroup(fileIn, offset):
+    """
+    Return the offset of the first line after the given byte offset which
+    starts a new group as GroupByTimestamp sees it: a timestamped line whose
+    timestamp differs from that of the timestamped line before it.  At the
+    end of the file, the offset of the end of the file is returned.
+    """
+    stamp, pos = _nextTimestamp(fileIn, offset)
+    if stamp is None:
+        return pos
+    fileIn.readline()
+    while True:
+        pos = fileIn.tell()
+        line = fileIn.readline()
+        if not line:
+            return pos
+        if not line.startswith(stamp) and timestampPattern.match(line):
+            return pos
+
+
+def SeekTimestamp(fileIn, begin):
+    """
+    Position an uncompressed GPDB log file at the start of a log entry at
+    or shortly before the first entry timestamped begin or later, using a
+    binary search over the byte offsets of the file.  Returns the offset.
+
+    SeekTimestamp(fileIn, begin) -> int
+        fileIn -- an open, seekable file.
+        begin -- a datetime.  The search is for begin minus SEEK_SLACK,
+            so that entries written slightly out of order are not missed.
+
+    The entries before the returned offset are all timestamped before
+    begin (give or take SEEK_SLACK); the caller still has to filter the
+    entries following it, e.g. with TimestampInBounds.
+    """
+    begin = _seekStamp(begin - SEEK_SLACK)
+    fileIn.seek(0, 2)
+    lo, hi = 0, fileIn.tell()
+    while hi - lo > SEEK_MIN_SPAN:
+        mid = (lo + hi) // 2
+        stamp, pos = _nextTimestamp(fileIn, mid)
+        if stamp is None or stamp >= begin or pos >= hi:
+            hi = mid
+        else:
+            lo = pos
+    fileIn.seek(lo)
+    return lo
+
+
+def TimestampIndexFilename(filename):
+    return filename + TIMESTAMP_INDEX_SUFFIX
+
+
+def ReadTimestampIndex(filename):
+    """
+    Return the timestamp index of a log file as a list of (timestamp, offset)
+    pairs, or None if there is no index or it was built for a different
+    version of the file.
+    """
+    try:
+        st = os.stat(filename)
+        with open(TimestampIndexFilename(filename)) as fd:
+            header = fd.readline().rstrip('\n').split('\t')
+            if header != [TIMESTAMP_INDEX_HEADER, str(st.st_size), str(int(st.st_mtime))]:
+                return None
+            index = []
+            for line in fd:
+                stamp, offset = line.rstrip('\n').split('\t')
+                index.append((stamp, int(offset)))
+            return index
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def WriteTimestampIndex(fileIn, filename):
+    """
+    Read a log file from its current position to the end and write its
+    timestamp index: the timestamp and uncompressed offset of a log entry
+    every INDEX_INTERVAL bytes.  Returns the index.  The index is not
+    written if its file cannot be created, e.g. in a read-only directory.
+
+    WriteTimestampIndex(fileIn, filename) -> list
+        fileIn -- an open file, e.g. a gzip.GzipFile, positioned at offset 0.
+        filename -- the name of the log file.
+    """
+    index = []
+    offset = 0
+    mark = 0
+    for line in fileIn:
+        if offset >= mark:
+            tsmatch = timestampPattern.match(line)
+            if tsmatch:
+                index.append((tsmatch.group(0), offset))
+                mark = offset + INDEX_INTERVAL
+        offset += len(line)
+
+    indexname = TimestampIndexFilename(filename)
+    tmpname = indexname + '.tmp'
+    try:
+        st = os.stat(filename)
+        with open(tmpname, 'w') as fd:
+            fd.write('%s\t%d\t%d\n' % (TIMESTAMP_INDEX_HEADER, st.st_size, int(st.st_mtime)))
+            for stamp, pos in index:
+                fd.write('%s\t%d\n' % (stamp, pos))
+        os.rename(tmpname, indexname)
+    except (IOError, OSError):
+        pass
+    return index
+
+
+def SeekTimestampIndex(fileIn, index, begin):
+    """
+    Skip a log file ahead to the last indexed log entry timestamped before
+    begin minus SEEK_SLACK.  Only reads forward, so it also works for
+    compressed files.  Returns the offset.
+    """
+    begin = _seekStamp(begin - SEEK_SLACK)
+    offset = 0
+    for stamp, pos in index:
+        if stamp >= begin:
+            break
+        offset = pos
+
+    remaining = offset
+    while remaining > 0:
+        data = fileIn.read(min(remaining, 1024 * 1024))
+        if not data:
+            break
+        remaining -= len(data)
+    return offset
+
+
+def StopAtTimestamp(iterable, end):
+    """
+    Generator to pass through the lines of a GPDB log file up to the first
+    line timestamped end plus SEEK_SLACK or later.
+    """
+    end = _seekStamp(end + SEEK_SLACK)
+    for line in iterable:
+        if line >= end and timestampPattern.match(line):
+            return
+        yield line
+
+
+def SeekTimestampRange(fileIn, filename, compressed, begin=None, end=None):
+    """
+    Position a GPDB log file for reading the log entries between begin and
+    end, and return an iterable over its lines which stops after end.
+    Log files are assumed to be written in timestamp order, give or take
+    SEEK_SLACK.
+
+    An uncompressed file is binary searched for begin.  For a compressed
+    file, a timestamp index is built the first time it is read with a
+    begin and reused afterwards.
+
+    SeekTimestampRange(fileIn, filename, compressed, begin, end) -> iterable
+        fileIn -- the open log file, a gzip.GzipFile if compressed.
+        filename -- the name of the log file.
+        compressed -- True if fileIn is a gzip.GzipFile.
+        begin, end -- datetimes bounding the interval, or None.
+    """
+    if begin:
+        if not compressed:
+            SeekTimestamp(fileIn, begin)
+        else:
+            index = ReadTimestampIndex(filename)
+            if index is None:
+                index = WriteTimestampIndex(fileIn, filename)
+                fileIn.rewind()
+            SeekTimestampIndex(fileIn, index, begin)
+    if end:
+        return StopAtTimestamp(fileIn, end)
+    return fileIn
+
+
+def SplitLogFile(fileIn, chunkSize=SPLIT_CHUNK_SIZE, begin=None, end=None):
+    """
+    Split an uncompressed GPDB log file into chunks of about chunkSize bytes
+    which start where the timestamp changes, so that the chunks can be
+    grouped and filtered independently of each other.  Returns a list of
+    (start, stop) byte offsets.
+
+    SplitLogFile(fileIn, chunkSize, begin, end) -> list
+        fileIn -- an open, seekable file.
+        chunkSize -- the size of the chunks in bytes.
+        begin, end -- datetimes or None.  If given, only the part of the
+            file which can hold the log entries of the interval is split,
+            allowing for SEEK_SLACK as SeekTimestampRange does.
+    """
+    fileIn.seek(0, 2)
+    stop = fileIn.tell()
+    start = 0
+    if begin:
+        start = SeekTimestamp(fileIn, begin)
+    if end:
+        # The binary search finds an offset shortly before the first entry
+        # timestamped end plus SEEK_SLACK; read on to that entry.
+        endstamp = _seekStamp(end + SEEK_SLACK)
+        fileIn.seek(max(start, SeekTimestamp(fileIn, end + 2 * SEEK_SLACK)))
+        while True:
+            pos = fileIn.tell()
+            line = fileIn.readline()
+            if not line or (line >= endstamp and timestampPattern.match(line)):
+                stop = pos
+                break
+
+    chunks = []
+    while start < stop:
+        pos = stop
+        if start + chunkSize < stop:
+            # never split the lines GroupByTimestamp would keep together
+            pos = min(_nextGroup(fileIn, start + chunkSize), stop)
+        chunks.append((start, pos))
+        start = pos
+    return chunks
+
+
 #--------------------------- Pattern Matching ----------------------------
     
 def MatchRegex(iterable, regex):
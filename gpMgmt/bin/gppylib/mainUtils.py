@@ -19,7 +19,7 @@ extend common functions of our gp utilities.  Please keep this in mind
 and try to avoid placing logic for a specific utility here.
 """
 
-import os, sys, signal, errno, yaml
+import os, sys, signal, errno
 
 gProgramName = os.path.split(sys.argv[0])[-1]
 if sys.version_info < (2, 5, 0):
@@ -28,13 +28,21 @@ if sys.version_info < (2, 5, 0):
 Please upgrade python installed on this machine.''' % gProgramName)
 
 from gppylib import gplog
-from gppylib.commands import gp, unix
-from gppylib.commands.base import ExecutionError
-from gppylib.system import configurationInterface, configurationImplGpdb, fileSystemInterface, \
-        fileSystemImplOs, osInterface, osImplNative, faultProberInterface, faultProberImplGpdb
+from gppylib.gpimport import lazy_import
+from gppylib.commands.base import ExecutionError, RemoteSessionPool, setRemoteSessionPool
+from gppylib.operations.agent import RemoteOperationAgentPool, setRemoteOperationAgentPool
+from gppylib.system import configurationInterface, fileSystemInterface, \
+        fileSystemImplOs, osInterface, osImplNative, faultProberInterface
 from optparse import OptionGroup, OptionParser, SUPPRESS_HELP
-from gppylib.gpcoverage import GpCoverage
-from lockfile.pidlockfile import PIDLockFile, LockTimeout
+
+# Not needed by every program importing this module; see gppylib.gpimport
+yaml = lazy_import('yaml')
+gp = lazy_import('gppylib.commands.gp')
+unix = lazy_import('gppylib.commands.unix')
+configurationImplGpdb = lazy_import('gppylib.system.configurationImplGpdb')
+faultProberImplGpdb = lazy_import('gppylib.system.faultProberImplGpdb')
+gpcoverage = lazy_import('gppylib.gpcoverage')
+pidlockfile = lazy_import('lockfile.pidlockfile')
 
 
 def getProgramName():
@@ -72,7 +80,7 @@ class SimpleMainLock:
 
         if self.pidfilename is not None:
             self.ppath       = os.path.join(gp.get_masterdatadir(), self.pidfilename)
-            self.pidlockfile = PIDLockFile( self.ppath )
+            self.pidlockfile = pidlockfile.PIDLockFile( self.ppath )
 
 
     def acquire(self):
@@ -107,7 +115,7 @@ class SimpleMainLock:
         try:
             self.pidlockfile.acquire(1)
 
-        except LockTimeout:
+        except pidlockfile.LockTimeout:
             self.pidfilepid = self.pidlockfile.read_pid()
             return self.pidfilepid
 
@@ -189,7 +197,7 @@ def simple_main( createOptionParserFn, createCommandFn, mainOptions=None) :
                               parentpidvar (string)
 
     """
-    coverage = GpCoverage()
+    coverage = gpcoverage.GpCoverage()
     coverage.start()
     try:
         simple_main_internal(createOptionParserFn, createCommandFn, mainOptions)
@@ -247,6 +255,20 @@ def simple_main_locked(createOptionParserFn, createCommandFn, mainOptions):
     useHelperToolLogging = mainOptions is not None and mainOptions.get("useHelperToolLogging")
     nonuser = True if mainOptions is not None and mainOptions.get("setNonuserOnToolLogger") else False
     exit_status = 1
+
+    # GP_SSH_MULTIPLEX=1 makes all REMOTE commands of this tool share one ssh
+    # control connection per host instead of connecting for every command
+    sessionPool = None
+    if os.environ.get('GP_SSH_MULTIPLEX'):
+        sessionPool = RemoteSessionPool()
+        setRemoteSessionPool(sessionPool)
+
+    # GP_OPERATION_AGENT=1 sends the RemoteOperations of this tool to a
+    # resident agent per host instead of launching gpoperation.py for each
+    agentPool = None
+    if os.environ.get('GP_OPERATION_AGENT'):
+        agentPool = RemoteOperationAgentPool()
+        setRemoteOperationAgentPool(agentPool)
     
     # NOTE: if this logic is changed then also change test_main in testUtils.py
     try:
@@ -312,6 +334,12 @@ def simple_main_locked(createOptionParserFn, createCommandFn, mainOptions):
     finally:
         if commandObject:
             commandObject.cleanup()
+        if agentPool:
+            setRemoteOperationAgentPool(None)
+            agentPool.close()
+        if sessionPool:
+            setRemoteSessionPool(None)
+            sessionPool.close()
     sys.exit(exit_status)
 
 
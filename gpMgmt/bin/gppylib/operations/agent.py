@@ -0,0 +1,482 @@
+#!/usr/bin/env python
+#
+# Copyright (c) Greenplum Inc 2008. All Rights Reserved.
+#
+"""
+Resident per-host agent for RemoteOperation.
+
+Without an agent every RemoteOperation ssh-launches gpoperation.py, which
+starts a fresh interpreter, imports gppylib and sets up logging before it
+can unpickle the operation.  A RemoteOperationAgentPool instead starts
+'gpoperation.py --agent' once per host over a single ssh channel and sends
+it pickled operations over that channel.  The agent runs the operations
+concurrently and returns their results or exceptions, together with the
+remote traceback.
+
+Messages in either direction are pickles framed as "<length>\\n<data>":
+
+    agent  -> master: ('hello', version)     once, after startup
+    master -> agent:  (id, pickled operation)
+    agent  -> master: (id, 'ok', result)
+                      (id, 'exception', exception, traceback text)
+                      (id, 'error', traceback text)  exception not picklable
+                      ('bye',)  idle; no further requests are read
+
+The agent only runs operations if its gppylib is the same as the master's;
+otherwise, or if the agent cannot be started at all, RemoteOperation falls
+back to running gpoperation.py once per operation.
+
+Install a pool with setRemoteOperationAgentPool() and close() it when done.
+"""
+
+import hashlib
+import os
+import pickle
+import select
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from threading import Thread, Lock, Event
+
+from gppylib import gplog
+from gppylib.commands.base import Command, CommandResult, ExecutionError, LOCAL, SRC_GPPATH, \
+                                  getRemoteSessionPool
+
+logger = gplog.get_default_logger()
+
+# Seconds an agent without running operations waits for the next one before it exits.
+AGENT_IDLE_TIMEOUT = 60
+# Seconds to wait for a starting agent to say hello.
+AGENT_START_TIMEOUT = 60
+
+gRemoteOperationAgentPool = None
+
+#
+# @param pool a RemoteOperationAgentPool used by all RemoteOperations, or None
+#        to go back to one gpoperation.py invocation per operation
+#
+def setRemoteOperationAgentPool(pool):
+    global gRemoteOperationAgentPool
+    gRemoteOperationAgentPool = pool
+
+def getRemoteOperationAgentPool():
+    return gRemoteOperationAgentPool
+
+
+_gppylib_version = None
+
+def gppylib_version():
+    """
+    Returns a digest of the gppylib sources.  The agent and the master must
+    agree on it since operations are pickled by reference to their classes.
+    """
+    global _gppylib_version
+    if _gppylib_version is None:
+        top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        m = hashlib.md5()
+        for root, dirs, files in os.walk(top):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith('.py'):
+                    path = os.path.join(root, name)
+                    m.update(path[len(top):])
+                    f = open(path, 'rb')
+                    try:
+                        m.update(f.read())
+                    finally:
+                        f.close()
+        _gppylib_version = m.hexdigest()
+    return _gppylib_version
+
+
+def format_remote_traceback(e, tb):
+    """
+    Formats an exception raised by a remote operation and its traceback the
+    way gpoperation.py reports it on stderr.
+    """
+    pretty_trace = str(e) + "\n"
+    pretty_trace += 'Traceback (most recent call last):\n'
+    pretty_trace += ''.join(traceback.format_list(traceback.extract_tb(tb)))
+    return pretty_trace
+
+
+def write_frame(f, data):
+    f.write('%d\n%s' % (len(data), data))
+    f.flush()
+
+
+class FrameReader(object):
+    """ Reads frames written by write_frame() from a file descriptor """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.buf = ''
+
+    def _next_frame(self):
+        i = self.buf.find('\n')
+        if i < 0:
+            return None
+        size = int(self.buf[:i])
+        if len(self.buf) < i + 1 + size:
+            return None
+        data = self.buf[i + 1:i + 1 + size]
+        self.buf = self.buf[i + 1 + size:]
+        return data
+
+    def read(self, timeout=None):
+        """
+        Returns the next frame, or None if no data arrived for timeout
+        seconds.  Raises EOFError at the end of the stream.
+        """
+        while True:
+            data = self._next_frame()
+            if data is not None:
+                return data
+            if timeout is not None and not select.select([self.fd], [], [], timeout)[0]:
+                return None
+            chunk = os.read(self.fd, 65536)
+            if not chunk:
+                raise EOFError()
+            self.buf += chunk
+
+
+class AgentUnavailable(Exception):
+    """ No agent can be used on the host; the operation has not been sent """
+    pass
+
+
+#-----------------------------------------------------------------------------
+# agent side
+
+class OperationAgent(object):
+    """
+    Serves the operations sent by a RemoteOperationAgentPool, each in its own
+    thread.  Exits at the end of its input, once the running operations are
+    done, or after idle_timeout seconds without any operation running.
+
+    Operations run in the same process, so an operation must not depend on
+    process wide state like the current directory.
+    """
+
+    def __init__(self, infd, outfile, idle_timeout=AGENT_IDLE_TIMEOUT):
+        self.reader = FrameReader(infd)
+        self.outfile = outfile
+        self.idle_timeout = idle_timeout
+        self.lock = Lock()
+        self.active = 0
+        self.last_active = time.time()
+
+    def _send(self, reply):
+        self.lock.acquire()
+        try:
+            write_frame(self.outfile, reply)
+        finally:
+            self.lock.release()
+
+    def _is_idle(self):
+        self.lock.acquire()
+        try:
+            return self.active == 0 and time.time() - self.last_active > self.idle_timeout
+        finally:
+            self.lock.release()
+
+    def serve(self):
+        self._send(pickle.dumps(('hello', gppylib_version())))
+        threads = []
+        while True:
+            try:
+                data = self.reader.read(1.0)
+            except EOFError:
+                break
+            if data is None:
+                if self._is_idle():
+                    # The master resends whatever it wrote after this
+                    self._send(pickle.dumps(('bye',)))
+                    break
+                continue
+
+            (req_id, pickled_operation) = pickle.loads(data)
+            self.lock.acquire()
+            try:
+                self.active += 1
+            finally:
+                self.lock.release()
+            thread = Thread(target=self._run, args=(req_id, pickled_operation))
+            thread.daemon = True
+            thread.start()
+            threads = [t for t in threads if t.isAlive()]
+            threads.append(thread)
+
+        for t in threads:
+            t.join()
+
+    def _run(self, req_id, pickled_operation):
+        try:
+            try:
+                operation = pickle.loads(pickled_operation)
+                reply = pickle.dumps((req_id, 'ok', operation.run()))
+            except Exception, e:
+                exc_traceback = sys.exc_info()[2]
+                pretty_trace = format_remote_traceback(e, exc_traceback)
+                try:
+                    reply = pickle.dumps((req_id, 'exception', e, pretty_trace))
+                except Exception:
+                    logger.critical(pretty_trace)
+                    reply = pickle.dumps((req_id, 'error', pretty_trace))
+            self._send(reply)
+        finally:
+            self.lock.acquire()
+            try:
+                self.active -= 1
+                self.last_active = time.time()
+            finally:
+                self.lock.release()
+
+
+#-----------------------------------------------------------------------------
+# master side
+
+class _PendingRequest(object):
+    def __init__(self):
+        self.done = Event()
+        self.reply = None
+
+
+class _RemoteOperationAgent(object):
+    """ The master's end of the channel to the agent on one host """
+
+    def __init__(self, host, proc, errfile=None):
+        self.host = host
+        self.proc = proc
+        self.errfile = errfile
+        self.reader = FrameReader(proc.stdout.fileno())
+        self.lock = Lock()
+        self.pending = {}
+        self.next_id = 0
+        self.closing = False
+
+        try:
+            hello = self.reader.read(AGENT_START_TIMEOUT)
+        except EOFError:
+            hello = None
+        if hello is None:
+            self.close()
+            raise AgentUnavailable('Could not start an operation agent on %s: %s' % (host, self.get_errors()))
+        hello = pickle.loads(hello)
+        if hello[1] != gppylib_version():
+            self.close()
+            raise AgentUnavailable('The gppylib of the operation agent on %s differs from the master' % host)
+
+        self.thread = Thread(target=self._read_replies)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def get_errors(self):
+        if self.errfile is None:
+            return ''
+        self.errfile.seek(0)
+        return self.errfile.read().strip()
+
+    def is_usable(self):
+        self.lock.acquire()
+        try:
+            return not self.closing
+        finally:
+            self.lock.release()
+
+    def call(self, pickled_operation):
+        """
+        Sends an operation and waits for its reply.  Returns None if the agent
+        stopped reading requests before this one, so it has not been run.
+        """
+        request = _PendingRequest()
+        self.lock.acquire()
+        try:
+            if self.closing:
+                return None
+            req_id = self.next_id
+            self.next_id += 1
+            self.pending[req_id] = request
+            try:
+                write_frame(self.proc.stdin, pickle.dumps((req_id, pickled_operation)))
+            except (IOError, OSError):
+                # the reader thread fails the request when it sees the EOF
+                pass
+        finally:
+            self.lock.release()
+        request.done.wait()
+        return request.reply
+
+    def _read_replies(self):
+        # after a 'bye' the requests in flight were not read, so they get a
+        # None reply and are resent
+        lost = None
+        try:
+            while True:
+                reply = pickle.loads(self.reader.read())
+                if reply[0] == 'bye':
+                    break
+                self.lock.acquire()
+                try:
+                    request = self.pending.pop(reply[0])
+                finally:
+                    self.lock.release()
+                request.reply = reply
+                request.done.set()
+        except Exception, e:
+            # EOF or garbage; the requests in flight may or may not have run
+            lost = (-1, 'lost', 'Lost the operation agent on %s (%s): %s' % (self.host, repr(e), self.get_errors()))
+
+        self.lock.acquire()
+        try:
+            self.closing = True
+            pending = self.pending.values()
+            self.pending = {}
+        finally:
+            self.lock.release()
+        for request in pending:
+            request.reply = lost
+            request.done.set()
+        self.close()
+        self.proc.wait()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            self.closing = True
+            try:
+                self.proc.stdin.close()
+            except (IOError, OSError):
+                pass
+        finally:
+            self.lock.release()
+
+
+class RemoteOperationAgentPool(object):
+    """
+    Keeps one OperationAgent per host for RemoteOperation, started on demand.
+    An agent exits after idle_timeout seconds without operations to run; the
+    next operation for that host starts a new one.  Hosts on which no agent
+    could be started keep running each operation through gpoperation.py.
+    """
+
+    def __init__(self, idle_timeout=AGENT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.lock = Lock()
+        self.agents = {}
+        self.host_locks = {}
+        self.unavailable = set()
+        self.starts = 0
+        self.operations = 0
+
+    def _spawn(self, host, execname):
+        """ starts the agent process for host; returns (proc, stderr file) """
+        cmd = ['ssh', '-o', 'StrictHostKeyChecking no', '-o', 'BatchMode yes']
+        session_pool = getRemoteSessionPool()
+        if session_pool is not None:
+            cmd.extend(shlex.split(session_pool.getSshOptions(host)))
+        cmd.extend([host, '%s $GPHOME/sbin/gpoperation.py --agent %s %d' % (SRC_GPPATH, execname, self.idle_timeout)])
+        errfile = tempfile.TemporaryFile()
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=errfile,
+                                close_fds=True)
+        return (proc, errfile)
+
+    def _acquire(self, host, execname):
+        self.lock.acquire()
+        try:
+            host_lock = self.host_locks.setdefault(host, Lock())
+        finally:
+            self.lock.release()
+
+        # agents for different hosts start concurrently
+        host_lock.acquire()
+        try:
+            self.lock.acquire()
+            try:
+                if host in self.unavailable:
+                    raise AgentUnavailable('No operation agent on %s' % host)
+                agent = self.agents.get(host)
+            finally:
+                self.lock.release()
+            if agent is not None and agent.is_usable():
+                return agent
+
+            (proc, errfile) = self._spawn(host, execname)
+            try:
+                agent = _RemoteOperationAgent(host, proc, errfile)
+            except AgentUnavailable, e:
+                logger.debug(str(e))
+                self.lock.acquire()
+                try:
+                    self.unavailable.add(host)
+                finally:
+                    self.lock.release()
+                raise
+
+            self.lock.acquire()
+            try:
+                self.agents[host] = agent
+                self.starts += 1
+            finally:
+                self.lock.release()
+            return agent
+        finally:
+            host_lock.release()
+
+    def execute(self, host, operation, execname):
+        """
+        Runs operation on host and returns its result or raises its exception.
+        Raises AgentUnavailable, before sending the operation, if there is no
+        agent on host.
+        """
+        pickled_operation = pickle.dumps(operation)
+        reply = None
+        while reply is None:
+            reply = self._acquire(host, execname).call(pickled_operation)
+
+        self.lock.acquire()
+        try:
+            self.operations += 1
+        finally:
+            self.lock.release()
+
+        status = reply[1]
+        if status == 'ok':
+            return reply[2]
+        if status == 'exception':
+            e = reply[2]
+            e.remote_traceback = reply[3]
+            logger.debug('%s on %s raised %s' % (operation, host, reply[3]))
+            raise e
+
+        cmd = Command('remote operation %s' % operation, 'gpoperation.py --agent', ctxt=LOCAL)
+        cmd.set_results(CommandResult(2, '', reply[2], True, False))
+        raise ExecutionError('%s failed on %s' % (operation, host), cmd)
+
+    def get_metrics(self):
+        self.lock.acquire()
+        try:
+            return {'agents': len(self.agents),
+                    'starts': self.starts,
+                    'operations': self.operations,
+                    'unavailable': len(self.unavailable)}
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """ lets all agents finish their operations and exit """
+        self.lock.acquire()
+        try:
+            agents = self.agents.values()
+            self.agents = {}
+        finally:
+            self.lock.release()
+
+        for agent in agents:
+            agent.close()
+        for agent in agents:
+            agent.proc.wait()
+        logger.debug("RemoteOperationAgentPool closed: %s" % self.get_metrics())
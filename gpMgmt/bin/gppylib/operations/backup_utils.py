@@ -870,6 +870,99 @@ def get_table_info(line):
     owner = temp[owner_start[0] + len(OWNER_EXPR) : tblspace_start[0]]
     return (name, type, schema, owner)
 
+PARTITION_CLAUSE_PREFIXES = ("START (", "DEFAULT PARTITION ", "PARTITION ", "SUBPARTITION ", "DEFAULT SUBPARTITION ")
+
+def get_partition_table_name(line):
+    """
+    Returns the (un-escaped) table name of a partition clause of a CREATE
+    TABLE statement, None if the line names no table.
+
+    line: a stripped line starting with one of PARTITION_CLAUSE_PREFIXES
+    """
+    keyword = " WITH \(tablename=E"
+
+    # minus the length of keyword below as we escaped '(' with an extra back slash (\)
+    pos = get_nonquoted_keyword_index(line, keyword, "'", len(keyword) - 1)
+    if pos == -1:
+        keyword = " WITH \(tablename="
+        pos = get_nonquoted_keyword_index(line, keyword, "'", len(keyword) - 1)
+        if pos == -1:
+            return None
+    # len(keyword) plus one to not include the first single quote
+    table = line[pos + len(keyword) : line.rfind("'")]
+    # unescape table name to get the defined name in database
+    return unescape_string(table)
+
+def scan_dump_toc(lines):
+    """
+    Yields (offset, type, schema, table, owner) for every table and
+    partition defined in a master dump, one line at a time so that the dump
+    never has to be held in memory.  type is TABLE, EXTERNAL TABLE or
+    PARTITION; offset is the position of the line in the uncompressed dump
+    when lines are read from the dump file itself.
+    """
+    schema = ''
+    owner = ''
+    offset = 0
+    for line in lines:
+        if line.startswith("-- Name: "):
+            table, table_type, schema, owner = get_table_info(line)
+            if table_type in ["TABLE", "EXTERNAL TABLE"]:
+                yield (offset, table_type, schema, table, owner)
+        else:
+            stripped = line.strip()
+            if stripped.startswith(PARTITION_CLAUSE_PREFIXES):
+                table = get_partition_table_name(stripped)
+                if table is not None:
+                    yield (offset, 'PARTITION', schema, table, owner)
+        offset += len(line)
+
+def generate_dump_toc_filename(dump_file):
+    """
+    The table of contents index of a master dump file is kept next to it,
+    named after the uncompressed dump file.
+    """
+    if dump_file.endswith('.gz'):
+        dump_file = dump_file[:-len('.gz')]
+    return '%s_toc' % dump_file
+
+def write_dump_toc(dump_file, compress):
+    """
+    Writes the table of contents index of a master dump file: one line per
+    table or partition with the fields of scan_dump_toc, tab separated and
+    escaped.  The index is written to a temporary file first so that a
+    partial index is never used.
+    """
+    toc_file = generate_dump_toc_filename(dump_file)
+    tmp_file = '%s.tmp' % toc_file
+    if compress:
+        dump = gzip.open(dump_file, 'r')
+    else:
+        dump = open(dump_file, 'r')
+    try:
+        with open(tmp_file, 'w') as toc:
+            for entry in scan_dump_toc(dump):
+                fields = [str(entry[0])] + [(field or '').encode('string_escape') for field in entry[1:]]
+                toc.write('%s\n' % '\t'.join(fields))
+    finally:
+        dump.close()
+    os.rename(tmp_file, toc_file)
+    return toc_file
+
+def read_dump_toc(lines):
+    """
+    Yields the (offset, type, schema, table, owner) entries of the lines of a
+    table of contents index written by write_dump_toc.
+    """
+    for line in lines:
+        line = line.rstrip('\n')
+        if not line:
+            continue
+        fields = line.split('\t')
+        if len(fields) != 5:
+            raise Exception('Invalid line in dump table of contents: %s' % line)
+        yield tuple([int(fields[0])] + [field.decode('string_escape') for field in fields[1:]])
+
 def get_master_dump_file(master_datadir, backup_dir, dump_dir, timestamp, dump_prefix, ddboost):
     """
     Generate the path to master dump file for ddboost, local cluster and netbackup dump, this function
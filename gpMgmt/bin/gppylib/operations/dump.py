@@ -18,6 +18,7 @@ from gppylib.utils import shellEscape
 from gppylib.operations import Operation
 from gppylib.operations.unix import CheckDir, CheckFile, ListFiles, ListFilesByPattern, MakeDir, RemoveFile, RemoveTree, RemoveRemoteTree
 from gppylib.operations.utils import RemoteOperation, ParallelOperation
+from gppylib.operations.state_store import StateStore, StateStoreException
 from gppylib.operations.backup_utils import backup_file_with_nbu, check_file_dumped_with_nbu, create_temp_file_from_list, execute_sql, \
                                             generate_ao_state_filename, generate_cdatabase_filename, generate_co_state_filename, generate_dirtytable_filename, \
                                             generate_filter_filename, generate_global_filename, generate_global_prefix, generate_increments_filename, \
@@ -27,7 +28,8 @@ from gppylib.operations.backup_utils import backup_file_with_nbu, check_file_dum
                                             generate_seg_status_prefix, generate_segment_config_filename, get_incremental_ts_from_report_file, \
                                             get_latest_full_dump_timestamp, get_latest_full_ts_with_nbu, get_latest_report_timestamp, get_lines_from_file, \
                                             restore_file_with_nbu, validate_timestamp, verify_lines_in_file, write_lines_to_file, isDoubleQuoted, formatSQLString, \
-                                            checkAndAddEnclosingDoubleQuote, split_fqn, remove_file_on_segments, generate_stats_prefix
+                                            checkAndAddEnclosingDoubleQuote, split_fqn, remove_file_on_segments, generate_stats_prefix, \
+                                            get_master_dump_file, write_dump_toc
 
 logger = gplog.get_default_logger()
 
@@ -249,12 +251,42 @@ def get_tables_with_dirty_metadata(master_datadir, backup_dir, dump_dir, dump_pr
     return dirty_tables
 
 def get_dirty_partition_tables(table_type, curr_state_partition_list, master_datadir, backup_dir, dump_dir, dump_prefix, full_timestamp,
-                               netbackup_service_host=None, netbackup_block_size=None):
+                               netbackup_service_host=None, netbackup_block_size=None, ddboost=False):
+    curr_state_dict = create_partition_dict(curr_state_partition_list)
+    store = get_last_state_store(master_datadir, backup_dir, dump_dir, dump_prefix, full_timestamp, netbackup_service_host, netbackup_block_size, ddboost)
+    if store is not None:
+        return store.changed_keys(table_type, curr_state_dict)
     last_state_partition_list = get_last_state(table_type, master_datadir, backup_dir, dump_dir, dump_prefix, full_timestamp, netbackup_service_host, netbackup_block_size)
     last_state_dict = create_partition_dict(last_state_partition_list)
-    curr_state_dict = create_partition_dict(curr_state_partition_list)
     return compare_dict(last_state_dict, curr_state_dict)
 
+def generate_dump_state_store_filename(master_datadir, backup_dir, dump_dir, dump_prefix, ddboost=False):
+    if ddboost or not backup_dir:
+        use_dir = master_datadir
+    else:
+        use_dir = backup_dir
+    return os.path.join(use_dir, dump_dir, '%sgp_dump_state_store' % dump_prefix)
+
+def get_last_state_store(master_datadir, backup_dir, dump_dir, dump_prefix, full_timestamp, netbackup_service_host=None, netbackup_block_size=None, ddboost=False):
+    """
+    The state store holding the ao/co state of the previous dump, or None
+    when there is no store or it was not written by that dump, in which
+    case the state files of the previous dump have to be read instead.
+    """
+    store_filename = generate_dump_state_store_filename(master_datadir, backup_dir, dump_dir, dump_prefix, ddboost)
+    if not os.path.isfile(store_filename):
+        return None
+    try:
+        store = StateStore(store_filename).load()
+    except (IOError, StateStoreException) as e:
+        logger.warning('Unable to read dump state store %s: %s' % (store_filename, e))
+        return None
+    last_ts = get_last_dump_timestamp(master_datadir, backup_dir, dump_dir, dump_prefix, full_timestamp, netbackup_service_host, netbackup_block_size)
+    if store.generation != last_ts.strip():
+        logger.debug('Dump state store %s is from %s, not from the last dump %s' % (store_filename, store.generation, last_ts.strip()))
+        return None
+    return store
+
 def get_last_state(table_type, master_datadir, backup_dir, dump_dir, dump_prefix, full_timestamp, netbackup_service_host=None, netbackup_block_size=None):
     last_ts = get_last_dump_timestamp(master_datadir, backup_dir, dump_dir, dump_prefix, full_timestamp, netbackup_service_host, netbackup_block_size)
     last_state_filename = get_filename_from_filetype(table_type, master_datadir, backup_dir, dump_dir, dump_prefix, last_ts.strip())
@@ -354,18 +386,57 @@ def write_state_file(table_type, master_datadir, backup_dir, dump_dir, dump_pref
     if ddboost:
         copy_file_to_dd(filename, dump_dir, ddboost_storage_unit=ddboost_storage_unit)
 
+def write_dump_state_store(master_datadir, backup_dir, dump_dir, dump_prefix, ao_partition_list, co_partition_list, ddboost=False):
+    """
+    Record the ao/co state of this dump so that the next incremental dump
+    does not need to read back and parse the state files.  The state files
+    are still written, they are part of the backup set.
+    """
+    store_filename = generate_dump_state_store_filename(master_datadir, backup_dir, dump_dir, dump_prefix, ddboost)
+    store = StateStore(store_filename)
+    try:
+        try:
+            store.load()
+        except StateStoreException as e:
+            logger.warning('Recreating dump state store %s: %s' % (store_filename, e))
+            os.remove(store_filename)
+            store = StateStore(store_filename)
+        store.begin(TIMESTAMP_KEY)
+        store.update('ao', create_partition_dict(ao_partition_list), replace=True)
+        store.update('co', create_partition_dict(co_partition_list), replace=True)
+        store.commit()
+    finally:
+        store.close()
+
+def write_master_dump_toc(master_datadir, backup_dir, dump_dir, dump_prefix, timestamp, compress):
+    """
+    Index the tables of the master dump file so that gpdbrestore does not
+    have to read through the whole dump to list or validate them.  The index
+    is an optimization only: gpdbrestore scans the dump when it is missing.
+    """
+    dump_file = get_master_dump_file(master_datadir, backup_dir, dump_dir, timestamp, dump_prefix, False)
+    if compress:
+        dump_file += '.gz'
+    if not os.path.isfile(dump_file):
+        return
+    try:
+        toc_file = write_dump_toc(dump_file, compress)
+        logger.info('Wrote table of contents of master dump file to %s' % toc_file)
+    except Exception as e:
+        logger.warning('Failed to write table of contents of master dump file %s: %s' % (dump_file, e))
+
 # return a list of dirty tables
 def get_dirty_tables(master_port, dbname, master_datadir, backup_dir, dump_dir, dump_prefix, fulldump_ts,
                      ao_partition_list, co_partition_list, last_operation_data,
-                     netbackup_service_host, netbackup_block_size):
+                     netbackup_service_host, netbackup_block_size, ddboost=False):
 
     dirty_heap_tables = get_dirty_heap_tables(master_port, dbname)
 
     dirty_ao_tables = get_dirty_partition_tables('ao', ao_partition_list, master_datadir, backup_dir, dump_dir, dump_prefix,
-                                                 fulldump_ts, netbackup_service_host, netbackup_block_size)
+                                                 fulldump_ts, netbackup_service_host, netbackup_block_size, ddboost)
 
     dirty_co_tables = get_dirty_partition_tables('co', co_partition_list, master_datadir, backup_dir, dump_dir, dump_prefix,
-                                                 fulldump_ts, netbackup_service_host, netbackup_block_size)
+                                                 fulldump_ts, netbackup_service_host, netbackup_block_size, ddboost)
 
     dirty_metadata_set = get_tables_with_dirty_metadata(master_datadir, backup_dir, dump_dir, dump_prefix, fulldump_ts, last_operation_data,
                                                         netbackup_service_host, netbackup_block_size)
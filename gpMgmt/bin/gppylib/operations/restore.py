@@ -4,10 +4,12 @@ import os
 import shutil
 import socket
 import time
+from Queue import Queue, Empty
+from threading import Lock
 
 from pygresql import pg
 from gppylib import gplog
-from gppylib.commands.base import WorkerPool, Command, ExecutionError
+from gppylib.commands.base import WorkerPool, Command, CommandResult, ExecutionError, SQLCommand
 from gppylib.commands.gp import Psql
 from gppylib.commands.unix import Scp
 from gppylib.utils import shellEscape
@@ -27,8 +29,8 @@ from gppylib.operations.backup_utils import check_backup_type, check_dir_writabl
                                             get_full_timestamp_for_incremental_with_nbu, get_lines_from_file, restore_file_with_nbu, run_pool_command, scp_file_to_hosts, \
                                             verify_lines_in_file, write_lines_to_file, split_fqn, escapeDoubleQuoteInSQLString, get_dbname_from_cdatabaseline, \
                                             checkAndRemoveEnclosingDoubleQuote, checkAndAddEnclosingDoubleQuote, removeEscapingDoubleQuoteInSQLString, \
-                                            create_temp_file_with_schemas, check_funny_chars_in_names, remove_file_on_segments, get_restore_dir, get_nonquoted_keyword_index, \
-                                            unescape_string, get_table_info
+                                            create_temp_file_with_schemas, check_funny_chars_in_names, remove_file_on_segments, get_restore_dir, \
+                                            scan_dump_toc, read_dump_toc, generate_dump_toc_filename
 from gppylib.operations.unix import CheckFile, CheckRemoteDir, MakeRemoteDir, CheckRemotePath
 from re import compile, search, sub
 
@@ -43,14 +45,78 @@ logger = gplog.get_default_logger()
 WARN_MARK = '<<<<<'
 POST_DATA_SUFFIX = '_post_data'
 
+# number of AO/CO tables whose statistics are refreshed by one statement
+AO_STATS_BATCH_SIZE = 100
+
+# maximum number of connections refreshing AO/CO statistics at the same time
+AO_STATS_NUM_WORKERS = 4
+
+# seconds between two AO/CO statistics progress messages
+AO_STATS_PROGRESS_INTERVAL = 30
+
 # TODO: use CLI-agnostic custom exceptions instead of ExceptionNoStackTraceNeeded
 
-def update_ao_stat_func(conn, ao_schema, ao_table, counter, batch_size):
-    qry = "SELECT * FROM gp_update_ao_master_stats('%s.%s')" % (pg.escape_string(escapeDoubleQuoteInSQLString(ao_schema)),
-                                                                pg.escape_string(escapeDoubleQuoteInSQLString(ao_table)))
-    rows = execSQLForSingleton(conn, qry)
-    if counter % batch_size == 0:
-        conn.commit()
+def update_ao_stat_batch_func(conn, ao_tables):
+    # a single round trip refreshes the statistics of the whole batch
+    funcs = ["gp_update_ao_master_stats('%s.%s')" % (pg.escape_string(escapeDoubleQuoteInSQLString(ao_schema)),
+                                                     pg.escape_string(escapeDoubleQuoteInSQLString(ao_table)))
+             for (ao_schema, ao_table) in ao_tables]
+    execSQL(conn, "SELECT %s" % ', '.join(funcs))
+    conn.commit()
+
+class UpdateAOStatsCommand(SQLCommand):
+    """
+    Refreshes the master statistics of restored AO/CO tables on its own
+    connection, taking batches of tables from a queue shared with the other
+    commands refreshing the same database.  Every batch is committed on its
+    own.
+    """
+
+    def __init__(self, name, master_port, dbname, batches, progress):
+        SQLCommand.__init__(self, name)
+        self.master_port = master_port
+        self.dbname = dbname
+        self.batches = batches
+        self.progress = progress
+        self.error = None
+
+    def run(self, validateAfter=False):
+        try:
+            with dbconn.connect(dbconn.DbURL(port=self.master_port, dbname=self.dbname)) as conn:
+                self.cancel_conn = conn
+                while not self.cancel_flag:
+                    try:
+                        batch = self.batches.get(False)
+                    except Empty:
+                        break
+                    update_ao_stat_batch_func(conn, batch)
+                    self.progress.add(len(batch))
+                self.cancel_conn = None
+            self.set_results(CommandResult(0, '', '', True, False))
+        except Exception as e:
+            self.cancel_conn = None
+            self.error = e
+            self.set_results(CommandResult(1, '', str(e), True, False))
+
+class AOStatsProgress(object):
+    """
+    Counts the AO/CO tables whose statistics were refreshed and logs the
+    progress every AO_STATS_PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.lock = Lock()
+        self.last_report = time.time()
+
+    def add(self, count):
+        with self.lock:
+            self.done += count
+            now = time.time()
+            if now - self.last_report >= AO_STATS_PROGRESS_INTERVAL and self.done < self.total:
+                self.last_report = now
+                logger.info("Updated AO/CO statistics of %d of %d tables" % (self.done, self.total))
 
 def generate_restored_tables(results, restored_tables, restored_schema, restore_all):
     restored_ao_tables = set()
@@ -67,16 +133,17 @@ def generate_restored_tables(results, restored_tables, restored_schema, restore_
 
     return restored_ao_tables
 
-def update_ao_statistics(master_port, dbname, restored_tables, restored_schema=[], restore_all=False):
+def update_ao_statistics(master_port, dbname, restored_tables, restored_schema=[], restore_all=False,
+                         num_workers=AO_STATS_NUM_WORKERS):
     # Restored schema is different from restored tables as restored schema
     # updates all tables within that schema.
+    # The tables are refreshed AO_STATS_BATCH_SIZE at a time over at most
+    # num_workers connections.
     qry = """SELECT c.relname,n.nspname
              FROM pg_class c, pg_namespace n
              WHERE c.relnamespace=n.oid
                  AND (c.relstorage='a' OR c.relstorage='c')"""
 
-    conn = None
-    counter = 1
     restored_ao_tables = set()
 
     try:
@@ -90,11 +157,33 @@ def update_ao_statistics(master_port, dbname, restored_tables, restored_schema=[
             logger.info("No AO/CO tables restored, skipping statistics update...")
             return
 
-        with dbconn.connect(dbconn.DbURL(port=master_port, dbname=dbname)) as conn:
-            for (ao_schema, ao_table) in sorted(restored_ao_tables):
-                update_ao_stat_func(conn, ao_schema, ao_table, counter, batch_size=1000)
-                counter = counter + 1
-            conn.commit()
+        ao_tables = sorted(restored_ao_tables)
+        batches = Queue()
+        for i in range(0, len(ao_tables), AO_STATS_BATCH_SIZE):
+            batches.put(ao_tables[i:i + AO_STATS_BATCH_SIZE])
+
+        progress = AOStatsProgress(len(ao_tables))
+        num_workers = max(1, min(num_workers, batches.qsize()))
+        cmds = [UpdateAOStatsCommand('update ao statistics %d' % i, master_port, dbname, batches, progress)
+                for i in range(num_workers)]
+
+        pool = WorkerPool(numWorkers=num_workers)
+        try:
+            for cmd in cmds:
+                pool.addCommand(cmd)
+            pool.join()
+        except:
+            for cmd in cmds:
+                cmd.cancel()
+            raise
+        finally:
+            pool.haltWork()
+            pool.joinWorkers()
+
+        for cmd in cmds:
+            if cmd.error is not None:
+                raise cmd.error
+        logger.info("Updated AO/CO statistics of %d tables" % progress.done)
     except Exception as e:
         logger.info("Error updating ao statistics after restore")
         raise e
@@ -606,7 +695,7 @@ class RestoreDatabase(Operation):
                     restore_all=True
                 update_ao_statistics(self.master_port, restore_db, self.restore_tables,
                                      restored_schema=self.schema_level_restore_list, restore_all=restore_all,
-                                    )
+                                     num_workers=min(self.batch_default, AO_STATS_NUM_WORKERS))
 
         if not self.metadata_only:
             if (not self.no_analyze) and (len(self.restore_tables) == 0):
@@ -780,7 +869,8 @@ class RestoreDatabase(Operation):
 
         if not self.no_ao_stats:
             logger.info("Updating AO/CO statistics on master")
-            update_ao_statistics(self.master_port, restore_db, restored_tables)
+            update_ao_statistics(self.master_port, restore_db, restored_tables,
+                                 num_workers=min(self.batch_default, AO_STATS_NUM_WORKERS))
         else:
             logger.info("noaostats enabled. Skipping update of AO/CO statistics on master.")
 
@@ -1411,36 +1501,10 @@ class GetDumpTablesOperation(Operation):
         self.gunzip_maybe = ' | gunzip' if self.compress else ''
 
     def extract_dumped_tables(self, lines):
-        schema = ''
-        owner = ''
-        table = ''
-        ret = []
-        for line in lines:
-            if line.startswith("-- Name: "):
-                table, table_type, schema, owner = get_table_info(line)
-                if table_type in ["TABLE", "EXTERNAL TABLE"]:
-                    ret.append((schema, table, owner))
-            else:
-                line = line.strip()
-                if (line.startswith("START (") or line.startswith("DEFAULT PARTITION ") or line.startswith("PARTITION ") or
-                    line.startswith("SUBPARTITION ") or line.startswith("DEFAULT SUBPARTITION ")):
-
-                    keyword = " WITH \(tablename=E"
-
-                    # minus the length of keyword below as we escaped '(' with an extra back slash (\)
-                    pos = get_nonquoted_keyword_index(line, keyword, "'", len(keyword) - 1)
-                    if pos == -1:
-                        keyword = " WITH \(tablename="
-                        pos = get_nonquoted_keyword_index(line, keyword, "'", len(keyword) - 1)
-                        if pos == -1:
-                            continue
-                    # len(keyword) plus one to not include the first single quote
-                    table = line[pos + len(keyword) : line.rfind("'")]
-                    # unescape table name to get the defined name in database
-                    table = unescape_string(table)
-                    ret.append((schema, table, owner))
+        return [(schema, table, owner) for (_, _, schema, table, owner) in scan_dump_toc(lines)]
 
-        return ret
+    def extract_toc_tables(self, lines):
+        return [(schema, table, owner) for (_, _, schema, table, owner) in read_dump_toc(lines)]
 
 class GetDDboostDumpTablesOperation(GetDumpTablesOperation):
     def __init__(self, restore_timestamp, master_datadir, backup_dir, dump_dir, dump_prefix, compress, dump_file, ddboost_storage_unit=None):
@@ -1487,6 +1551,12 @@ class GetLocalDumpTablesOperation(GetDumpTablesOperation):
         super(GetLocalDumpTablesOperation, self).__init__(restore_timestamp, master_datadir, backup_dir, dump_dir, dump_prefix, compress)
 
     def execute(self):
+        if self.dump_file:
+            toc_file = generate_dump_toc_filename(self.dump_file)
+            if os.path.exists(toc_file) and os.path.getmtime(toc_file) >= os.path.getmtime(self.dump_file):
+                with open(toc_file, 'r') as f:
+                    return self.extract_toc_tables(f)
+
         ret = []
         f = None
         try:
@@ -1495,8 +1565,7 @@ class GetLocalDumpTablesOperation(GetDumpTablesOperation):
             else:
                 f = open(self.dump_file, 'r')
 
-            lines = f.readlines()
-            ret = self.extract_dumped_tables(lines)
+            ret = self.extract_dumped_tables(f)
 
         finally:
             if f is not None:
@@ -1510,6 +1579,14 @@ class GetRemoteDumpTablesOperation(GetDumpTablesOperation):
         super(GetRemoteDumpTablesOperation, self).__init__(restore_timestamp, master_datadir, backup_dir, dump_dir, dump_prefix, compress)
 
     def execute(self):
+        # use the table of contents index unless the dump is newer than it
+        toc_file = generate_dump_toc_filename(self.dump_file)
+        get_remote_toc = '''ssh %s "test ! %s -nt %s && cat %s"''' % (self.host, self.dump_file, toc_file, toc_file)
+        cmd = Command('Get remote table of contents of dump', get_remote_toc)
+        cmd.run(validateAfter=False)
+        if cmd.get_results().rc == 0:
+            return self.extract_toc_tables(cmd.get_results().stdout.splitlines())
+
         cat_cmdStr = 'cat %s%s' % (self.dump_file, self.gunzip_maybe)
         get_remote_dump_tables = '''ssh %s %s%s''' % (self.host, cat_cmdStr, self.grep_cmdStr)
 
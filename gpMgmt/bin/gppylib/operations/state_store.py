@@ -0,0 +1,319 @@
+"""
+A keyed, single file state store shared by the utilities that keep per
+table state from run to run (analyzedb, incremental gpcrondump).
+
+The file is an append only log of records, one per line, each followed by
+its crc32.  Loading it builds an in-memory index of the current value of
+every key, grouped in namespaces.  A run only appends the entries that
+changed; the log is compacted into a fresh file once it holds mostly
+superseded records.
+
+Every run is a generation.  The records of a generation carry the values
+they replaced, so runs can be undone, latest first.  Compaction keeps what
+is needed to undo the latest generation and any retained before it.
+
+Crash safety: a record is only considered once its line is complete and
+its checksum matches; anything after the first bad record (a torn write)
+is ignored and truncated away before the next append.  Compaction writes a
+new file and renames it over the old one.
+"""
+
+import json
+import os
+import zlib
+
+from gppylib import gplog
+
+logger = gplog.get_default_logger()
+
+STORE_VERSION = 1
+
+# compact when the log holds this many times more records than live entries
+COMPACT_RATIO = 4
+
+# ... but never for a log smaller than this
+COMPACT_MIN_RECORDS = 1000
+
+_MISSING = [False, None]
+
+
+def _to_bytes(obj):
+    # names are stored as latin-1 so that any byte string survives the
+    # round trip through json unchanged
+    if isinstance(obj, unicode):
+        return obj.encode('latin-1')
+    if isinstance(obj, list):
+        return [_to_bytes(x) for x in obj]
+    return obj
+
+
+def _encode_key(key):
+    if isinstance(key, tuple):
+        return list(key)
+    return key
+
+
+def _decode_key(key):
+    if isinstance(key, list):
+        return tuple(key)
+    return key
+
+
+class StateStoreException(Exception): pass
+
+
+class StateStore(object):
+    def __init__(self, path):
+        self.path = path
+        self.index = {}           # namespace -> {key: value}
+        self.generations = []     # (generation, previous, undo) oldest first, undo
+                                  # being [(namespace, key, [existed, value])]
+        self.retain = set()       # generations to keep undoable on compaction
+        self.num_records = 0
+        self.good_offset = 0
+        self.fp = None
+
+    def load(self):
+        """
+        Read the log and build the index.  A missing file is an empty store.
+        """
+        self.index = {}
+        self.generations = []
+        self.num_records = 0
+        self.good_offset = 0
+
+        if not os.path.exists(self.path):
+            return self
+
+        with open(self.path, 'rb') as fp:
+            offset = 0
+            for line in fp:
+                record = self._decode_record(line)
+                if record is None:
+                    logger.warning('Ignoring damaged records at offset %d of state store %s' % (offset, self.path))
+                    break
+                self._apply(record)
+                offset += len(line)
+                self.num_records += 1
+            self.good_offset = offset
+        return self
+
+    def _decode_record(self, line):
+        if not line.endswith('\n'):
+            return None
+        try:
+            payload, crc = line[:-1].rsplit('\t', 1)
+            if int(crc, 16) != (zlib.crc32(payload) & 0xffffffff):
+                return None
+            return _to_bytes(json.loads(payload))
+        except ValueError:
+            return None
+
+    def _encode_record(self, record):
+        payload = json.dumps(record, separators=(',', ':'), encoding='latin-1')
+        return '%s\t%08x\n' % (payload, zlib.crc32(payload) & 0xffffffff)
+
+    def _apply(self, record):
+        op = record[0]
+        if op == 'V':
+            if record[1] != STORE_VERSION:
+                raise StateStoreException('Unsupported state store version %s in %s' % (record[1], self.path))
+        elif op == 'G':
+            self.generations.append((record[1], record[2], []))
+        elif op == 'P':
+            ns, key, value, prev = record[1], _decode_key(record[2]), record[3], record[4]
+            self.index.setdefault(ns, {})[key] = value
+            self._add_undo(ns, key, prev)
+        elif op == 'D':
+            ns, key, prev = record[1], _decode_key(record[2]), record[3]
+            self.index.get(ns, {}).pop(key, None)
+            self._add_undo(ns, key, prev)
+        else:
+            raise StateStoreException('Unknown record type %s in state store %s' % (op, self.path))
+
+    def _add_undo(self, ns, key, prev):
+        if self.generations:
+            self.generations[-1][2].append((ns, key, prev))
+
+    @property
+    def generation(self):
+        if not self.generations:
+            return None
+        return self.generations[-1][0]
+
+    @property
+    def previous_generation(self):
+        if not self.generations:
+            return None
+        return self.generations[-1][1]
+
+    def _append(self, record):
+        if self.fp is None:
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            self.fp = open(self.path, 'ab')
+            # drop a torn tail left by an earlier crash
+            self.fp.truncate(self.good_offset)
+            self.fp.seek(self.good_offset)
+            if self.good_offset == 0:
+                self.fp.write(self._encode_record(['V', STORE_VERSION]))
+                self.num_records += 1
+        self.fp.write(self._encode_record(record))
+        self.num_records += 1
+        self._apply(record)
+
+    def get(self, namespace, key, default=None):
+        return self.index.get(namespace, {}).get(key, default)
+
+    def items(self, namespace):
+        """
+        The index of a namespace, {key: value}.  Do not modify it.
+        """
+        return self.index.get(namespace, {})
+
+    def changed_keys(self, namespace, current):
+        """
+        The keys of the current {key: value} state whose value differs from
+        the stored one, without reading anything but the index.
+        """
+        stored = self.items(namespace)
+        return set(k for k, v in current.iteritems() if k not in stored or stored[k] != v)
+
+    def begin(self, generation):
+        """
+        Start a new generation; the changes made until the next one can be
+        undone with undo_generation().
+        """
+        self._append(['G', generation, self.generation])
+
+    def put(self, namespace, key, value):
+        stored = self.index.get(namespace, {})
+        if key in stored:
+            if stored[key] == value:
+                return
+            prev = [True, stored[key]]
+        else:
+            prev = _MISSING
+        self._append(['P', namespace, _encode_key(key), value, prev])
+
+    def delete(self, namespace, key):
+        stored = self.index.get(namespace, {})
+        if key not in stored:
+            return
+        self._append(['D', namespace, _encode_key(key), [True, stored[key]]])
+
+    def update(self, namespace, mapping, replace=False):
+        """
+        Store every changed entry of mapping; with replace, also delete the
+        keys that are not in it.
+        """
+        for key, value in mapping.iteritems():
+            self.put(namespace, key, value)
+        if replace:
+            for key in [k for k in self.items(namespace) if k not in mapping]:
+                self.delete(namespace, key)
+
+    def commit(self):
+        """
+        Make the appended records durable, compacting the log if worthwhile.
+        """
+        if self.fp is None:
+            return
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.good_offset = self.fp.tell()
+        live = sum(len(entries) for entries in self.index.itervalues())
+        undo = sum(len(g[2]) for g in self._retained())
+        if self.num_records > COMPACT_MIN_RECORDS and self.num_records > COMPACT_RATIO * (live + undo):
+            self.compact()
+
+    def retain_undo(self, generations):
+        """
+        Keep the given generations undoable when the log is compacted, as
+        long as every generation after them is kept too.  The latest
+        generation always is.
+        """
+        self.retain = set(generations)
+
+    def _retained(self):
+        kept = []
+        for gen in reversed(self.generations):
+            if kept and gen[0] not in self.retain:
+                break
+            kept.append(gen)
+        kept.reverse()
+        return kept
+
+    def undo_generation(self):
+        """
+        Revert the changes of the latest generation.  Returns False when
+        there is nothing left to undo, in which case the caller must treat
+        the stored state as lost.
+        """
+        if not self.generations:
+            return False
+        generation, previous, undo = self.generations.pop()
+        _revert(self.index, undo)
+        self._rewrite(self._retained())
+        return True
+
+    def compact(self):
+        """
+        Rewrite the log with only the live entries, keeping what is needed
+        to undo the retained generations.
+        """
+        self._rewrite(self._retained())
+
+    def _rewrite(self, kept):
+        # the state before the oldest kept generation is written first,
+        # then the changes of each kept generation on top of it
+        state = dict((ns, dict(entries)) for ns, entries in self.index.iteritems())
+        changes = []
+        for generation, previous, undo in reversed(kept):
+            records = [['G', generation, previous]]
+            seen = set()
+            for ns, key, prev in undo:
+                if (ns, key) in seen:
+                    continue
+                seen.add((ns, key))
+                if key in state.get(ns, {}):
+                    records.append(['P', ns, _encode_key(key), state[ns][key], prev])
+                else:
+                    records.append(['D', ns, _encode_key(key), prev])
+            changes.append(records)
+            _revert(state, undo)
+
+        records = [['V', STORE_VERSION]]
+        dropped = self.generations[:len(self.generations) - len(kept)]
+        if dropped:
+            records.append(['G', dropped[-1][0], None])
+        for ns in sorted(state):
+            for key, value in state[ns].iteritems():
+                records.append(['P', ns, _encode_key(key), value, _MISSING])
+        for generation_records in reversed(changes):
+            records.extend(generation_records)
+
+        self.close()
+        tmpname = self.path + '.tmp'
+        with open(tmpname, 'wb') as fp:
+            for record in records:
+                fp.write(self._encode_record(record))
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.rename(tmpname, self.path)
+        self.load()
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+
+def _revert(index, undo):
+    for ns, key, prev in reversed(undo):
+        existed, value = prev
+        if existed:
+            index.setdefault(ns, {})[key] = value
+        else:
+            index.get(ns, {}).pop(key, None)
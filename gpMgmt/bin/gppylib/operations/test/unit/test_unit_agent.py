@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# Copyright (c) Greenplum Inc 2008. All Rights Reserved.
+#
+
+import os
+import subprocess
+import sys
+import time
+import unittest2 as unittest
+from mock import patch
+
+import gppylib
+from gppylib.commands.base import ExecutionError
+from gppylib.operations.agent import AgentUnavailable, RemoteOperationAgentPool, setRemoteOperationAgentPool
+from gppylib.operations.utils import RemoteOperation
+from gppylib.operations.test_utils_helper import TestOperation, RaiseOperation, RaiseOperation_Nested, \
+                                                RaiseOperation_Safe, MyException, ExceptionWithArgs
+
+AGENT_MAIN = """
+import os, sys
+out = sys.stdout
+sys.stdout = open(os.devnull, 'w')
+from gppylib.operations.agent import OperationAgent
+OperationAgent(sys.stdin.fileno(), out, %d).serve()
+"""
+
+class LocalAgentPool(RemoteOperationAgentPool):
+    """ runs the agents as local processes instead of over ssh """
+
+    def _spawn(self, host, execname):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(gppylib.__file__)))
+        devnull = open(os.devnull, 'w')
+        proc = subprocess.Popen([sys.executable, '-c', AGENT_MAIN % self.idle_timeout],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=devnull,
+                                close_fds=True, env=env)
+        return (proc, None)
+
+
+class RemoteOperationAgentTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = LocalAgentPool()
+
+    def tearDown(self):
+        setRemoteOperationAgentPool(None)
+        self.pool.close()
+
+    def test_execute(self):
+        for i in range(3):
+            self.assertEqual(self.pool.execute('host1', TestOperation(), 'test'), 1)
+        self.pool.execute('host2', TestOperation(), 'test')
+        self.assertEqual(self.pool.get_metrics(), {'agents': 2, 'starts': 2, 'operations': 4, 'unavailable': 0})
+
+    def test_exception_with_remote_traceback(self):
+        try:
+            self.pool.execute('host1', RaiseOperation_Safe(), 'test')
+        except ExceptionWithArgs, e:
+            self.assertEqual((e.x, e.y), (1, 2))
+            self.assertTrue('raise ExceptionWithArgs(1, 2)' in e.remote_traceback)
+        else:
+            self.fail("RaiseOperation_Safe should have thrown ExceptionWithArgs(1, 2)")
+
+    def test_unpicklable_exception(self):
+        try:
+            self.pool.execute('host1', RaiseOperation_Nested(), 'test')
+        except ExecutionError, e:
+            self.assertTrue(e.cmd.get_results().stderr.strip().endswith("raise RaiseOperation_Nested.MyException2()"))
+        else:
+            self.fail("RaiseOperation_Nested should have caused an ExecutionError")
+        # the agent survives a failed operation
+        self.assertEqual(self.pool.execute('host1', TestOperation(), 'test'), 1)
+        self.assertEqual(self.pool.get_metrics()['starts'], 1)
+
+    def test_idle_agent_is_restarted(self):
+        self.pool.idle_timeout = 0
+        self.pool.execute('host1', TestOperation(), 'test')
+        time.sleep(2.5)
+        self.assertEqual(self.pool.execute('host1', TestOperation(), 'test'), 1)
+        self.assertEqual(self.pool.get_metrics()['starts'], 2)
+
+    def test_version_mismatch(self):
+        with patch('gppylib.operations.agent.gppylib_version', return_value='0'):
+            self.assertRaises(AgentUnavailable, self.pool.execute, 'host1', TestOperation(), 'test')
+        self.assertRaises(AgentUnavailable, self.pool.execute, 'host1', TestOperation(), 'test')
+        self.assertEqual(self.pool.get_metrics()['unavailable'], 1)
+
+    def test_remote_operation_uses_agent(self):
+        setRemoteOperationAgentPool(self.pool)
+        self.assertEqual(RemoteOperation(TestOperation(), 'host1').run(), 1)
+        self.assertRaises(MyException, RemoteOperation(RaiseOperation(), 'host1').run)
+        self.assertEqual(self.pool.get_metrics()['operations'], 2)
+
+    @patch('gppylib.operations.utils.Command')
+    def test_remote_operation_falls_back(self, mock_cmd):
+        self.pool.unavailable.add('host1')
+        setRemoteOperationAgentPool(self.pool)
+        mock_cmd.return_value.get_results.return_value.stdout = '\x80\x02K\x01.'
+        self.assertEqual(RemoteOperation(TestOperation(), 'host1').run(), 1)
+        self.assertTrue(mock_cmd.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,8 +3,10 @@
 # Copyright (c) Greenplum Inc 2012. All Rights Reserved.
 #
 
+import gzip
 import os
 import shutil
+import tempfile
 import unittest2 as unittest
 from gppylib.commands.base import CommandResult
 from gppylib.operations.backup_utils import generate_report_filename, validate_timestamp, generate_increments_filename,\
@@ -22,7 +24,8 @@ from gppylib.operations.backup_utils import generate_report_filename, validate_t
                                             generate_master_status_prefix, generate_seg_dbdump_prefix, generate_seg_status_prefix, \
                                             generate_dbdump_prefix, generate_createdb_filename, generate_filter_filename, backup_file_with_nbu, \
                                             restore_file_with_nbu, generate_global_filename, generate_cdatabase_filename, check_file_dumped_with_nbu, \
-                                            get_full_timestamp_for_incremental_with_nbu, get_latest_full_ts_with_nbu, generate_schema_filename, get_batch_from_list, list_to_quoted_string
+                                            get_full_timestamp_for_incremental_with_nbu, get_latest_full_ts_with_nbu, generate_schema_filename, get_batch_from_list, list_to_quoted_string, \
+                                            generate_dump_toc_filename, scan_dump_toc, write_dump_toc, read_dump_toc
 
 from mock import patch, MagicMock, Mock
 
@@ -1874,3 +1877,56 @@ class BackupUtilsTestCase(unittest.TestCase):
 
         with self.assertRaisesRegexp(Exception, 'No full backup found for given incremental on the specified NetBackup server'):
             get_latest_full_ts_with_nbu(dbname, backup_dir, self.dump_prefix, netbackup_service_host, netbackup_block_size)
+
+    def test_generate_dump_toc_filename_00(self):
+        self.assertEquals(generate_dump_toc_filename('/data/gp_dump_1_1_20120731093030'), '/data/gp_dump_1_1_20120731093030_toc')
+
+    def test_generate_dump_toc_filename_01(self):
+        self.assertEquals(generate_dump_toc_filename('/data/gp_dump_1_1_20120731093030.gz'), '/data/gp_dump_1_1_20120731093030_toc')
+
+    def test_scan_dump_toc_00(self):
+        lines = ['-- Name: sales; Type: TABLE; Schema: public; Owner: gpadmin\n',
+                 'CREATE TABLE sales (id int)\n',
+                 "          START ('2011-01-01'::date) WITH (tablename='sales_1_prt_2', appendonly=false ),\n",
+                 '-- Name: v; Type: VIEW; Schema: public; Owner: gpadmin\n',
+                 '-- Name: ext; Type: EXTERNAL TABLE; Schema: s1; Owner: u1\n']
+        offsets = [sum(len(line) for line in lines[:i]) for i in range(len(lines))]
+        result = list(scan_dump_toc(lines))
+        self.assertEquals(result, [(offsets[0], 'TABLE', 'public', 'sales', 'gpadmin'),
+                                   (offsets[2], 'PARTITION', 'public', 'sales_1_prt_2', 'gpadmin'),
+                                   (offsets[4], 'EXTERNAL TABLE', 's1', 'ext', 'u1')])
+
+    def _write_and_read_dump_toc(self, compress):
+        lines = ['-- Name: t\tab; Type: TABLE; Schema: s\\1; Owner: gpadmin\n',
+                 'CREATE TABLE "t\tab" (id int)\n',
+                 "    PARTITION p1 WITH (tablename=E't\\\\ab_1_prt_p1', appendonly=false ),\n"]
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            dump_file = os.path.join(tmp_dir, 'gp_dump_1_1_20120731093030')
+            if compress:
+                dump_file += '.gz'
+                f = gzip.open(dump_file, 'w')
+            else:
+                f = open(dump_file, 'w')
+            f.writelines(lines)
+            f.close()
+
+            toc_file = write_dump_toc(dump_file, compress)
+            self.assertEquals(toc_file, os.path.join(tmp_dir, 'gp_dump_1_1_20120731093030_toc'))
+            with open(toc_file) as toc:
+                result = list(read_dump_toc(toc))
+            self.assertEquals(result, list(scan_dump_toc(lines)))
+            self.assertEquals(result[1][1:], ('PARTITION', 's\\1', 't\\ab_1_prt_p1', 'gpadmin'))
+            self.assertFalse(os.path.exists('%s.tmp' % toc_file))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_write_dump_toc_00(self):
+        self._write_and_read_dump_toc(False)
+
+    def test_write_dump_toc_01(self):
+        self._write_and_read_dump_toc(True)
+
+    def test_read_dump_toc_invalid_line(self):
+        with self.assertRaisesRegexp(Exception, 'Invalid line in dump table of contents'):
+            list(read_dump_toc(['0\tTABLE\tpublic\n']))
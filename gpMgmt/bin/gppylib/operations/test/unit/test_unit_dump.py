@@ -5,6 +5,7 @@
 
 import os
 import shutil
+import tempfile
 import time
 import unittest2 as unittest
 from datetime import datetime
@@ -22,7 +23,8 @@ from gppylib.operations.dump import DumpDatabase, DumpGlobal, compare_dict, crea
                                     backup_global_file_with_nbu, backup_config_files_with_nbu, backup_report_file_with_ddboost, \
                                     backup_increments_file_with_ddboost, copy_file_to_dd, backup_dirty_file_with_nbu, backup_increments_file_with_nbu, \
                                     backup_partition_list_file_with_nbu, get_include_schema_list_from_exclude_schema, backup_schema_file_with_ddboost, \
-                                    update_filter_file_with_dirty_list, TIMESTAMP, TIMESTAMP_KEY, DUMP_DATE, DeleteCurrentDump, DeleteOldestDumps
+                                    update_filter_file_with_dirty_list, TIMESTAMP, TIMESTAMP_KEY, DUMP_DATE, DeleteCurrentDump, DeleteOldestDumps, \
+                                    write_dump_state_store, write_master_dump_toc
 from mock import patch, MagicMock, Mock
 
 class DumpTestCase(unittest.TestCase):
@@ -869,6 +871,70 @@ class DumpTestCase(unittest.TestCase):
         result = get_dirty_partition_tables(table_type, curr_state_partition_list, master_datadir, backup_dir, self.dumper.dump_dir, self.dumper.dump_prefix, full_timestamp, netbackup_service_host, netbackup_block_size)
         self.assertEqual(result, expected_output)
 
+    @patch('gppylib.operations.dump.TIMESTAMP_KEY', '20121212020202')
+    @patch('gppylib.operations.dump.get_last_state')
+    def test_get_dirty_partition_tables_from_state_store(self, mock1):
+        master_datadir = tempfile.mkdtemp()
+        try:
+            write_dump_state_store(master_datadir, None, self.dumper.dump_dir, self.dumper.dump_prefix,
+                                   ['pepper,t1,100', 'pepper,t2,200'], ['pepper,t4,400'])
+            curr_state_partition_list = ['pepper,t3,300', 'pepper,t1,200', 'pepper,t2,200']
+            with patch('gppylib.operations.dump.get_last_dump_timestamp', return_value='20121212020202'):
+                result = get_dirty_partition_tables('ao', curr_state_partition_list, master_datadir, None, self.dumper.dump_dir, self.dumper.dump_prefix, '20121212010101')
+            self.assertEqual(result, set(['pepper.t3', 'pepper.t1']))
+            self.assertFalse(mock1.called)
+        finally:
+            shutil.rmtree(master_datadir)
+
+    @patch('gppylib.operations.dump.TIMESTAMP_KEY', '20121212020202')
+    @patch('gppylib.operations.dump.get_last_state', return_value=['pepper,t1,100', 'pepper,t2,200'])
+    def test_get_dirty_partition_tables_state_store_from_other_dump(self, mock1):
+        master_datadir = tempfile.mkdtemp()
+        try:
+            write_dump_state_store(master_datadir, None, self.dumper.dump_dir, self.dumper.dump_prefix,
+                                   ['pepper,t1,200', 'pepper,t2,200'], [])
+            curr_state_partition_list = ['pepper,t1,200', 'pepper,t2,200']
+            with patch('gppylib.operations.dump.get_last_dump_timestamp', return_value='20121212010101'):
+                result = get_dirty_partition_tables('ao', curr_state_partition_list, master_datadir, None, self.dumper.dump_dir, self.dumper.dump_prefix, '20121212010101')
+            self.assertEqual(result, set(['pepper.t1']))
+            self.assertTrue(mock1.called)
+        finally:
+            shutil.rmtree(master_datadir)
+
+    @patch('gppylib.operations.dump.TIMESTAMP_KEY', '20121212020202')
+    @patch('gppylib.operations.dump.get_last_state')
+    def test_get_dirty_partition_tables_from_ddboost_state_store(self, mock1):
+        master_datadir = tempfile.mkdtemp()
+        try:
+            write_dump_state_store(master_datadir, '/backup', self.dumper.dump_dir, self.dumper.dump_prefix,
+                                   ['pepper,t1,100', 'pepper,t2,200'], [], True)
+            curr_state_partition_list = ['pepper,t1,200', 'pepper,t2,200']
+            with patch('gppylib.operations.dump.get_last_dump_timestamp', return_value='20121212020202'):
+                result = get_dirty_partition_tables('ao', curr_state_partition_list, master_datadir, '/backup', self.dumper.dump_dir,
+                                                    self.dumper.dump_prefix, '20121212010101', ddboost=True)
+            self.assertEqual(result, set(['pepper.t1']))
+            self.assertFalse(mock1.called)
+        finally:
+            shutil.rmtree(master_datadir)
+
+    @patch('os.path.isfile', return_value=True)
+    @patch('gppylib.operations.dump.write_dump_toc')
+    def test_write_master_dump_toc_00(self, mock1, mock2):
+        write_master_dump_toc('/data', None, self.dumper.dump_dir, self.dumper.dump_prefix, '20121212010101', True)
+        mock1.assert_called_once_with('/data/db_dumps/20121212/gp_dump_1_1_20121212010101.gz', True)
+
+    @patch('os.path.isfile', return_value=False)
+    @patch('gppylib.operations.dump.write_dump_toc')
+    def test_write_master_dump_toc_01(self, mock1, mock2):
+        write_master_dump_toc('/data', '/backup', self.dumper.dump_dir, self.dumper.dump_prefix, '20121212010101', False)
+        self.assertFalse(mock1.called)
+
+    @patch('os.path.isfile', return_value=True)
+    @patch('gppylib.operations.dump.write_dump_toc', side_effect=IOError('No space left on device'))
+    def test_write_master_dump_toc_02(self, mock1, mock2):
+        write_master_dump_toc('/data', None, self.dumper.dump_dir, self.dumper.dump_prefix, '20121212010101', False)
+        mock1.assert_called_once_with('/data/db_dumps/20121212/gp_dump_1_1_20121212010101', False)
+
     @patch('gppylib.operations.dump.get_dirty_heap_tables', return_value=set(['public.heap_table1']))
     @patch('gppylib.operations.dump.get_dirty_partition_tables', side_effect=[set(['public,ao_t1,100', 'public,ao_t2,100']), set(['public,co_t1,100', 'public,co_t2,100'])])
     @patch('gppylib.operations.dump.get_tables_with_dirty_metadata', return_value=set(['public,ao_t3,1234,CREATE,,20121212101010', 'public,co_t3,2345,VACCUM,,20121212101010', 'public,ao_t1,1234,CREATE,,20121212101010']))
@@ -13,7 +13,7 @@ from gppylib.operations.restore import RestoreDatabase, create_restore_plan, get
         create_plan_file_contents, GetDbName, get_dirty_table_file_contents, \
         get_incremental_restore_timestamps, get_partition_list, get_restore_dir, is_begin_incremental_run, \
         is_incremental_restore, get_restore_table_list, validate_restore_tables_list, \
-        update_ao_stat_func, update_ao_statistics, _build_gpdbrestore_cmd_line, ValidateTimestamp, \
+        update_ao_stat_batch_func, update_ao_statistics, _build_gpdbrestore_cmd_line, ValidateTimestamp, \
         is_full_restore, restore_state_files_with_nbu, restore_report_file_with_nbu, restore_cdatabase_file_with_nbu, \
         restore_global_file_with_nbu, restore_config_files_with_nbu, config_files_dumped, global_file_dumped, generate_restored_tables, \
         restore_partition_list_file_with_nbu, restore_increments_file_with_nbu, GetDumpTables, validate_tablenames_exist_in_dump_file
@@ -40,6 +40,15 @@ class OpenFileMock():
     def readlines(self):
         return self.lines
 
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
     def close(self):
         pass
 
@@ -1499,61 +1508,17 @@ CREATE DATABASE monkey WITH TEMPLATE = template0 ENCODING = 'UTF8' OWNER = thisg
 
         self.restore._restore_global(restore_timestamp, master_datadir, backup_dir) # should not error out
 
-    @patch('gppylib.operations.restore.execSQLForSingleton')
-    @patch('pygresql.pgdb.pgdbCnx.commit')
-    def test_update_ao_stat_func_00(self, m1, m2):
-        conn = None
-        ao_schema = 'schema'
-        ao_table = 'table'
-        counter = 1
-        batch_size = 1000
-        update_ao_stat_func(conn, ao_schema, ao_table, counter, batch_size)
-
-    @patch('pygresql.pgdb.pgdbCnx.commit')
-    @patch('gppylib.operations.restore.execSQLForSingleton')
-    def test_update_ao_stat_func_01(self, m1, m2):
-        conn = None
-        ao_table = 'table'
-        ao_schema = 'schema'
-        counter = 999
-        batch_size = 1000
-        update_ao_stat_func(conn, ao_schema, ao_table, counter, batch_size)
-
-    @patch('gppylib.operations.restore.execSQLForSingleton')
-    @patch('pygresql.pgdb.pgdbCnx.commit')
-    def test_update_ao_stat_func_02(self, m1, m2):
-        conn = None
-        ao_table = 'table'
-        ao_schema = 'schema'
-        counter = 1000
-        batch_size = 1000
-        with self.assertRaisesRegexp(AttributeError, "'NoneType' object has no attribute 'commit'"):
-            update_ao_stat_func(conn, ao_schema, ao_table, counter, batch_size)
-
-    @patch('gppylib.operations.restore.execSQLForSingleton')
-    @patch('pygresql.pgdb.pgdbCnx.commit')
-    def test_update_ao_stat_func_03(self, m1, m2):
-        conn = None
-        ao_table = 'table'
-        ao_schema = 'schema'
-        counter = 1001
-        batch_size = 1000
-        update_ao_stat_func(conn, ao_schema, ao_table, counter, batch_size)
-
-    @patch('gppylib.operations.restore.execSQLForSingleton')
-    @patch('pygresql.pgdb.pgdbCnx.commit')
-    def test_update_ao_stat_func_04(self, m1, m2):
-        conn = None
-        ao_table = 'table'
-        ao_schema = 'schema'
-        counter = 2000
-        batch_size = 1000
-        with self.assertRaisesRegexp(AttributeError, "'NoneType' object has no attribute 'commit'"):
-            update_ao_stat_func(conn, ao_schema, ao_table, counter, batch_size)
+    @patch('gppylib.operations.restore.execSQL')
+    def test_update_ao_stat_batch_func_00(self, m1):
+        conn = Mock()
+        update_ao_stat_batch_func(conn, [('public', 't1'), ('s"1', "t'2")])
+        m1.assert_called_once_with(conn, "SELECT gp_update_ao_master_stats('\"public\".\"t1\"'), "
+                                         "gp_update_ao_master_stats('\"s\"\"1\".\"t''2\"')")
+        conn.commit.assert_called_once_with()
 
     @patch('gppylib.operations.restore.execute_sql', return_value=[['t1', 'public']])
     @patch('gppylib.operations.restore.dbconn.connect')
-    @patch('gppylib.operations.restore.update_ao_stat_func')
+    @patch('gppylib.operations.restore.update_ao_stat_batch_func')
     def test_update_ao_statistics_00(self, m1, m2, m3):
         port = 28888
         db = 'testdb'
@@ -1564,6 +1529,25 @@ CREATE DATABASE monkey WITH TEMPLATE = template0 ENCODING = 'UTF8' OWNER = thisg
         update_ao_statistics(port, db, restored_tables=[], restored_schema=['public'], restore_all=False)
         update_ao_statistics(port, db, restored_tables=[], restored_schema=[], restore_all=True)
 
+    @patch('gppylib.operations.restore.AO_STATS_BATCH_SIZE', 2)
+    @patch('gppylib.operations.restore.execute_sql', return_value=[['t%d' % i, 'public'] for i in range(5)])
+    @patch('gppylib.operations.restore.dbconn.connect')
+    @patch('gppylib.operations.restore.update_ao_stat_batch_func')
+    def test_update_ao_statistics_batches(self, m1, m2, m3):
+        update_ao_statistics(28888, 'testdb', restored_tables=[], restore_all=True, num_workers=2)
+        self.assertEqual(m2.call_count, 2)
+        batches = sorted(c[0][1] for c in m1.call_args_list)
+        self.assertEqual(batches, [[('public', 't0'), ('public', 't1')],
+                                   [('public', 't2'), ('public', 't3')],
+                                   [('public', 't4')]])
+
+    @patch('gppylib.operations.restore.execute_sql', return_value=[['t1', 'public']])
+    @patch('gppylib.operations.restore.dbconn.connect')
+    @patch('gppylib.operations.restore.update_ao_stat_batch_func', side_effect=Exception('stats failed'))
+    def test_update_ao_statistics_error(self, m1, m2, m3):
+        with self.assertRaisesRegexp(Exception, 'stats failed'):
+            update_ao_statistics(28888, 'testdb', restored_tables=['public.t1'])
+
     def test_generate_restored_tables_no_table(self):
         results = [['t1','public'], ['t2', 'public'], ['foo', 'bar']]
 
@@ -1769,9 +1753,10 @@ CREATE DATABASE monkey WITH TEMPLATE = template0 ENCODING = 'UTF8' OWNER = thisg
     @patch('gppylib.commands.base.Command.get_results')
     def test_getdumptables_from_remote_host(self, m1, m2, mockCommand_init):
             m1.stdout = ['my return']
+            m1.return_value.rc = 1
             get = GetDumpTables(None, None, None, None, None, False, None, None, 'remote_host', 'myfile')
             result = get.get_dump_tables()
-            mockCommand_init.assert_called_once_with('Get remote copy of dumped tables', 'ssh remote_host cat myfile | grep -e "-- Name: " -e "^\\W*START (" -e "^\\W*PARTITION " -e "^\\W*DEFAULT PARTITION " -e "^\\W*SUBPARTITION " -e "^\\W*DEFAULT SUBPARTITION "')
+            mockCommand_init.assert_called_with('Get remote copy of dumped tables', 'ssh remote_host cat myfile | grep -e "-- Name: " -e "^\\W*START (" -e "^\\W*PARTITION " -e "^\\W*DEFAULT PARTITION " -e "^\\W*SUBPARTITION " -e "^\\W*DEFAULT SUBPARTITION "')
 
 
     @patch('gppylib.commands.base.Command.__init__', return_value=None)
@@ -1779,9 +1764,39 @@ CREATE DATABASE monkey WITH TEMPLATE = template0 ENCODING = 'UTF8' OWNER = thisg
     @patch('gppylib.commands.base.Command.get_results')
     def test_getdumptables_from_remote_host_compressed_file(self, m1, m2, mockCommand_init):
             m1.stdout = ['my return']
+            m1.return_value.rc = 1
+            get = GetDumpTables(None, None, None, None, None, True, None, None, 'remote_host', 'myfile.gz')
+            result = get.get_dump_tables()
+            mockCommand_init.assert_called_with('Get remote copy of dumped tables', 'ssh remote_host cat myfile.gz | gunzip | grep -e "-- Name: " -e "^\\W*START (" -e "^\\W*PARTITION " -e "^\\W*DEFAULT PARTITION " -e "^\\W*SUBPARTITION " -e "^\\W*DEFAULT SUBPARTITION "')
+
+    @patch('gppylib.commands.base.Command.__init__', return_value=None)
+    @patch('gppylib.commands.base.Command.run', return_value="myfile")
+    @patch('gppylib.commands.base.Command.get_results')
+    def test_getdumptables_from_remote_host_toc(self, m1, m2, mockCommand_init):
+            m1.return_value.rc = 0
+            m1.return_value.stdout = '0\tTABLE\tpublic\tsales\tgpadmin\n80\tPARTITION\tpublic\tsales_1_prt_2\tgpadmin\n'
             get = GetDumpTables(None, None, None, None, None, True, None, None, 'remote_host', 'myfile.gz')
             result = get.get_dump_tables()
-            mockCommand_init.assert_called_once_with('Get remote copy of dumped tables', 'ssh remote_host cat myfile.gz | gunzip | grep -e "-- Name: " -e "^\\W*START (" -e "^\\W*PARTITION " -e "^\\W*DEFAULT PARTITION " -e "^\\W*SUBPARTITION " -e "^\\W*DEFAULT SUBPARTITION "')
+            mockCommand_init.assert_called_once_with('Get remote table of contents of dump', 'ssh remote_host "test ! myfile.gz -nt myfile_toc && cat myfile_toc"')
+            self.assertEqual(result, [('public', 'sales', 'gpadmin'), ('public', 'sales_1_prt_2', 'gpadmin')])
+
+    @patch('os.path.exists', return_value=True)
+    @patch('os.path.getmtime', side_effect=[2, 1])
+    @patch('__builtin__.open', return_value=OpenFileMock(['0\tTABLE\tpublic\tsales\tgpadmin\n', '80\tPARTITION\tpublic\tsales_1_prt_2\tgpadmin\n']))
+    def test_getdumptables_execute_with_toc(self, m1, m2, m3):
+        get = GetDumpTables(None, None, None, None, None, False, None, None, None, 'myfile')
+        result = get.get_dump_tables()
+        m1.assert_called_once_with('myfile_toc', 'r')
+        self.assertEqual(result, [('public', 'sales', 'gpadmin'), ('public', 'sales_1_prt_2', 'gpadmin')])
+
+    @patch('os.path.exists', return_value=True)
+    @patch('os.path.getmtime', side_effect=[1, 2])
+    @patch('__builtin__.open', return_value=OpenFileMock(["-- Name: sales; Type: TABLE; Schema: public; Owner: gpadmin"]))
+    def test_getdumptables_execute_with_stale_toc(self, m1, m2, m3):
+        get = GetDumpTables(None, None, None, None, None, False, None, None, None, 'myfile')
+        result = get.get_dump_tables()
+        m1.assert_called_once_with('myfile', 'r')
+        self.assertEqual(result, [('public', 'sales', 'gpadmin')])
 
 class ValidateTimestampTestCase(unittest.TestCase):
 
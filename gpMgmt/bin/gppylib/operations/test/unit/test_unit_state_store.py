@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest2 as unittest
+
+from gppylib.operations import state_store
+from gppylib.operations.state_store import StateStore
+from mock import patch
+
+
+class StateStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'db', 'state')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _reopen(self, store=None):
+        if store is not None:
+            store.close()
+        return StateStore(self.path).load()
+
+    def _num_lines(self):
+        with open(self.path) as fp:
+            return len(fp.readlines())
+
+    def test_load_missing_file_is_empty(self):
+        store = StateStore(self.path).load()
+        self.assertEqual(store.items('ao'), {})
+        self.assertEqual(store.generation, None)
+
+    def test_put_and_reload(self):
+        store = StateStore(self.path).load()
+        store.begin('20160101010101')
+        store.put('ao', ('public', 'foo'), '3')
+        store.put('col', ('public', 'foo'), ['a', 'b'])
+        store.commit()
+
+        store = self._reopen(store)
+        self.assertEqual(store.generation, '20160101010101')
+        self.assertEqual(store.get('ao', ('public', 'foo')), '3')
+        self.assertEqual(store.items('col'), {('public', 'foo'): ['a', 'b']})
+
+    def test_update_only_appends_changed_entries(self):
+        store = StateStore(self.path).load()
+        store.begin('1')
+        store.update('ao', {('public', 'foo'): '1', ('public', 'bar'): '1'})
+        store.commit()
+        lines = self._num_lines()
+
+        store.begin('2')
+        store.update('ao', {('public', 'foo'): '1', ('public', 'bar'): '2'})
+        store.commit()
+
+        # the generation record and one changed entry
+        self.assertEqual(self._num_lines(), lines + 2)
+
+    def test_update_with_replace_deletes_missing_keys(self):
+        store = StateStore(self.path).load()
+        store.begin('1')
+        store.update('ao', {('public', 'foo'): '1', ('public', 'bar'): '1'})
+        store.update('ao', {('public', 'foo'): '1'}, replace=True)
+        store.commit()
+
+        store = self._reopen(store)
+        self.assertEqual(store.items('ao'), {('public', 'foo'): '1'})
+
+    def test_changed_keys(self):
+        store = StateStore(self.path).load()
+        store.begin('1')
+        store.update('ao', {('public', 'foo'): '1', ('public', 'bar'): '1'})
+
+        changed = store.changed_keys('ao', {('public', 'foo'): '1', ('public', 'bar'): '2', ('public', 'baz'): '0'})
+        self.assertEqual(changed, set([('public', 'bar'), ('public', 'baz')]))
+
+    def test_torn_tail_is_ignored_and_truncated(self):
+        store = StateStore(self.path).load()
+        store.begin('1')
+        store.put('ao', ('public', 'foo'), '1')
+        store.commit()
+        store.close()
+        with open(self.path, 'a') as fp:
+            fp.write('["P","ao",["public","bar"],"7",[fal')
+
+        store = self._reopen()
+        self.assertEqual(store.items('ao'), {('public', 'foo'): '1'})
+
+        store.put('ao', ('public', 'baz'), '2')
+        store.commit()
+        store = self._reopen(store)
+        self.assertEqual(store.items('ao'), {('public', 'foo'): '1', ('public', 'baz'): '2'})
+
+    def test_corrupt_record_stops_loading(self):
+        store = StateStore(self.path).load()
+        store.begin('1')
+        store.put('ao', ('public', 'foo'), '1')
+        store.put('ao', ('public', 'bar'), '1')
+        store.commit()
+        store.close()
+        with open(self.path) as fp:
+            data = fp.read()
+        with open(self.path, 'w') as fp:
+            fp.write(data.replace('"bar"', '"baz"'))
+
+        store = self._reopen()
+        self.assertEqual(store.items('ao'), {('public', 'foo'): '1'})
+
+    def test_undo_generation_restores_previous_values(self):
+        store = StateStore(self.path).load()
+        store.begin('1')
+        store.update('ao', {('public', 'foo'): '1', ('public', 'bar'): '1'})
+        store.commit()
+        store.begin('2')
+        store.update('ao', {('public', 'foo'): '2', ('public', 'baz'): '1'})
+        store.delete('ao', ('public', 'bar'))
+        store.commit()
+
+        self.assertTrue(store.undo_generation())
+        self.assertEqual(store.generation, '1')
+        store = self._reopen(store)
+        self.assertEqual(store.items('ao'), {('public', 'foo'): '1', ('public', 'bar'): '1'})
+        self.assertEqual(store.generation, '1')
+
+    def test_compact_keeps_state_and_undo(self):
+        store = StateStore(self.path).load()
+        for gen in range(10):
+            store.begin(str(gen))
+            store.put('ao', ('public', 'foo'), str(gen))
+            store.put('ao', ('public', 'bar'), '1')
+            store.commit()
+        lines = self._num_lines()
+
+        store.compact()
+        self.assertTrue(self._num_lines() < lines)
+        self.assertEqual(store.items('ao'), {('public', 'foo'): '9', ('public', 'bar'): '1'})
+
+        store = self._reopen(store)
+        self.assertTrue(store.undo_generation())
+        self.assertEqual(store.items('ao'), {('public', 'foo'): '8', ('public', 'bar'): '1'})
+        self.assertEqual(store.generation, '8')
+
+    def test_undo_several_generations(self):
+        store = StateStore(self.path).load()
+        for gen in range(3):
+            store.begin(str(gen))
+            store.put('ao', ('public', 'foo'), str(gen))
+            store.put('ao', ('public', 'bar%d' % gen), '1')
+            store.commit()
+
+        self.assertTrue(store.undo_generation())
+        store = self._reopen(store)
+        self.assertTrue(store.undo_generation())
+        self.assertEqual(store.generation, '0')
+        store = self._reopen(store)
+        self.assertEqual(store.items('ao'), {('public', 'foo'): '0', ('public', 'bar0'): '1'})
+        self.assertTrue(store.undo_generation())
+        self.assertEqual(store.generation, None)
+        self.assertEqual(store.items('ao'), {})
+        self.assertFalse(store.undo_generation())
+
+    def test_compact_keeps_retained_generations_undoable(self):
+        store = StateStore(self.path).load()
+        for gen in range(10):
+            store.begin(str(gen))
+            store.put('ao', ('public', 'foo'), str(gen))
+            store.commit()
+        store.retain_undo(['6', '7', '8'])
+        store.compact()
+
+        store = self._reopen(store)
+        store.retain_undo(['6', '7', '8'])
+        for gen in ['8', '7', '6']:
+            self.assertTrue(store.undo_generation())
+            self.assertEqual(store.generation, gen)
+            self.assertEqual(store.get('ao', ('public', 'foo')), gen)
+        # the generations before the retained ones were collapsed into one
+        self.assertTrue(store.undo_generation())
+        self.assertEqual(store.generation, '5')
+        self.assertEqual(store.get('ao', ('public', 'foo')), '5')
+        self.assertTrue(store.undo_generation())
+        self.assertEqual(store.generation, None)
+
+    def test_commit_compacts_mostly_superseded_log(self):
+        store = StateStore(self.path).load()
+        with patch.object(state_store, 'COMPACT_MIN_RECORDS', 10):
+            for gen in range(10):
+                store.begin(str(gen))
+                store.put('ao', ('public', 'foo'), str(gen))
+                store.commit()
+        self.assertTrue(self._num_lines() < 20)
+        self.assertEqual(self._reopen(store).get('ao', ('public', 'foo')), '9')
+
+    def test_non_ascii_names_round_trip(self):
+        store = StateStore(self.path).load()
+        store.begin('1')
+        store.put('ao', ('sch\xe9ma', 't\xc3\xa4b'), '1')
+        store.commit()
+
+        store = self._reopen(store)
+        self.assertEqual(store.items('ao'), {('sch\xe9ma', 't\xc3\xa4b'): '1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
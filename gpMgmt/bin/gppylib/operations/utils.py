@@ -5,6 +5,7 @@ import pickle
 from gppylib import gplog
 from gppylib.commands.base import OperationWorkerPool, Command, REMOTE
 from gppylib.operations import Operation
+from gppylib.operations.agent import AgentUnavailable, getRemoteOperationAgentPool
 
 DEFAULT_NUM_WORKERS = 64
 logger = gplog.get_default_logger()
@@ -34,6 +35,9 @@ class RemoteOperation(Operation):
        However, there is exactly one edge case: unit testing. If a unit test is invoked directly through CLI, its objects
        reside in the __main__ module as opposed to gppylib.test_something. Again, this can be circumvented by invoking unit tests
        through PyUnit or python -m unittest, etc. 
+
+    If a RemoteOperationAgentPool is installed (see gppylib.operations.agent), the operation is
+    sent to the resident agent on the host instead of launching gpoperation.py for it.
     """
     def __init__(self, operation, host):
         super(RemoteOperation, self).__init__()
@@ -41,6 +45,16 @@ class RemoteOperation(Operation):
         self.host = host
     def execute(self):
         execname = os.path.split(sys.argv[0])[-1]
+        agent_pool = getRemoteOperationAgentPool()
+        if agent_pool is not None:
+            try:
+                ret = self.operation.ret = agent_pool.execute(self.host, self.operation, execname)
+                return ret
+            except AgentUnavailable:
+                pass
+            except Exception, e:
+                self.operation.ret = e
+                raise
         pickled_execname = pickle.dumps(execname) 
         pickled_operation = pickle.dumps(self.operation)
         cmd = Command('pickling an operation', '$GPHOME/sbin/gpoperation.py',
@@ -15,8 +15,11 @@ from gppylib.system.configurationInterface import *
 from gppylib.system.ComputeCatalogUpdate import ComputeCatalogUpdate
 from gppylib.gparray import GpArray, GpDB, InvalidSegmentConfiguration
 from gppylib import gparray
-from gppylib.db import dbconn
 from gppylib.commands.gp import get_local_db_mode
+from gppylib.gpimport import lazy_import
+
+# Not needed until the configuration is read or written; see gppylib.gpimport
+dbconn = lazy_import('gppylib.db.dbconn')
 
 logger = get_default_logger()
 
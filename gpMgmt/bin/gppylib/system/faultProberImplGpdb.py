@@ -15,7 +15,11 @@ import re
 from gppylib.gplog import *
 from gppylib.utils import checkNotNone
 from gppylib.system.faultProberInterface import GpFaultProber
-from gppylib.db import dbconn, catalog
+from gppylib.gpimport import lazy_import
+
+# Not needed until segments are probed; see gppylib.gpimport
+dbconn = lazy_import('gppylib.db.dbconn')
+catalog = lazy_import('gppylib.db.catalog')
 
 logger = get_default_logger()
 
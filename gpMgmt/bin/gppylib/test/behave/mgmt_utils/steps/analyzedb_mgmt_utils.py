@@ -2,7 +2,10 @@ import os
 import shutil
 from gppylib.db import dbconn
 from gppylib.test.behave_utils.utils import check_schema_exists, check_table_exists, drop_table_if_exists
-from gppylib.operations.backup_utils import get_lines_from_file
+from gppylib.operations.state_store import StateStore
+
+# the per table state analyzedb keeps in its state store
+STATE_NAMESPACES = ('ao', 'lastop', 'col')
 
 CREATE_MULTI_PARTITION_TABLE_SQL = """
 CREATE TABLE %s.%s (trans_id int, date date, amount decimal(9,2), region text)
@@ -140,72 +143,50 @@ def impl(context, tablename, schemaname):
     perform_ddl_on_table(context.conn, schemaname, tablename)
 
 def table_found_in_state_file(dbname, qualified_table):
-    comma_name = ','.join(qualified_table.split('.'))
-    files = get_latest_analyze_state_files(dbname)
-    if len(files) == 0:
+    store = get_analyze_state_store(dbname)
+    if store is None:
         return False,""
-    state_file = ""
-    for state_file in files:
-        found = False
-        for line in get_lines_from_file(state_file):
-            if comma_name in line:
-                found = True
-                continue
-        if not found:
-            return False,state_file
-    return True,state_file
+    key = tuple(qualified_table.split('.'))
+    for namespace in STATE_NAMESPACES:
+        if key not in store.items(namespace):
+            return False,"%s (%s)" % (store.path, namespace)
+    return True,store.path
 
 def column_found_in_state_file(dbname, qualified_table, col_name_list):
-    comma_name = ','.join(qualified_table.split('.'))
-    files = get_latest_analyze_state_files(dbname)
-    if len(files) == 0:
+    store = get_analyze_state_store(dbname)
+    if store is None:
         return False,"",""
 
-    for state_file in files:
-        if not "col_state_file" in state_file:
-            continue
-        for line in get_lines_from_file(state_file):
-            if comma_name in line:
-                for column in col_name_list.split(','):
-                    if not column in line.split(',')[2:]:
-                        return False,column,state_file
-                return True,"",state_file
-        return False,col_name_list,state_file
+    columns = store.get('col', tuple(qualified_table.split('.')))
+    if columns is None:
+        return False,col_name_list,store.path
+    for column in col_name_list.split(','):
+        if not column in columns:
+            return False,column,store.path
+    return True,"",store.path
 
 def delete_table_from_state_files(dbname, qualified_table):
-    comma_name = ','.join(qualified_table.split('.'))
-    files = get_latest_analyze_state_files(dbname)
-    for filename in files:
-        lines = get_lines_from_file(filename)
-        f = open(filename,"w")
-        for line in lines:
-            if not comma_name in line:
-                f.write(line)
-        f.close()
-
-def get_latest_analyze_state_files(dbname):
+    store = get_analyze_state_store(dbname)
+    if store is None:
+        return
+    key = tuple(qualified_table.split('.'))
+    for namespace in STATE_NAMESPACES:
+        store.delete(namespace, key)
+    store.commit()
+    store.close()
+
+def get_analyze_state_store(dbname):
     """
-    return the latest state files (absolute paths)
+    return the analyze state store of dbname, None if there is none
     """
     master_data_dir = os.environ.get('MASTER_DATA_DIRECTORY')
-    analyze_dir = os.path.join(master_data_dir, 'db_analyze', dbname)
-    if not os.path.exists(analyze_dir):
-        return []
-
-    folders = sorted(os.listdir(analyze_dir), reverse=True)
-    if len(folders) == 0:
-        return []
-
-    state_files_dir = os.path.join(analyze_dir, folders[0])
-    files = os.listdir(state_files_dir)
-
-    if len(files) != 4:
-        raise Exception("Missing or unexpected state files in folder %s" % state_files_dir)
-    ret = []
-    for f in files:
-        if 'report' not in f:
-            ret.append(os.path.join(state_files_dir, f))
-    return ret
+    path = os.path.join(master_data_dir, 'db_analyze', dbname, 'analyze_state_store')
+    if not os.path.exists(path):
+        return None
+    store = StateStore(path).load()
+    if store.generation is None:
+        return None
+    return store
 
 def create_table_with_column_list(conn, storage_type, schemaname, tablename, col_name_list, col_type_list):
     col_name_list = col_name_list.strip().split(',')
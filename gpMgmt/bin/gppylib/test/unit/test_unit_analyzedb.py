@@ -0,0 +1,267 @@
+import imp
+import os
+import threading
+
+from mock import *
+
+from gp_unittest import *
+
+
+class AnalyzeWorkerTestCase(GpTestCase):
+    def setUp(self):
+        # analyzedb does not have a .py extension, so we have to use imp to import it
+        analyzedb_file = os.path.abspath(os.path.dirname(__file__) + "/../../../analyzedb")
+        self.subject = imp.load_source('analyzedb', analyzedb_file)
+        self.subject.logger = Mock(spec=['log', 'info', 'debug', 'warning', 'error'])
+
+        self.dburl = Mock(pgdb='testdb', pghost='mdw', pgport='5432', pguser='gpadmin', pgpass=None)
+        self.connections = []
+        self.queries = []
+        self.query_side_effect = lambda conn, query: None
+
+        self.apply_patches([
+            patch('analyzedb.pg.connect', side_effect=self._connect),
+        ])
+
+    def _connect(self, **kwargs):
+        conn = Mock(spec=['query', 'close', 'cancel'])
+        conn.query.side_effect = lambda query: self._query(conn, query)
+        self.connections.append(conn)
+        return conn
+
+    def _query(self, conn, query):
+        self.queries.append((self.connections.index(conn), query))
+        return self.query_side_effect(conn, query)
+
+    def _run_pool(self, statements, num_workers=1):
+        pool = self.subject.AnalyzeWorkerPool(num_workers, statements, self.dburl)
+        self._join(pool)
+        return pool
+
+    def _join(self, pool):
+        for w in pool.workers:
+            w.join(10)
+            self.assertFalse(w.isAlive())
+
+    def _statements(self, *tables):
+        return [self.subject.AnalyzeStatement('analyze %s;' % t) for t in tables]
+
+    def test_worker__runs_all_statements_over_one_connection(self):
+        stmts = self._statements('t1', 't2', 't3')
+
+        self._run_pool(stmts)
+
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(self.queries, [(0, 'analyze t1;'), (0, 'analyze t2;'), (0, 'analyze t3;')])
+        self.assertTrue(all(s.was_successful() for s in stmts))
+
+    def test_worker__when_the_connection_breaks__reconnects_and_runs_the_next_statement(self):
+        def query(conn, query):
+            if conn is self.connections[0]:
+                raise Exception('server closed the connection unexpectedly')
+        self.query_side_effect = query
+        stmts = self._statements('t1', 't2')
+
+        self._run_pool(stmts)
+
+        self.assertEqual(len(self.connections), 2)
+        self.connections[0].close.assert_called_once_with()
+        self.assertEqual(self.queries, [(0, 'analyze t1;'), (0, 'SELECT 1'),
+                                        (1, 'analyze t1;'), (1, 'analyze t2;')])
+        self.assertTrue(all(s.was_successful() for s in stmts))
+
+    def test_worker__when_a_statement_fails_on_a_live_connection__records_the_error_and_runs_the_next_statement(self):
+        def query(conn, query):
+            if query == 'analyze t1;':
+                raise Exception('ERROR:  relation "t1" does not exist')
+        self.query_side_effect = query
+        stmts = self._statements('t1', 't2')
+
+        self._run_pool(stmts)
+
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(self.queries, [(0, 'analyze t1;'), (0, 'SELECT 1'), (0, 'analyze t2;')])
+        self.assertFalse(stmts[0].was_successful())
+        self.assertEqual(stmts[0].get_stderr_lines(), ['ERROR:  relation "t1" does not exist'])
+        self.assertTrue(stmts[1].was_successful())
+
+    def test_worker__when_halted__cancels_the_running_statement_and_stops(self):
+        started = threading.Event()
+        canceled = threading.Event()
+
+        def query(conn, query):
+            if query == 'analyze t1;':
+                conn.cancel.side_effect = canceled.set
+                started.set()
+                canceled.wait(10)
+                raise Exception('ERROR:  canceling statement due to user request')
+        self.query_side_effect = query
+        stmts = self._statements('t1', 't2')
+
+        pool = self.subject.AnalyzeWorkerPool(1, stmts, self.dburl)
+        self.assertTrue(started.wait(10))
+        pool.haltWork()
+        self._join(pool)
+
+        self.connections[0].cancel.assert_called_once_with()
+        self.assertFalse(stmts[0].was_successful())
+        self.assertNotIn((0, 'analyze t2;'), self.queries)
+        self.assertFalse(stmts[1].done)
+        self.connections[0].close.assert_called_once_with()
+
+    def test_worker__closes_the_connections_at_shutdown(self):
+        stmts = self._statements('t1', 't2', 't3', 't4', 't5', 't6')
+
+        pool = self._run_pool(stmts, num_workers=3)
+
+        self.assertTrue(len(self.connections) > 0)
+        for conn in self.connections:
+            conn.close.assert_called_once_with()
+        self.assertEqual(len(pool.getCompletedItems()), len(stmts))
+
+
+class AnalyzeSchedulerTestCase(GpTestCase):
+    def setUp(self):
+        analyzedb_file = os.path.abspath(os.path.dirname(__file__) + "/../../../analyzedb")
+        self.subject = imp.load_source('analyzedb', analyzedb_file)
+        self.subject.logger = Mock(spec=['log', 'info', 'debug', 'warning', 'error'])
+
+    def _dispatch(self, scheduler):
+        """
+        Run the targets one at a time in the order the scheduler releases them.
+        """
+        dispatched = []
+        queue = scheduler.ready_targets()
+        while queue:
+            target = queue.pop(0)
+            dispatched.append(target)
+            queue.extend(scheduler.target_done(target))
+        return dispatched
+
+    def test_scheduler__orders_targets_longest_predicted_first(self):
+        candidates = [('public', 'small'), ('public', 'large'), ('public', 'medium')]
+        predicted = {('public', 'small'): 1.0, ('public', 'large'): 30.0, ('public', 'medium'): 5.0}
+
+        scheduler = self.subject.AnalyzeScheduler(candidates, predicted, {})
+
+        expected = [('public', 'large'), ('public', 'medium'), ('public', 'small')]
+        self.assertEqual(scheduler.ordered_targets(), expected)
+        self.assertEqual(self._dispatch(scheduler), expected)
+
+    def test_scheduler__keeps_the_given_order_of_equal_predictions(self):
+        candidates = [('public', 't3'), ('public', 't1'), ('public', 'big'), ('public', 't2')]
+        predicted = {('public', 't3'): 2.0, ('public', 't1'): 2.0, ('public', 'big'): 9.0, ('public', 't2'): 2.0}
+
+        scheduler = self.subject.AnalyzeScheduler(candidates, predicted, {})
+
+        self.assertEqual(scheduler.ordered_targets(),
+                         [('public', 'big'), ('public', 't3'), ('public', 't1'), ('public', 't2')])
+
+    def test_scheduler__holds_a_root_partition_until_all_its_leaves_are_done(self):
+        root = ('public', 'sales')
+        leaf1 = ('public', 'sales_1_prt_1')
+        leaf2 = ('public', 'sales_1_prt_2')
+        other = ('public', 'customers')
+        candidates = [leaf2, leaf1, root, other]
+        # the root is predicted to take longest, yet it must come after its leaves
+        predicted = {root: 100.0, leaf1: 10.0, leaf2: 20.0, other: 15.0}
+        leaf_root = {leaf1: root, leaf2: root}
+
+        scheduler = self.subject.AnalyzeScheduler(candidates, predicted, leaf_root)
+
+        self.assertEqual(scheduler.ready_targets(), [leaf2, other, leaf1])
+        self.assertEqual(scheduler.target_done(leaf2), [])
+        self.assertEqual(scheduler.target_done(other), [])
+        self.assertEqual(scheduler.target_done(leaf1), [root])
+        self.assertEqual(scheduler.target_done(root), [])
+        self.assertEqual(scheduler.ready_targets(), [])
+
+    def test_scheduler__places_a_held_root_partition_after_the_other_targets(self):
+        root = ('public', 'sales')
+        leaf1 = ('public', 'sales_1_prt_1')
+        leaf2 = ('public', 'sales_1_prt_2')
+        other = ('public', 'customers')
+        predicted = {root: 100.0, leaf1: 10.0, leaf2: 20.0, other: 15.0}
+
+        scheduler = self.subject.AnalyzeScheduler([leaf2, leaf1, root, other], predicted, {leaf1: root, leaf2: root})
+
+        self.assertEqual(scheduler.ordered_targets(), [leaf2, other, leaf1, root])
+        self.assertEqual(self._dispatch(scheduler), [leaf2, other, leaf1, root])
+
+    def test_scheduler__does_not_hold_a_root_partition_whose_leaves_are_not_analyzed(self):
+        root = ('public', 'sales')
+        leaf = ('public', 'sales_1_prt_1')
+        predicted = {root: 100.0, ('public', 'customers'): 15.0}
+
+        scheduler = self.subject.AnalyzeScheduler([root, ('public', 'customers')], predicted, {leaf: root})
+
+        self.assertEqual(scheduler.ready_targets(), [root, ('public', 'customers')])
+
+
+class AnalyzePredictionTestCase(GpTestCase):
+    def setUp(self):
+        analyzedb_file = os.path.abspath(os.path.dirname(__file__) + "/../../../analyzedb")
+        self.subject = imp.load_source('analyzedb', analyzedb_file)
+        self.subject.logger = Mock(spec=['log', 'info', 'debug', 'warning', 'error'])
+
+        # columns: schema, table, relpages, natts
+        self.cost_info = [('public', 'heap', 100, 2), ('public', 'ao', 0, 4), ('public', 'empty', 0, 3)]
+        self.apply_patches([
+            patch('analyzedb.run_sql', return_value=self.cost_info),
+        ])
+        self.analyzedb = self.subject.AnalyzeDb.__new__(self.subject.AnalyzeDb)
+        self.analyzedb.conn = Mock()
+        self.analyzedb.prev_timings = {}
+
+        self.candidates = [('public', 'heap'), ('public', 'ao'), ('public', 'empty')]
+        self.input_col_dict = {('public', 'heap'): set(['-1']), ('public', 'ao'): set(['a', 'b']),
+                               ('public', 'empty'): set(['-1'])}
+        # pg_aoseg modcount of the AO table
+        self.curr_ao_state = [('public', 'ao', '50')]
+
+    def _predict(self):
+        return self.analyzedb._predict_analyze_times(self.candidates, self.input_col_dict, {}, self.curr_ao_state)
+
+    def test_predict__without_history__uses_the_relative_costs(self):
+        predicted = self._predict()
+
+        # pages (or modcount) times the number of columns to analyze
+        self.assertEqual(predicted, {('public', 'heap'): 200.0, ('public', 'ao'): 100.0, ('public', 'empty'): 3.0})
+        self.assertFalse(self.analyzedb._have_predicted_times())
+
+    def test_predict__without_history__schedules_the_largest_table_first(self):
+        predicted = self._predict()
+
+        scheduler = self.subject.AnalyzeScheduler(self.candidates, predicted, {})
+        self.assertEqual(scheduler.ordered_targets(), self.candidates)
+
+    def test_predict__with_history__uses_the_recorded_times_and_scales_the_others(self):
+        # heap took 10 seconds for a cost of 200: 0.05 seconds per unit of cost
+        self.analyzedb.prev_timings = {('public', 'heap'): 10.0}
+
+        predicted = self._predict()
+
+        self.assertEqual(predicted[('public', 'heap')], 10.0)
+        self.assertAlmostEqual(predicted[('public', 'ao')], 5.0)
+        self.assertAlmostEqual(predicted[('public', 'empty')], 0.15)
+        self.assertTrue(self.analyzedb._have_predicted_times())
+
+    def test_predict__with_history__orders_by_the_recorded_times(self):
+        # the table that is small in the catalog was slow last time
+        self.analyzedb.prev_timings = {('public', 'heap'): 10.0, ('public', 'empty'): 60.0}
+
+        predicted = self._predict()
+
+        scheduler = self.subject.AnalyzeScheduler(self.candidates, predicted, {})
+        self.assertEqual(scheduler.ordered_targets(), [('public', 'empty'), ('public', 'ao'), ('public', 'heap')])
+
+    def test_predict__with_history_of_tables_not_in_the_catalog__falls_back_to_the_relative_costs(self):
+        self.analyzedb.prev_timings = {('public', 'dropped'): 10.0}
+
+        predicted = self._predict()
+
+        self.assertEqual(predicted, {('public', 'heap'): 200.0, ('public', 'ao'): 100.0, ('public', 'empty'): 3.0})
+
+
+if __name__ == '__main__':
+    run_tests()
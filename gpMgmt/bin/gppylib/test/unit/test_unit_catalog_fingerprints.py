@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+
+from mock import *
+
+from gp_unittest import *
+from gpcheckcat_modules.catalog_fingerprints import CatalogFingerprints
+
+
+class CatalogFingerprintsTestCase(GpTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, '.gpcheckcat', 'fingerprints_5432_postgres')
+
+        self.db_connection = Mock(spec=['query'])
+        result = Mock()
+        result.getresult.return_value = [(-1, 10, '123'), (0, 10, '123'), (1, 10, '-45')]
+        self.db_connection.query.return_value = result
+
+        self.pg_class = self._catalog_table('pg_class')
+        self.pg_authid = self._catalog_table('pg_authid', master_only=True)
+
+        self.subject = CatalogFingerprints(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _catalog_table(self, name, master_only=False):
+        cat = Mock()
+        cat.getTableName.return_value = name
+        cat.isMasterOnly.return_value = master_only
+        cat.getTableColumns.return_value = ['oid', 'relname']
+        return cat
+
+    def test_get_fingerprint_query__queries_master_and_segments(self):
+        qry = self.subject.get_fingerprint_query('pg_class', ['oid', 'relname'])
+
+        self.assertIn('ROW(oid, relname)', qry)
+        self.assertIn('FROM pg_catalog.pg_class', qry)
+        self.assertIn("FROM gp_dist_random('pg_catalog.pg_class')", qry)
+
+    def test_compute__skips_master_only_tables(self):
+        self.subject.compute(self.db_connection, [self.pg_class, self.pg_authid])
+
+        self.assertEqual(self.db_connection.query.call_count, 1)
+        self.assertEqual(self.subject.current,
+                         {'pg_class': {-1: (10, '123'), 0: (10, '123'), 1: (10, '-45')}})
+
+    def test_is_changed__without_saved_fingerprints__returns_true(self):
+        self.subject.load()
+        self.subject.compute(self.db_connection, [self.pg_class])
+
+        self.assertTrue(self.subject.is_changed('pg_class'))
+        self.assertEqual(self.subject.get_changed_tables(), ['pg_class'])
+
+    def test_is_changed__when_table_was_not_fingerprinted__returns_true(self):
+        self.assertTrue(self.subject.is_changed('pg_authid'))
+
+    def test_save_and_load__roundtrip_marks_tables_unchanged(self):
+        self.subject.compute(self.db_connection, [self.pg_class])
+        self.subject.save()
+        self.assertFalse(os.path.exists(self.filename + '.tmp'))
+
+        subject = CatalogFingerprints(self.filename)
+        subject.load()
+        subject.compute(self.db_connection, [self.pg_class])
+
+        self.assertFalse(subject.is_changed('pg_class'))
+        self.assertEqual(subject.get_changed_tables(), [])
+
+    def test_is_changed__when_a_segment_hash_differs__returns_true(self):
+        self.subject.compute(self.db_connection, [self.pg_class])
+        self.subject.save()
+
+        changed = Mock()
+        changed.getresult.return_value = [(-1, 10, '123'), (0, 11, '999'), (1, 10, '-45')]
+        self.db_connection.query.return_value = changed
+        subject = CatalogFingerprints(self.filename)
+        subject.load()
+        subject.compute(self.db_connection, [self.pg_class])
+
+        self.assertTrue(subject.is_changed('pg_class'))
+
+
+if __name__ == '__main__':
+    run_tests()
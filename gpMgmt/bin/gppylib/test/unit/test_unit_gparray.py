@@ -7,9 +7,15 @@
 
 """ Unittesting for gplog module
 """
+import os
+import shutil
+import tempfile
+import time
 import unittest2 as unittest
+from mock import Mock, patch
 
-from gppylib.gparray import GpArray, GpDB, createSegmentRows
+from gppylib import gparray as gparray_module
+from gppylib.gparray import GpArray, GpDB, createSegmentRows, ROLE_PRIMARY, ROLE_MIRROR, STATUS_DOWN
 from gppylib import gplog
 
 logger = gplog.get_unittest_logger()
@@ -172,7 +178,182 @@ class MyTestCase(unittest.TestCase):
         for count in portdict.values():
             self.assertEquals(expected_count, count)
             
-    
+
+def make_gparray(num_hosts, primaries_per_host, mirrors=True):
+    """ a synthetic array with the mirrors of a host on the next host """
+    dbs = [GpDB(-1, 'p', 1, 'p', 's', 'u', 'mdw', 'mdw', 5432, '/data/master/gpseg-1', None),
+           GpDB(-1, 'm', 2, 'm', 's', 'u', 'smdw', 'smdw', 5432, '/data/master/gpseg-1', None)]
+    dbid = 3
+    for content in range(num_hosts * primaries_per_host):
+        host = content / primaries_per_host
+        port = content % primaries_per_host
+        dbs.append(GpDB(content, 'p', dbid, 'p', 's', 'u', 'sdw%d' % host, 'sdw%d' % host,
+                        40000 + port, '/data/primary/gpseg%d' % content, 41000 + port))
+        dbid += 1
+        if mirrors:
+            host = (host + 1) % num_hosts
+            dbs.append(GpDB(content, 'm', dbid, 'm', 's', 'u', 'sdw%d' % host, 'sdw%d' % host,
+                            50000 + port, '/data/mirror/gpseg%d' % content, 51000 + port))
+            dbid += 1
+    return GpArray(dbs)
+
+class GpArrayIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.gparray = make_gparray(4, 2)
+
+    def test_lookups(self):
+        gparray = self.gparray
+        segdbs = [db for seg in gparray.segments for db in seg.get_dbs()]
+        self.assertEqual(gparray.getSegDbList(), segdbs)
+        self.assertEqual(gparray.getHostList(), ['mdw', 'smdw', 'sdw0', 'sdw1', 'sdw2', 'sdw3'])
+        self.assertEqual([db.getSegmentDbId() for db in gparray.get_list_of_primary_segments_on_host('sdw1')], [7, 9])
+        self.assertEqual([db.getSegmentDbId() for db in gparray.get_list_of_mirror_segments_on_host('sdw1')], [4, 6])
+        self.assertEqual(gparray.getSegDbsByHostName('nohost'), [])
+        self.assertEqual(len(gparray.getSegDbsByRole(ROLE_MIRROR)), 8)
+        self.assertTrue(gparray.getSegDbByDbId(5) is segdbs[2])
+        self.assertTrue(gparray.getSegmentContainingDb(segdbs[3]) is gparray.segments[1])
+        self.assertTrue(gparray.getSegDbPeer(segdbs[3]) is segdbs[2])
+        self.assertEqual(gparray.getDbIdToPeerMap()[3].getSegmentDbId(), 4)
+
+    def test_results_are_copies(self):
+        self.gparray.getSegDbList().pop()
+        self.gparray.get_list_of_primary_segments_on_host('sdw0').pop()
+        self.assertEqual(len(self.gparray.getSegDbList()), 16)
+        self.assertEqual(len(self.gparray.get_list_of_primary_segments_on_host('sdw0')), 2)
+
+    def test_index_follows_changes(self):
+        gparray = self.gparray
+        db = gparray.getSegDbByDbId(3)
+        db.setSegmentHostName('sdw9')
+        self.assertTrue('sdw9' in gparray.getHostList())
+        self.assertTrue(db in gparray.get_list_of_primary_segments_on_host('sdw9'))
+        self.assertFalse(db in gparray.get_list_of_primary_segments_on_host('sdw0'))
+
+        db.setSegmentStatus(STATUS_DOWN)
+        db.setSegmentRole(ROLE_MIRROR)
+        self.assertEqual(gparray.getSegDbsByStatus(STATUS_DOWN), [db])
+        self.assertTrue(db in gparray.getSegDbsByRole(ROLE_MIRROR))
+        self.assertTrue(db in gparray.getSegDbsByRole(ROLE_PRIMARY, current_role=False))
+
+        gparray.addSegmentDb(GpDB(8, 'p', 100, 'p', 's', 'u', 'sdw10', 'sdw10', 40000, '/data/primary/gpseg8', 41000))
+        self.assertEqual(gparray.getSegDbByDbId(100).getSegmentContentId(), 8)
+        self.assertEqual(gparray.getHostList()[-1], 'sdw10')
+
+    def test_peer_map_more_than_two_segments(self):
+        self.gparray.addSegmentDb(GpDB(0, 'm', 100, 'm', 's', 'u', 'sdw3', 'sdw3', 50000, '/data/mirror/gpseg0', 51000))
+        with self.assertRaisesRegexp(Exception, 'Content 0 has more than two segments'):
+            self.gparray.getDbIdToPeerMap()
+        self.assertEqual(len(self.gparray.getSegDbList()), 17)
+
+    def test_large_array(self):
+        """ per segment lookups on 4096 primaries with mirrors """
+        gparray = make_gparray(128, 32)
+        start = time.time()
+        for db in gparray.getSegDbList():
+            gparray.getSegmentContainingDb(db)
+            gparray.getSegDbPeer(db)
+            gparray.get_list_of_primary_segments_on_host(db.getSegmentHostName())
+            gparray.get_list_of_mirror_segments_on_host(db.getSegmentHostName())
+        gparray.getHostList()
+        elapsed = time.time() - start
+        # these scanned the whole array on every call: 19s for 1024 primaries
+        self.assertTrue(elapsed < 2, 'lookups took %.2f seconds' % elapsed)
+
+class FakeCatalog:
+    """ stands in for gppylib.db.dbconn, answering the queries of GpArray.initFromCatalog """
+
+    VERSION = 'PostgreSQL 8.2.15 (Greenplum Database 4.3.10.0 build 1) on x86_64-unknown-linux-gnu'
+
+    def __init__(self):
+        self.marker = 'marker1'
+        self.queries = []
+        self.rows = [('SELECT version()', [[self.VERSION]]),
+                     ('gp_fault_strategy', [['f']]),
+                     ('JOIN pg_catalog.pg_filespace_entry', [
+                         [1, -1, 'p', 'p', 's', 'u', 'mdw', 'mdw', 5432, None, 3052, '/data/master/gpseg-1'],
+                         [2, 0, 'p', 'p', 's', 'u', 'sdw1', 'sdw1', 40000, 41000, 3052, '/data/primary/gpseg0'],
+                         [2, 0, 'p', 'p', 's', 'u', 'sdw1', 'sdw1', 40000, 41000, 16385, '/fs1/primary/gpseg0'],
+                         [3, 0, 'm', 'm', 's', 'u', 'sdw2', 'sdw2', 50000, 51000, 3052, '/data/mirror/gpseg0'],
+                         [3, 0, 'm', 'm', 's', 'u', 'sdw2', 'sdw2', 50000, 51000, 16385, '/fs1/mirror/gpseg0']]),
+                     ('unnest(san_mounts)', []),
+                     ('gp_san_configuration', []),
+                     ('FROM pg_filespace', [[3052, 'pg_system'], [16385, 'fs1']]),
+                     ('FROM pg_database', [[1, 1663, 3052], [16384, 16386, 16385]])]
+
+    def connect(self, dbURL, utility=False):
+        return Mock()
+
+    def execSQL(self, conn, sql):
+        for (text, rows) in self.rows:
+            if text in sql:
+                self.queries.append(text)
+                return rows
+        raise Exception('unexpected query %s' % sql)
+
+    def execSQLForSingleton(self, conn, sql):
+        self.queries.append('marker')
+        return self.marker
+
+class GpArrayConfigurationSnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.catalog = FakeCatalog()
+        self.url = Mock(pghost='mdw', pgport=5432)
+        gparray_module._configurationSnapshot = None
+        patch('gppylib.gparray.dbconn', self.catalog).start()
+        patch.dict(os.environ, {'MASTER_DATA_DIRECTORY': self.dir}).start()
+
+    def tearDown(self):
+        patch.stopall()
+        gparray_module._configurationSnapshot = None
+        shutil.rmtree(self.dir)
+
+    def _initFromCatalog(self):
+        # as if by a new process
+        gparray_module._configurationSnapshot = None
+        self.catalog.queries = []
+        return GpArray.initFromCatalog(self.url)
+
+    def _check_array(self, gparray):
+        self.assertEqual(gparray.getFaultStrategy(), 'f')
+        self.assertEqual([db.getSegmentDbId() for db in gparray.getDbList()], [1, 2, 3])
+        db = gparray.getSegDbByDbId(2)
+        self.assertEqual(db.getSegmentFilespaces(), {3052: '/data/primary/gpseg0', 16385: '/fs1/primary/gpseg0'})
+        self.assertEqual(db.catdirs, ['/data/primary/gpseg0/base/1', '/fs1/primary/gpseg0/16386/16384'])
+        self.assertEqual([fs.getName() for fs in gparray.getFilespaces()], ['pg_system', 'fs1'])
+
+    def test_snapshot(self):
+        self._check_array(self._initFromCatalog())
+        self.assertTrue('JOIN pg_catalog.pg_filespace_entry' in self.catalog.queries)
+        self.assertTrue(os.path.exists(os.path.join(self.dir, gparray_module.CONFIGURATION_SNAPSHOT_FILE)))
+
+        self._check_array(self._initFromCatalog())
+        self.assertEqual(self.catalog.queries, ['SELECT version()', 'marker'])
+
+    def test_snapshot_out_of_date(self):
+        self._initFromCatalog()
+        self.catalog.marker = 'marker2'
+        self.catalog.rows[2][1].append([4, 1, 'p', 'p', 's', 'u', 'sdw2', 'sdw2', 40000, 41000, 3052, '/data/primary/gpseg1'])
+        gparray = self._initFromCatalog()
+        self.assertTrue('JOIN pg_catalog.pg_filespace_entry' in self.catalog.queries)
+        self.assertEqual(len(gparray.getSegDbList()), 3)
+
+    def test_snapshot_disabled(self):
+        with patch.dict(os.environ, {'GP_GPARRAY_SNAPSHOT': '0'}):
+            self._check_array(self._initFromCatalog())
+            self._initFromCatalog()
+        self.assertFalse('marker' in self.catalog.queries)
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_unreadable_snapshot(self):
+        with open(os.path.join(self.dir, gparray_module.CONFIGURATION_SNAPSHOT_FILE), 'w') as f:
+            f.write('garbage')
+        self._check_array(self._initFromCatalog())
+        self._check_array(self._initFromCatalog())
+        self.assertEqual(self.catalog.queries, ['SELECT version()', 'marker'])
+
 def convert_bool(val):
     if val == 't':
         return True
@@ -150,39 +150,235 @@ class GpCheckCatTestCase(GpTestCase):
 
 
 
+    def test_check_scheduler__single_job__runs_checks_in_order(self):
+        ran = []
+        with patch('gpcheckcat.runOneCheck', side_effect=ran.append):
+            self.subject.CheckScheduler(['owner', 'duplicate', 'acl'], 1).run()
+        self.assertEqual(ran, ['duplicate', 'acl', 'owner'])
+
+    def test_check_scheduler__waits_for_dependencies(self):
+        ran = []
+        self.subject.all_checks['duplicate']['depends'] = ['owner']
+        try:
+            with patch('gpcheckcat.runOneCheck', side_effect=ran.append):
+                self.subject.CheckScheduler(['owner', 'duplicate', 'acl'], 4).run()
+        finally:
+            del self.subject.all_checks['duplicate']['depends']
+        self.assertEqual(sorted(ran), ['acl', 'duplicate', 'owner'])
+        self.assertTrue(ran.index('owner') < ran.index('duplicate'))
+
+    def test_check_scheduler__part_constraint_waits_for_the_checks_it_reads(self):
+        import time
+        events = []
+
+        def run(name):
+            events.append(('start', name))
+            if name != 'part_constraint':
+                time.sleep(0.05)
+            events.append(('finish', name))
+
+        names = ['part_constraint', 'foreign_key', 'inconsistent', 'missing_extraneous', 'acl']
+        with patch('gpcheckcat.runOneCheck', side_effect=run):
+            self.subject.CheckScheduler(names, len(names)).run()
+
+        started = events.index(('start', 'part_constraint'))
+        for dep in self.subject.all_checks['part_constraint']['depends']:
+            self.assertTrue(events.index(('finish', dep)) < started)
+        self.assertTrue(events.index(('start', 'acl')) < events.index(('finish', 'foreign_key')))
+
+    def test_add_remove__from_many_threads__keeps_every_entry(self):
+        import threading
+        self.subject.GV.Remove = {}
+
+        def add(i):
+            for j in range(100):
+                self.subject.addRemove(j % 3, 'DELETE %d %d;' % (i, j))
+        threads = [threading.Thread(target=add, args=(i,)) for i in range(8)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+
+        self.assertEqual(sorted(self.subject.GV.Remove.keys()), [0, 1, 2])
+        self.assertEqual(sum(len(l) for l in self.subject.GV.Remove.values()), 800)
+
+    def test_check_scheduler__raises_check_failure(self):
+        with patch('gpcheckcat.runOneCheck', side_effect=LookupError):
+            with self.assertRaises(LookupError):
+                self.subject.CheckScheduler(['owner', 'duplicate'], 2).run()
+
+    def test_check_status_is_per_thread(self):
+        import threading
+        def fail_check():
+            self.subject.GV.checkStatus = False
+        th = threading.Thread(target=fail_check)
+        th.start()
+        th.join()
+        self.assertTrue(self.subject.GV.checkStatus)
+
+    def test_connect2run__yields_the_rows_of_every_segment(self):
+        self.subject.GV.opt['-B'] = 1
+        self.db_connection.query.return_value.dictresult.return_value = [{'oid': 1}, {'oid': 2}]
+
+        rows = list(self.subject.connect2run('select oid', ('oid',)))
+
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(sorted(row[0]['dbid'] for row in rows), [0, 0, 1, 1])
+        self.assertEqual(rows[0][1], ('oid',))
+
+    def test_stream_query__fetches_in_batches_and_commits(self):
+        batches = [[(1,), (2,)], [(3,), (4,)], []]
+        queries = []
+
+        def query(qry):
+            queries.append(qry)
+            result = Mock()
+            result.listfields.return_value = ['oid']
+            if qry.startswith('FETCH'):
+                result.getresult.return_value = batches.pop(0)
+            return result
+        self.db_connection.query.side_effect = query
+
+        fields, rows = self.subject.streamQuery(self.db_connection, 'select oid from pg_class', 2)
+
+        self.assertEqual(fields, ['oid'])
+        self.assertEqual(list(rows), [(1,), (2,), (3,), (4,)])
+        self.assertEqual(queries[0], 'BEGIN')
+        cursor = queries[1].split()[1]
+        self.assertEqual(queries[1], 'DECLARE %s NO SCROLL CURSOR FOR select oid from pg_class' % cursor)
+        self.assertEqual(queries.count('FETCH 2 FROM %s' % cursor), 3)
+        self.assertEqual(queries[-2:], ['CLOSE %s' % cursor, 'COMMIT'])
+
+    def test_stream_query__when_closed_early__rolls_back(self):
+        queries = []
+
+        def query(qry):
+            queries.append(qry)
+            result = Mock()
+            result.listfields.return_value = ['oid']
+            result.getresult.return_value = [(1,), (2,)]
+            return result
+        self.db_connection.query.side_effect = query
+
+        fields, rows = self.subject.streamQuery(self.db_connection, 'select oid from pg_class', 2)
+        self.assertEqual(rows.next(), (1,))
+        rows.close()
+
+        self.assertEqual(queries[-1], 'ROLLBACK')
+        self.assertFalse('COMMIT' in queries)
+
+    def test_stream_query__when_declare_fails__rolls_back(self):
+        queries = []
+
+        def query(qry):
+            queries.append(qry)
+            if qry.startswith('DECLARE'):
+                raise Exception('syntax error')
+        self.db_connection.query.side_effect = query
+
+        with self.assertRaises(Exception):
+            self.subject.streamQuery(self.db_connection, 'select', 2)
+        self.assertEqual(queries[-1], 'ROLLBACK')
+
+    def test_stream_query__uses_a_cursor_name_per_call(self):
+        queries = []
+
+        def query(qry):
+            queries.append(qry)
+            result = Mock()
+            result.listfields.return_value = ['oid']
+            result.getresult.return_value = []
+            return result
+        self.db_connection.query.side_effect = query
+
+        self.subject.streamQuery(self.db_connection, 'select 1', 2)
+        self.subject.streamQuery(self.db_connection, 'select 2', 2)
+
+        declared = [q.split()[1] for q in queries if q.startswith('DECLARE')]
+        self.assertEqual(len(set(declared)), 2)
+
+    def test_stream_query__runs_the_preamble_of_the_check_queries_before_the_cursor(self):
+        self.subject.GV.dbname = 'my;db'
+        serializable = 'SET TRANSACTION ISOLATION LEVEL SERIALIZABLE'
+        queries = [(self.subject.missingEntryQuery(1, 'pg_class', ['oid'], ['oid']), [serializable]),
+                   (self.subject.inconsistentEntryQuery(1, 'pg_class', ['oid'], ['oid', 'relname'], ['oid', 'relname']),
+                    [serializable, 'SET gp_enable_mk_sort=off']),
+                   (self.subject.duplicateEntryQuery('pg_class', ['oid']), [serializable]),
+                   (self.subject.duplicatePersistentEntryQuery('gp_persistent_relation_node', ['relfilenode_oid'],
+                                                               'mirror_existence_state', 6), [serializable])]
+        for (qry, sets) in queries:
+            issued = []
+
+            def query(stmt):
+                issued.append(stmt)
+                result = Mock()
+                result.listfields.return_value = ['oid']
+                result.getresult.return_value = []
+                return result
+            self.db_connection.query.side_effect = query
+
+            fields, rows = self.subject.streamQuery(self.db_connection, qry, 2)
+            self.assertEqual(list(rows), [])
+
+            self.assertEqual(issued[0], 'BEGIN')
+            declares = [i for i, stmt in enumerate(issued) if stmt.startswith('DECLARE')]
+            self.assertEqual(len(declares), 1)
+            preamble = issued[1:declares[0]]
+            self.assertEqual(preamble[:-1], sets)
+            self.assertTrue(preamble[-1].startswith('CREATE TEMPORARY TABLE _tmp_master ON COMMIT DROP AS'))
+            self.assertFalse(';' in preamble[-1] or '--' in preamble[-1])
+            select = issued[declares[0]].split(' NO SCROLL CURSOR FOR ', 1)[1]
+            self.assertTrue(select.startswith('SELECT'))
+            self.assertFalse(select.rstrip().endswith(';'))
+            self.assertEqual(issued[-1], 'COMMIT')
+        self.assertTrue("d.datname = 'my;db'" in select)
+
+    def test_process_inconsistent_entry_result__groups_sorted_rows_per_key(self):
+        gpObj = Mock()
+        colname = ['oid', 'relname', 'segids']
+        rows = iter([(10, 't1', '{0}'), (10, 't1x', '{1}'), (11, 't2', '{0}'), (11, 't2x', '{-1}')])
+
+        with patch('gpcheckcat.getGPObject', return_value=gpObj) as mock_getGPObject:
+            self.subject.processInconsistentEntryResult('pg_class', ['oid'], colname, rows, ['oid'])
+
+        self.assertEqual([args for args, _ in mock_getGPObject.call_args_list], [(10, 'pg_class'), (11, 'pg_class')])
+        issues = [args[0] for args, _ in gpObj.addInconsistentIssue.call_args_list]
+        self.assertEqual([len(issue.rows) for issue in issues], [2, 2])
+
     ####################### PRIVATE METHODS #######################
     def _run_batch_size_experiment(self, num_primaries):
         BATCH_SIZE = 4
         self.subject.GV.opt['-B'] = BATCH_SIZE
-        self.num_batches = 0
-        self.num_joins = 0
-        self.num_starts = 0
-        self.is_remainder_case = False
+        self.running = 0
+        self.max_running = 0
+        self.num_queries = 0
         for i in range(2, num_primaries):
             self.subject.GV.cfg[i] = dict(hostname='host1', port=123, id=1, address='123',
                                           datadir='dir', content=1, dbid=i)
 
-        def count_starts():
-            self.num_starts += 1
-
-        def count_joins():
-            if self.num_starts != BATCH_SIZE:
-                self.is_remainder_case = True
-            self.num_joins += 1
-            if self.num_joins == BATCH_SIZE:
-                self.num_batches += 1
-                self.num_joins = 0
-                self.num_starts = 0
-
-        with patch('gpcheckcat.execThread') as mock_execThread:
-            mock_execThread.return_value.cfg = self.subject.GV.cfg[0]
-            mock_execThread.return_value.join.side_effect = count_joins
-            mock_execThread.return_value.start.side_effect = count_starts
+        def make_thread(cfg, db, qry, done):
+            thread = Mock(cfg=cfg, error=None)
+            thread.curs.dictresult.return_value = []
+
+            def start():
+                self.running += 1
+                self.num_queries += 1
+                self.max_running = max(self.max_running, self.running)
+                done.put(thread)
+
+            def join():
+                self.running -= 1
+
+            thread.start.side_effect = start
+            thread.join.side_effect = join
+            return thread
+
+        with patch('gpcheckcat.execThread', side_effect=make_thread):
             self.subject.runOneCheck('persistent')
 
-            self.assertTrue(self.num_batches > 0)
-            if self.is_remainder_case:
-                self.assertTrue(self.num_joins < BATCH_SIZE)
+        self.assertEqual(self.max_running, BATCH_SIZE)
+        self.assertEqual(self.running, 0)
+        self.assertEqual(self.num_queries % len(self.subject.GV.cfg), 0)
 
 if __name__ == '__main__':
     run_tests()
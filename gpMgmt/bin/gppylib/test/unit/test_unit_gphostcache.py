@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+#
+# Copyright (c) Greenplum Inc 2008. All Rights Reserved.
+#
+
+""" Unittesting for gphostcache module
+"""
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest2 as unittest
+from mock import Mock, patch
+
+from gppylib import gphostcache
+from gppylib.gparray import GpDB
+from gppylib.gphostcache import GpHostCache, GpInterfaceToHostNameCache, LocalHostNameResolver, \
+                                readHostCacheFile, updateHostCacheFile
+
+class FakeCommand:
+    """ stands in for the Hostname and Ping commands, answering from a map """
+
+    answers = {}    # host -> hostname, or None if it is unreachable
+    created = []
+
+    def __init__(self, name, host=None, ctxt=None, remoteHost=None):
+        self.host = host or remoteHost
+        self.hostToPing = self.host
+        self.created.append(self.host)
+
+    def get_results(self):
+        return Mock(rc=0 if self.answers.get(self.host) else 1)
+
+    def was_successful(self):
+        return self.get_results().rc == 0
+
+    def get_hostname(self):
+        return self.answers[self.host]
+
+class FakePool:
+
+    def __init__(self):
+        self.completed = []
+
+    def addCommand(self, cmd):
+        self.completed.append(cmd)
+
+    def join(self):
+        pass
+
+    def getCompletedItems(self):
+        return list(self.completed)
+
+    def empty_completed_items(self):
+        self.completed = []
+
+class GpHostCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cachefile = os.path.join(self.dir, '.gphostcache')
+        FakeCommand.answers = {}
+        FakeCommand.created = []
+        patch('gppylib.gphostcache.CACHEFILE', self.cachefile).start()
+        patch('gppylib.gphostcache.unix.Hostname', FakeCommand).start()
+        patch('gppylib.gphostcache.unix.Ping', FakeCommand).start()
+        patch('gppylib.gphostcache.LocalHostNameResolver.resolve', return_value=None).start()
+
+    def tearDown(self):
+        patch.stopall()
+        shutil.rmtree(self.dir)
+
+    def _write(self, lines):
+        with open(self.cachefile, 'w') as fp:
+            fp.write('\n'.join(lines) + '\n')
+
+    def test_lookup_and_cache(self):
+        FakeCommand.answers = {'sdw1-1': 'sdw1', 'sdw1-2': 'sdw1'}
+        cache = GpInterfaceToHostNameCache(FakePool(), ['sdw1-1', 'sdw1-2', 'sdw2-1'], [None, None, 'sdw2'])
+        self.assertEqual(sorted(FakeCommand.created), ['sdw1-1', 'sdw1-2'])
+        self.assertEqual(cache.getHostName('sdw1-2'), 'sdw1')
+        entries = readHostCacheFile()
+        self.assertEqual(dict((i, h) for (i, (h, t)) in entries.items()),
+                         {'sdw1-1': 'sdw1', 'sdw1-2': 'sdw1', 'sdw2-1': 'sdw2'})
+
+        FakeCommand.created = []
+        cache = GpInterfaceToHostNameCache(FakePool(), ['sdw1-1', 'sdw1-2'], [None, None])
+        self.assertEqual(FakeCommand.created, [])
+        self.assertEqual(cache.getHostName('sdw1-1'), 'sdw1')
+
+    def test_expired_entries(self):
+        old = int(time.time() - gphostcache.HOSTCACHE_TTL - 1)
+        self._write(['sdw1-1:sdw1:%d' % old, 'sdw1-2:sdw1:%d' % time.time()])
+        self.assertEqual(readHostCacheFile().keys(), ['sdw1-2'])
+
+    def test_old_format(self):
+        self._write(['# comment', 'sdw1-1:sdw1', 'bad line'])
+        self.assertEqual(readHostCacheFile()['sdw1-1'][0], 'sdw1')
+        old = time.time() - gphostcache.HOSTCACHE_TTL - 1
+        os.utime(self.cachefile, (old, old))
+        self.assertEqual(readHostCacheFile(), {})
+
+    def test_negative_cache(self):
+        cache = GpInterfaceToHostNameCache(FakePool(), ['sdw9-1'], [None])
+        self.assertEqual(cache.getHostName('sdw9-1'), None)
+        self.assertEqual(readHostCacheFile()['sdw9-1'][0], None)
+
+        FakeCommand.created = []
+        FakeCommand.answers = {'sdw9-1': 'sdw9'}
+        cache = GpInterfaceToHostNameCache(FakePool(), ['sdw9-1'], [None])
+        self.assertEqual(FakeCommand.created, [])
+        self.assertEqual(cache.getHostName('sdw9-1'), None)
+
+        old = int(time.time() - gphostcache.HOSTCACHE_NEGATIVE_TTL - 1)
+        self._write(['sdw9-1::%d' % old])
+        cache = GpInterfaceToHostNameCache(FakePool(), ['sdw9-1'], [None])
+        self.assertEqual(cache.getHostName('sdw9-1'), 'sdw9')
+
+    def test_update_merges_entries(self):
+        now = int(time.time())
+        updateHostCacheFile({'sdw1-1': ('sdw1', now)})
+        updateHostCacheFile({'sdw2-1': ('sdw2', now), 'sdw3-1': (None, now)})
+        self.assertEqual(readHostCacheFile(), {'sdw1-1': ('sdw1', now), 'sdw2-1': ('sdw2', now), 'sdw3-1': (None, now)})
+        self.assertEqual(sorted(os.listdir(self.dir)), ['.gphostcache', '.gphostcache.lock'])
+
+    def test_resolved_locally(self):
+        with patch('gppylib.gphostcache.LocalHostNameResolver.resolve', return_value='sdw1'):
+            cache = GpInterfaceToHostNameCache(FakePool(), ['sdw1-1'], [None])
+        self.assertEqual(FakeCommand.created, [])
+        self.assertEqual(cache.getHostName('sdw1-1'), 'sdw1')
+        self.assertEqual(readHostCacheFile()['sdw1-1'][0], 'sdw1')
+
+    def test_ping_hosts(self):
+        dbs = [GpDB(0, 'p', 2, 'p', 's', 'u', 'sdw1', 'sdw1-1', 40000, '/data/primary/gpseg0', None),
+               GpDB(1, 'p', 3, 'p', 's', 'u', 'sdw1', 'sdw1-2', 40001, '/data/primary/gpseg1', None),
+               GpDB(2, 'p', 4, 'p', 's', 'u', 'sdw2', 'sdw2-1', 40000, '/data/primary/gpseg2', None),
+               GpDB(3, 'p', 5, 'p', 's', 'u', 'sdw3', 'sdw3-1', 40000, '/data/primary/gpseg3', None)]
+        gparray = Mock()
+        gparray.getSegDbList.return_value = dbs
+        pool = FakePool()
+        hostcache = GpHostCache(gparray, pool)
+
+        FakeCommand.answers = {'sdw2': True, 'sdw1-2': True}
+        failed = hostcache.ping_hosts(pool)
+        self.assertEqual(failed, [dbs[3]])
+        self.assertEqual(sorted(FakeCommand.created), ['sdw1', 'sdw1-1', 'sdw1-2', 'sdw2', 'sdw3', 'sdw3-1'])
+        self.assertEqual(sorted(h.hostname for h in hostcache.get_hosts()), ['sdw1-2', 'sdw2'])
+        self.assertEqual(pool.completed, [])
+
+class LocalHostNameResolverTestCase(unittest.TestCase):
+
+    def test_resolve(self):
+        resolver = LocalHostNameResolver(['sdw1'])
+        self.assertEqual(resolver.resolve('127.0.0.1'), socket.gethostname())
+        self.assertEqual(resolver.resolve('nosuchhost.invalid'), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,7 +7,8 @@ from gppylib import gplog
 from mock import patch
 from gppylib.mainUtils import ExceptionNoStackTraceNeeded
 from gprestore_filter import get_table_schema_set, extract_schema, extract_table, \
-                            process_data, get_table_info, process_schema, check_valid_schema, check_valid_table, check_dropped_table
+                            process_data, get_table_info, process_schema, check_valid_schema, check_valid_table, check_dropped_table, \
+                            process_data_file, read_copy_index, get_copy_index_filename
 
 
 logger = gplog.get_unittest_logger()
@@ -3143,3 +3144,97 @@ GRANT ALL ON TABLE "Ж" TO user_role_b;
         with open(outfile, 'r') as fd:
             results = fd.read()
         self.assertEquals(results, expected_out)
+
+    copy_index_dump = """SET statement_timeout = 0;
+
+SET search_path = pepper, pg_catalog;
+
+COPY ao_table (column1, column2) FROM stdin;
+3	backup
+7	backup
+\\.
+
+COPY heap_table (column1) FROM stdin;
+1
+\\.
+
+SET search_path = "S 1", pg_catalog;
+
+COPY "T 1" (a) FROM stdin;
+5
+\\.
+
+"""
+
+    def _process_data_file(self, dump_file, dump_tables, schema_level_restore_list=None):
+        out_name = os.path.join(os.getcwd(), 'outfile')
+        try:
+            dump_schemas = set([schema for (schema, table) in dump_tables])
+            with open(out_name, 'w') as fdout:
+                process_data_file(dump_schemas, dump_tables, dump_file, fdout, None, schema_level_restore_list)
+            with open(out_name, 'r') as fd:
+                return fd.read()
+        finally:
+            os.remove(out_name)
+
+    def test_process_data_file_copy_index(self):
+        in_name = os.path.join(os.getcwd(), 'infile')
+        with open(in_name, 'w') as fd:
+            fd.write(self.copy_index_dump)
+
+        try:
+            dump_tables = set([('pepper', 'heap_table'), ('S 1', 'T 1')])
+            expected_out = """SET search_path = pepper, pg_catalog;
+COPY heap_table (column1) FROM stdin;
+1
+\\.
+SET search_path = "S 1", pg_catalog;
+COPY "T 1" (a) FROM stdin;
+5
+\\.
+"""
+            # the first restore reads the whole dump and writes the index
+            self.assertEquals(self._process_data_file(in_name, dump_tables), expected_out)
+            entries = read_copy_index(in_name)
+            self.assertEquals([self.copy_index_dump[start:end].split(' ')[1] for (start, end, _, _) in entries],
+                              ['ao_table', 'heap_table', '"T'])
+
+            # the next ones only read the blocks of the restored tables
+            with patch('gprestore_filter.index_copy_blocks') as mock:
+                self.assertEquals(self._process_data_file(in_name, dump_tables), expected_out)
+                self.assertFalse(mock.called)
+                self.assertEquals(self._process_data_file(in_name, set(), ['pepper']), """SET search_path = pepper, pg_catalog;
+COPY ao_table (column1, column2) FROM stdin;
+3	backup
+7	backup
+\\.
+SET search_path = pepper, pg_catalog;
+COPY heap_table (column1) FROM stdin;
+1
+\\.
+""")
+        finally:
+            os.remove(in_name)
+            os.remove(get_copy_index_filename(in_name))
+
+    def test_process_data_file_stale_copy_index(self):
+        in_name = os.path.join(os.getcwd(), 'infile')
+        with open(in_name, 'w') as fd:
+            fd.write(self.copy_index_dump)
+
+        try:
+            dump_tables = set([('pepper', 'ao_table')])
+            self._process_data_file(in_name, dump_tables)
+            with open(in_name, 'a') as fd:
+                fd.write('--\n')
+            self.assertEquals(read_copy_index(in_name), None)
+            self.assertEquals(self._process_data_file(in_name, dump_tables), """SET search_path = pepper, pg_catalog;
+COPY ao_table (column1, column2) FROM stdin;
+3	backup
+7	backup
+\\.
+""")
+            self.assertNotEquals(read_copy_index(in_name), None)
+        finally:
+            os.remove(in_name)
+            os.remove(get_copy_index_filename(in_name))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#
+# Copyright (c) Greenplum Inc 2008. All Rights Reserved.
+#
+
+""" Unittesting for logfilter module
+"""
+import gzip
+import os
+import shutil
+import tempfile
+import unittest2 as unittest
+from datetime import datetime, timedelta
+
+from gppylib import logfilter
+from gppylib.logfilter import SeekTimestamp, SeekTimestampRange, StopAtTimestamp, ReadTimestampIndex, \
+                              TimestampIndexFilename, GroupByTimestamp, MergeByTimestamp, SplitLogFile
+
+START = datetime(2016, 1, 1)
+
+class LogFilterSeekTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.lines = []
+        for i in range(20000):
+            stamp = (START + timedelta(seconds=i)).strftime('%Y-%m-%d %H:%M:%S')
+            self.lines.append('%s.000000 PST|con%d|LOG:  statement %d\n' % (stamp, i, i))
+            if i % 10 == 0:
+                self.lines.append('DETAIL:  line without a timestamp\n')
+        self.logfile = os.path.join(self.dir, 'gpdb.log')
+        with open(self.logfile, 'w') as fd:
+            fd.writelines(self.lines)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _first_line_of(self, begin):
+        stamp = begin.strftime('%Y-%m-%d %H:%M:%S')
+        return [l for l in self.lines if l >= stamp and logfilter.timestampPattern.match(l)][0]
+
+    def test_seek_timestamp(self):
+        begin = START + timedelta(hours=3)
+        with open(self.logfile) as fd:
+            offset = SeekTimestamp(fd, begin)
+            rest = fd.readlines()
+
+        self.assertTrue(offset > 0)
+        self.assertTrue(logfilter.timestampPattern.match(rest[0]))
+        self.assertTrue(rest[0] < (begin - logfilter.SEEK_SLACK).strftime('%Y-%m-%d %H:%M:%S'))
+        self.assertTrue(self._first_line_of(begin) in rest)
+
+    def test_seek_timestamp_before_start(self):
+        with open(self.logfile) as fd:
+            self.assertEqual(SeekTimestamp(fd, START - timedelta(days=1)), 0)
+
+    def test_seek_timestamp_after_end(self):
+        with open(self.logfile) as fd:
+            SeekTimestamp(fd, START + timedelta(days=1))
+            rest = fd.readlines()
+        self.assertTrue(len(rest) < len(self.lines) / 10)
+
+    def test_stop_at_timestamp(self):
+        end = START + timedelta(minutes=10)
+        lines = list(StopAtTimestamp(self.lines, end))
+        last = (end + logfilter.SEEK_SLACK).strftime('%Y-%m-%d %H:%M:%S')
+        self.assertTrue(all(l < last for l in lines if logfilter.timestampPattern.match(l)))
+        self.assertEqual(self.lines[len(lines)][:19], last)
+
+    def test_seek_timestamp_range_gzip(self):
+        gzname = self.logfile + '.gz'
+        with gzip.open(gzname, 'wb') as fd:
+            fd.writelines(self.lines)
+        begin = START + timedelta(hours=2)
+        end = begin + timedelta(minutes=5)
+
+        old_interval = logfilter.INDEX_INTERVAL
+        logfilter.INDEX_INTERVAL = 64 * 1024
+        try:
+            for i in range(2):
+                fd = gzip.GzipFile(gzname, 'rb')
+                try:
+                    lines = list(SeekTimestampRange(fd, gzname, True, begin, end))
+                finally:
+                    fd.close()
+                self.assertTrue(len(lines) < len(self.lines) / 2)
+                self.assertTrue(self._first_line_of(begin) in lines)
+                self.assertTrue(os.path.exists(TimestampIndexFilename(gzname)))
+        finally:
+            logfilter.INDEX_INTERVAL = old_interval
+
+        index = ReadTimestampIndex(gzname)
+        self.assertTrue(len(index) > 1)
+        self.assertEqual(index[0], ('2016-01-01 00:00:00.000000', 0))
+
+    def test_split_log_file(self):
+        with open(self.logfile) as fd:
+            chunks = SplitLogFile(fd, 64 * 1024)
+            self.assertTrue(len(chunks) > 1)
+            self.assertEqual(chunks[0][0], 0)
+            self.assertEqual(chunks[-1][1], os.path.getsize(self.logfile))
+            data = []
+            for (start, stop) in chunks:
+                fd.seek(start)
+                chunk = fd.read(stop - start)
+                self.assertTrue(logfilter.timestampPattern.match(chunk))
+                data.append(chunk)
+        self.assertEqual(''.join(data), ''.join(self.lines))
+
+    def test_split_log_file_keeps_same_timestamp_lines_together(self):
+        lines = []
+        for i in range(100):
+            stamp = (START + timedelta(seconds=i / 50)).strftime('%Y-%m-%d %H:%M:%S')
+            lines.append('%s.000000 PST|con%d|LOG:  statement %d\n' % (stamp, i, i))
+        with open(self.logfile, 'w') as fd:
+            fd.writelines(lines)
+        with open(self.logfile) as fd:
+            chunks = SplitLogFile(fd, 1024)
+            groups = []
+            for (start, stop) in chunks:
+                fd.seek(start)
+                groups.extend(GroupByTimestamp(fd.read(stop - start).splitlines(True)))
+        self.assertEqual(chunks[1][0], len(''.join(lines[:50])))
+        self.assertEqual(groups, list(GroupByTimestamp(lines)))
+
+    def test_split_log_file_range(self):
+        begin = START + timedelta(hours=1)
+        end = begin + timedelta(minutes=30)
+        with open(self.logfile) as fd:
+            chunks = SplitLogFile(fd, 16 * 1024, begin, end)
+            fd.seek(chunks[0][0])
+            data = fd.read(chunks[-1][1] - chunks[0][0])
+        self.assertTrue(len(data) < os.path.getsize(self.logfile) / 2)
+        self.assertTrue(self._first_line_of(begin) in data)
+        self.assertTrue(self._first_line_of(end - timedelta(seconds=1)) in data)
+        self.assertFalse(self._first_line_of(end + 2 * logfilter.SEEK_SLACK) in data)
+
+    def test_read_timestamp_index_stale(self):
+        with open(TimestampIndexFilename(self.logfile), 'w') as fd:
+            fd.write('%s\t1\t1\n' % logfilter.TIMESTAMP_INDEX_HEADER)
+            fd.write('2016-01-01 00:00:00.000000\t0\n')
+        self.assertEqual(ReadTimestampIndex(self.logfile), None)
+
+class LogFilterMergeTestCase(unittest.TestCase):
+
+    def test_merge_by_timestamp(self):
+        log1 = ['2016-01-01 00:00:01 PST|a\n', 'detail a\n', '2016-01-01 00:00:03 PST|b\n']
+        log2 = ['2016-01-01 00:00:00 PST|c\n', '2016-01-01 00:00:01 PST|d\n', '2016-01-01 00:00:04 PST|e\n']
+        merged = list(MergeByTimestamp([GroupByTimestamp(log1), GroupByTimestamp(log2)]))
+        self.assertEqual(merged, [(1, ['2016-01-01 00:00:00 PST|c\n']),
+                                  (0, ['2016-01-01 00:00:01 PST|a\n', 'detail a\n']),
+                                  (1, ['2016-01-01 00:00:01 PST|d\n']),
+                                  (0, ['2016-01-01 00:00:03 PST|b\n']),
+                                  (1, ['2016-01-01 00:00:04 PST|e\n'])])
+
+    def test_merge_by_timestamp_empty(self):
+        self.assertEqual(list(MergeByTimestamp([[], GroupByTimestamp(['2016-01-01 00:00:00 PST|a\n'])])),
+                         [(1, ['2016-01-01 00:00:00 PST|a\n'])])
+
+if __name__ == '__main__':
+    unittest.main()
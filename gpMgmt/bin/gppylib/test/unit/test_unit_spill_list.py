@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+
+from gp_unittest import *
+from gpcheckcat_modules.spill_list import SpillList, merge_sorted_unique
+
+
+class SpillListTestCase(GpTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.subject = SpillList(max_in_memory=3, tmpdir=self.tmpdir)
+
+    def tearDown(self):
+        self.subject.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_sorted_unique__without_spilling__returns_sorted_entries(self):
+        for entry in ['b', 'a', 'b']:
+            self.subject.append(entry)
+
+        self.assertEqual(list(self.subject.sorted_unique()), ['a', 'b'])
+        self.assertEqual(len(self.subject), 3)
+
+    def test_append__over_the_limit__spills_sorted_runs_to_disk(self):
+        for entry in ['e', 'c', 'a', 'd', 'b', 'a', 'f']:
+            self.subject.append(entry)
+
+        self.assertEqual(len(self.subject.runs), 2)
+        self.assertEqual(len(self.subject.entries), 1)
+        self.assertEqual(list(self.subject.sorted_unique()), ['a', 'b', 'c', 'd', 'e', 'f'])
+
+    def test_sorted_unique__keeps_multiline_statements(self):
+        stmt = '--Object Name: foo\n--Remove pg_class for 1\nDELETE FROM pg_class WHERE oid = \'1\';'
+        for entry in [stmt, 'x', 'y', stmt]:
+            self.subject.append(entry)
+
+        self.assertEqual(list(self.subject.sorted_unique()), [stmt, 'x', 'y'])
+
+    def test_close__removes_spill_files(self):
+        for entry in ['a', 'b', 'c']:
+            self.subject.append(entry)
+        runs = list(self.subject.runs)
+
+        self.subject.close()
+
+        self.assertFalse(any(os.path.exists(run) for run in runs))
+        self.assertEqual(len(self.subject), 0)
+
+    def test_merge_sorted_unique__merges_and_drops_duplicates(self):
+        self.assertEqual(list(merge_sorted_unique(iter(['a', 'c']), iter(['a', 'b', 'c']))), ['a', 'b', 'c'])
+
+
+if __name__ == '__main__':
+    run_tests()
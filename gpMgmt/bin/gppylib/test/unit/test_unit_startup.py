@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+#
+# Copyright (c) Greenplum Inc 2008. All Rights Reserved.
+#
+
+""" Startup cost of the management utilities
+
+The tests start fresh interpreters and fail when an import pulls in a
+module that should only be loaded on first use.  The import time budgets
+depend on the load of the host, so they are only checked when
+GP_STARTUP_BENCHMARK is set (make check-startup).  To see where the time
+goes, run a tool with GP_IMPORT_PROFILE=1.
+"""
+import os
+import subprocess
+import sys
+import time
+import unittest2 as unittest
+from StringIO import StringIO
+
+import gppylib
+from gppylib.gpimport import lazy_import, LazyModule, ImportProfiler
+
+BIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(gppylib.__file__)))
+SBIN_DIR = os.path.join(os.path.dirname(BIN_DIR), 'sbin')
+
+# Milliseconds an import may take on top of starting a bare interpreter
+IMPORT_BUDGETS = [('gppylib.commands.base', 75),
+                  ('gppylib.commands.unix', 75),
+                  ('gppylib.commands.gp', 125),
+                  ('gppylib.mainUtils', 100),
+                  ('gppylib.operations.utils', 75)]
+
+# Segment host helpers, run many times per management operation
+HELPERS = ['gpsegstart.py', 'gpsegstop.py', 'gpoperation.py']
+
+# Modules only some code paths need, which must not be imported at startup
+LAZY_MODULES = ['paramiko', 'yaml', 'psutil', 'pygresql', 'lockfile', 'figleaf', 'uuid']
+
+def _environ(**kwargs):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([BIN_DIR, os.path.join(BIN_DIR, 'lib'), env.get('PYTHONPATH', '')])
+    env.setdefault('GPHOME', BIN_DIR)
+    env.update(kwargs)
+    return env
+
+def _run(args, env, runs=3):
+    """ returns (best time in ms, stderr of the last run) """
+    best = None
+    for i in range(runs):
+        start = time.time()
+        p = subprocess.Popen(args, stdin=open(os.devnull), stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        (out, err) = p.communicate()
+        elapsed = (time.time() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, err)
+
+def _loaded(report):
+    """ names of the modules in an ImportProfiler report """
+    names = set()
+    for line in report.splitlines()[1:]:
+        name = line.split('|')[-1].strip().split(' ')[0]
+        names.add(name.split('.')[0])
+    return names
+
+
+class StartupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = _environ()
+
+    @unittest.skipUnless(os.environ.get('GP_STARTUP_BENCHMARK'), 'set GP_STARTUP_BENCHMARK to check import times')
+    def test_import_budgets(self):
+        (bare, err) = _run([sys.executable, '-c', 'pass'], self.env)
+        for (module, budget) in IMPORT_BUDGETS:
+            (elapsed, err) = _run([sys.executable, '-c', 'import %s' % module], self.env)
+            self.assertTrue(elapsed - bare <= budget,
+                            'import %s took %d ms, the budget is %d ms\n%s' % (module, elapsed - bare, budget, err))
+
+    def test_imports_are_lazy(self):
+        code = 'import sys, %s; sys.stderr.write(" ".join(sys.modules))' % ', '.join(m for (m, b) in IMPORT_BUDGETS)
+        (elapsed, err) = _run([sys.executable, '-c', code], self.env, runs=1)
+        self.assertEqual(set(LAZY_MODULES) & set(err.split()), set())
+
+    def test_helpers_import_profile(self):
+        env = _environ(GP_IMPORT_PROFILE='1')
+        for helper in HELPERS:
+            (elapsed, err) = _run([sys.executable, os.path.join(SBIN_DIR, helper), '--help'], env, runs=1)
+            report = err[err.index('import time:'):]
+            self.assertEqual(set(LAZY_MODULES) & _loaded(report), set(), '%s\n%s' % (helper, report))
+
+
+class LazyImportTestCase(unittest.TestCase):
+
+    def test_lazy_import(self):
+        self.assertTrue(lazy_import('os') is os)
+        module = lazy_import('gppylib.test.unit.gp_unittest')
+        self.assertTrue(isinstance(module, LazyModule))
+        self.assertTrue(module.GpTestCase is not None)
+        self.assertTrue('gppylib.test.unit.gp_unittest' in sys.modules)
+
+    def test_lazy_import_setattr(self):
+        module = LazyModule('gpimport_test_module')
+        real = type(sys)('gpimport_test_module')
+        sys.modules['gpimport_test_module'] = real
+        try:
+            module.x = 1
+            self.assertEqual(real.x, 1)
+            del module.x
+            self.assertFalse(hasattr(real, 'x'))
+        finally:
+            del sys.modules['gpimport_test_module']
+
+    def test_import_profiler(self):
+        out = StringIO()
+        profiler = ImportProfiler(out)
+        sys.modules.pop('colorsys', None)
+        profiler.install()
+        try:
+            import colorsys
+            import os
+        finally:
+            profiler.uninstall()
+        profiler.report()
+        self.assertEqual(_loaded(out.getvalue()), set(['colorsys']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -32,6 +32,8 @@ schema_expr = '; Schema: '
 owner_expr = '; Owner: '
 comment_data_expr_a = '-- Data: '
 comment_data_expr_b = '-- Data for Name: '
+copy_index_suffix = '_copy_index'
+copy_index_header = 'gprestore_filter copy index 1'
 
 
 def get_table_info(line, cur_comment_expr):
@@ -324,6 +326,104 @@ def process_data(dump_schemas, dump_tables, fdin, fdout, change_schema=None, sch
         if output:
             fdout.write(line)
 
+def get_copy_index_filename(dump_file):
+    return dump_file + copy_index_suffix
+
+def index_copy_blocks(fdin, entries):
+    """
+    Passes the lines of a data dump through while recording in entries the
+    (start offset, end offset, search path line, COPY line) of every COPY
+    block, the end offset being just past its terminating \. line.
+    """
+    offset = 0
+    search_path_line = None
+    block = None
+    for line in fdin:
+        if block is None:
+            if (line[0] == set_start) and line.startswith(search_path_expr):
+                search_path_line = line
+            elif (line[0] == copy_start) and line.startswith(copy_expr) and line.endswith(copy_expr_end):
+                block = (offset, line)
+        elif (line[0] == copy_end_start) and line.startswith(copy_end_expr):
+            if search_path_line is not None:
+                entries.append((block[0], offset + len(line), search_path_line, block[1]))
+            block = None
+        offset += len(line)
+        yield line
+
+def write_copy_index(dump_file, entries):
+    """
+    Writes the COPY block index of a data dump file next to it.  The index
+    is only an optimization, so failing to write it is not an error.
+    """
+    index_file = get_copy_index_filename(dump_file)
+    tmp_file = index_file + '.tmp'
+    try:
+        st = os.stat(dump_file)
+        with open(tmp_file, 'w') as fd:
+            fd.write('%s\t%d\t%d\n' % (copy_index_header, st.st_size, int(st.st_mtime)))
+            for (start, end, search_path_line, copy_line) in entries:
+                fd.write('%d\t%d\t%s\t%s\n' % (start, end, search_path_line.encode('string_escape'),
+                                               copy_line.encode('string_escape')))
+        os.rename(tmp_file, index_file)
+    except (IOError, OSError):
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+def read_copy_index(dump_file):
+    """
+    Returns the COPY block entries of the index of a data dump file, or None
+    if there is no index or it does not belong to the current dump file.
+    """
+    index_file = get_copy_index_filename(dump_file)
+    if not os.path.exists(index_file):
+        return None
+    st = os.stat(dump_file)
+    entries = []
+    with open(index_file) as fd:
+        header = fd.readline().rstrip('\n').split('\t')
+        if header != [copy_index_header, str(st.st_size), str(int(st.st_mtime))]:
+            return None
+        for line in fd:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 4:
+                return None
+            entries.append((int(fields[0]), int(fields[1]),
+                            fields[2].decode('string_escape'), fields[3].decode('string_escape')))
+    return entries
+
+def read_indexed_copy_blocks(fdin, entries, dump_tables, schema_level_restore_list=None):
+    """
+    Yields the lines of the COPY blocks of the tables to restore, each
+    preceded by its search path, seeking over all the other blocks.
+    """
+    for (start, end, search_path_line, copy_line) in entries:
+        schema = removeEscapingDoubleQuoteInSQLString(extract_schema(search_path_line), False)
+        table = removeEscapingDoubleQuoteInSQLString(extract_table(copy_line), False)
+        if not check_valid_table(schema, table, dump_tables, schema_level_restore_list):
+            continue
+        yield search_path_line
+        fdin.seek(start)
+        while fdin.tell() < end:
+            yield fdin.readline()
+
+def process_data_file(dump_schemas, dump_tables, dump_file, fdout, change_schema=None, schema_level_restore_list=None):
+    """
+    Filters a data dump file like process_data.  With a COPY block index only
+    the blocks of the tables to restore are read; otherwise the whole file is
+    read and the index is written for the next restore.
+    """
+    entries = read_copy_index(dump_file)
+    with open(dump_file, 'rb') as fdin:
+        if entries is not None:
+            lines = read_indexed_copy_blocks(fdin, entries, dump_tables, schema_level_restore_list)
+            process_data(dump_schemas, dump_tables, lines, fdout, change_schema, schema_level_restore_list)
+        else:
+            entries = []
+            lines = index_copy_blocks(fdin, entries)
+            process_data(dump_schemas, dump_tables, lines, fdout, change_schema, schema_level_restore_list)
+            write_copy_index(dump_file, entries)
+
 def get_schema_level_restore_list(schema_level_restore_file=None):
     """
     Note: white space in schema and table name is supported now, don't do strip on them
@@ -357,6 +457,7 @@ if __name__ == "__main__":
     parser.add_option('-m', '--master_only', action='store_true')
     parser.add_option('-c', '--change-schema-file', type='string', default=None)
     parser.add_option('-s', '--schema-level-file', type='string', default=None)
+    parser.add_option('-f', '--dump-file', type='string', default=None)
     (options, args) = parser.parse_args()
     if not (options.tablefile or options.schema_level_file):
         raise Exception('-t table file name or -s schema level file name must be specified')
@@ -377,6 +478,8 @@ if __name__ == "__main__":
 
     if options.master_only:
         process_schema(schemas, tables, sys.stdin, sys.stdout, change_schema_name, schema_level_restore_list)
+    elif options.dump_file:
+        process_data_file(schemas, tables, options.dump_file, sys.stdout, change_schema_name, schema_level_restore_list)
     else:
         process_data(schemas, tables, sys.stdin, sys.stdout, change_schema_name, schema_level_restore_list)
 
@@ -11,8 +11,10 @@ if sys.hexversion<0x2040400:
 import cPickle
 import inspect
 import hashlib
+import Queue
 import signal
 import socket
+import struct
 import subprocess
 import threading
 import zlib
@@ -233,6 +235,84 @@ class ReaderThread(threading.Thread):
             self.lines.append(line.rstrip())
 
 
+class SourceReader:
+    '''
+    Reads chunks of the files in a source directory.  The file last read is
+    kept open so the consecutive chunks of a file are read without reopening
+    it.  A SourceReader must only be used by a single thread.
+    '''
+    
+    def __init__(self, sourceDir):
+        self.sourceDir = sourceDir
+        self.filename = None
+        self.file = None
+
+    def read(self, filename, offset, size):
+        '''
+        Read a chunk of the specified size at the specified offset from the
+        file identified.
+        '''
+        if filename != self.filename:
+            self.close()
+            self.file = open(os.path.join(self.sourceDir, filename), 'rb')
+            self.filename = filename
+        self.file.seek(offset)
+        a = self.file.read(size)
+        assert len(a)==size
+        return a
+
+    def close(self):
+        if self.file:
+            self.file.close()
+        self.file = None
+        self.filename = None
+
+
+class DataSender(threading.Thread):
+    '''
+    Sends the chunks requested for one data stream of RemotePysync over the
+    stream's socket.  Each chunk is preceded by its length so a single 
+    'getData' command can request many chunks; the chunks are read and sent
+    while the command loop goes on serving other streams.
+    '''
+    
+    def __init__(self, index, sock, sourceDir, compress):
+        self.socket = sock
+        self.reader = SourceReader(sourceDir)
+        self.compress = compress
+        self.queue = Queue.Queue()
+        threading.Thread.__init__(self, name="pysync_stream%d" % index)
+        self.setDaemon(True)
+
+    def send(self, chunks):
+        '''
+        Queue a list of (filename, offset, size) chunks to send.
+        '''
+        self.queue.put(chunks)
+
+    def stop(self):
+        self.queue.put(None)
+
+    def run(self):
+        try:
+            try:
+                while True:
+                    chunks = self.queue.get()
+                    if chunks is None:
+                        break
+                    for filename, offset, size in chunks:
+                        data = self.reader.read(filename, offset, size)
+                        if self.compress:
+                            data = zlib.compress(data, 1)
+                        self.socket.sendall(struct.pack('!I', len(data)) + data)
+            except Exception, e:
+                # Closing the socket fails the receiving RemotePysync
+                sys.stderr.write("%s failed: %s\n" % (self.getName(), e))
+        finally:
+            self.reader.close()
+            self.socket.close()
+
+
 class LocalPysync:
     '''
     The LocalPysync class initiates a directory synchronization task by starting
@@ -269,7 +349,6 @@ class LocalPysync:
         self.options = Options()
         self.usingProxy = False
         self.sshargs = []
-        self.cache = [None]
         self.exclude = set()
         self.include = set()
         self.recordProgressCallback = recordProgressCallback
@@ -304,6 +383,15 @@ class LocalPysync:
             elif a[0]=='--delete':
                 self.options.delete = True
             
+            elif a[0]=='--streams':
+                a.pop(0)
+                try:
+                    self.options.streams = int(a[0])
+                except ValueError:
+                    raise ValueError("--streams value is not supported", a[0])
+                if self.options.streams < 1:
+                    raise ValueError("--streams value must be at least 1", a[0])
+            
             elif a[0]=='-x':
                 a.pop(0)
                 name = a[0]
@@ -370,6 +458,7 @@ class LocalPysync:
             self.usage(argv)
             
         self.sourceDir = os.path.abspath(a[0])
+        self.reader = SourceReader(self.sourceDir)
         if not os.path.exists(self.sourceDir):
             raise ValueError("Source path \"%s\" not found" % self.sourceDir)
         if not os.path.isdir(self.sourceDir):
@@ -389,8 +478,9 @@ class LocalPysync:
                 self.usage(argv)
             self.userAndHost, self.destDir = dest[:i], dest[i+1:]
 
-        self.connectAddress = None
-        self.sendData = None
+        # Data streams to connect and the DataSender of each connected stream
+        self.connectStreams = []
+        self.senders = dict()
         
         hostname = self.userAndHost[self.userAndHost.find('@')+1:]
         try:
@@ -408,6 +498,7 @@ class LocalPysync:
         sys.stderr.write("""usage:
     python """+argv[0]+""" [-v] [-?] [-n] 
                 [--ssharg arg] [-x exclude_file] [-i include_file] [--insecure] [--delete]
+                [--streams n]
                 [--progress-time seconds] [--progress-bytes { n[.n]{% | G | T} }
                 [--proxy] [--omit-progress-timestamp]
                 sourcedir [user@]host:destdir
@@ -426,6 +517,8 @@ class LocalPysync:
             This makes pysync.py run faster, but a bad guy can forge TCP
             packets and put junk of his choice into your files.
         --delete: Delete things in dst that do not exist in src.
+        --streams n: Copy up to n files at a time, each over its own
+            connection.  The default is %d.
         --progress-time minutes: the number of minutes to elapse before a
             time-based progress message is issued.  Progress messages may
             appear more frequently than specified due to the --progress-bytes 
@@ -437,28 +530,9 @@ class LocalPysync:
             percent of the total bytes expected to be processed.
         --proxy: Internal option indicating a call from PysyncProxy.
         --omit-progress-timestamp: Omit the timestamp from progress messages.
-""")
+""" % pysync_remote.DEFAULT_STREAMS)
         sys.exit(1)
 
-    def readFile(self,filename,offset,size):
-        '''
-        Read a chunk of the specified size at the specified offset from the
-        file identified.  The last chunk read is cached for possible re-reading.
-        
-        The file is opened only for the duration of the seek and read operations.
-        '''
-        key = (filename,offset,size)
-        if self.cache[0]==key:
-            return self.cache[1]
-        absfilename = os.path.join(self.sourceDir, filename)
-        f = open(absfilename,'rb')
-        f.seek(offset)
-        a = f.read(size)
-        f.close()
-        assert len(a)==size
-        self.cache = (key,a)
-        return a
-
     def getList(self):
         '''
         Gets a map of {name:stat} pairs to be processed.  The stat value
@@ -506,22 +580,23 @@ class LocalPysync:
         result.
         '''
         if what[0]=='connect':
-            self.connectAddress = what[1]
+            self.connectStreams.append((what[1],what[2]))
         elif what[0]=='getOptions':
             return self.options
         elif what[0]=='getDestDir':
             return self.destDir
         elif what[0]=='getList':
             return self.getList()
-        elif what[0]=='getDigest':
-            m = hashlib.md5()
-            m.update(self.readFile(what[1],what[2],what[3]))
-            return m.digest()
+        elif what[0]=='getDigests':
+            digests = []
+            for filename,offset,size in what[1]:
+                m = hashlib.md5()
+                m.update(self.reader.read(filename,offset,size))
+                digests.append(m.digest())
+            return digests
         elif what[0]=='getData':
-            self.sendData = self.readFile(what[1],what[2],what[3])
-            if self.options.compress:
-                self.sendData = zlib.compress(self.sendData,1)
-            return len(self.sendData)
+            self.senders[what[1]].send(what[2])
+            return None
         elif what[0] == 'recordProgress':
             if self.recordProgressCallback:
                 self.recordProgressCallback(what[1].rstrip())
@@ -605,17 +680,14 @@ class LocalPysync:
             self.p.stdin.flush()
             
             # If the command was a connect order, open a socket to
-            # the remote side for data transfer
-            if self.connectAddress!=None:
-                self.socket = socket.socket(self.options.addrinfo[0])
-                self.socket.connect(self.connectAddress)
-                self.connectAddress = None
-                
-            # If the command was a getData order, send the prepared
-            # data over the socket.
-            if self.sendData!=None:
-                self.socket.sendall(self.sendData)
-                self.sendData = None
+            # the remote side for the data stream and start sending
+            # the data requested for it.
+            while self.connectStreams:
+                index, address = self.connectStreams.pop(0)
+                sock = socket.socket(self.options.addrinfo[0])
+                sock.connect(address)
+                self.senders[index] = DataSender(index, sock, self.sourceDir, self.options.compress)
+                self.senders[index].start()
 
     def run(self):
         '''
@@ -650,6 +722,9 @@ class LocalPysync:
                 raise
         finally:
             os.remove('/tmp/pysync.py.%s.ppid' % (self.destDir.replace('/','_')))
+            for sender in self.senders.values():
+                sender.stop()
+            self.reader.close()
             if self.p:
                 timer = threading.Timer(2.0, (lambda: os.kill(self.p.pid, signal.SIGHUP)))
                 timer.start()
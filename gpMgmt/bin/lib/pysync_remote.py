@@ -17,8 +17,10 @@ import cPickle
 from datetime import datetime
 import errno
 import hashlib 
+import Queue
 import socket
 import stat
+import struct
 import threading
 import time
 import zlib
@@ -31,6 +33,12 @@ if __name__ == '__main__':
 # The number of file bytes processed at a time
 CHUNK_SIZE=4000000
 
+# The number of chunk digests requested from LocalPysync at a time
+DIGEST_BATCH=16
+
+# The default number of data streams used to copy files concurrently
+DEFAULT_STREAMS=4
+
 class Progress: 
     def __init__(self, byteMax, fileMax):
         self.status = '';
@@ -79,6 +87,7 @@ class Options:
         self.sendProgress = True
         self.sendRawProgress = False
         self.addrinfo = None
+        self.streams = DEFAULT_STREAMS
 
 
 
@@ -360,16 +369,18 @@ class SyncProgress(threading.Thread):
         
         return self.progressInterval
 
-    def update(self, fileBytesProcessed=0, processingFile=None):
+    def update(self, fileBytesProcessed=0, processingFile=None, fileCompleted=False):
         '''
         Update the progress information and emit a progress message if
         deemed necessary.
         
         fileBytesProcessed - the number of bytes processed (moved/examined)
                 since progress was last reported.
-        processingFile - the file currently being processed.  If different
-                from the previous value, the file completion counter is
-                incremented.
+        processingFile - the file currently being processed.
+        fileCompleted - indicates processingFile is completely processed;
+                the file completion counter is incremented.  Several files
+                may be processed at the same time so completion is not
+                inferred from a change of processingFile.
         
         The final (closing) call to this method is made when the SyncProgress
         thread is terminated by the stop() method call.
@@ -380,11 +391,9 @@ class SyncProgress(threading.Thread):
         with self.progressCountersLock:
             self.progressCounters.updateTime = time.time()
             self.progressCounters.bytesProcessed += fileBytesProcessed
-            
-            if self.progressCounters.processingFile != processingFile:
-                if self.progressCounters.processingFile:
-                    self.progressCounters.filesProcessed += 1
-                self.progressCounters.processingFile = processingFile
+            self.progressCounters.processingFile = processingFile
+            if fileCompleted:
+                self.progressCounters.filesProcessed += 1
                 
             processingChunk = self.progressCounters.bytesProcessed // self.progressBytes if self.progressBytes != 0 else 1
             if self._final or processingChunk > self.processingChunk:
@@ -435,6 +444,60 @@ class SyncProgress(threading.Thread):
             self.join(0.5)
 
 
+class DataStream:
+    '''
+    A data connection from LocalPysync to RemotePysync.  A stream copies one
+    file at a time; the chunks requested by a single 'getData' command arrive
+    on the stream's socket in the order requested, each preceded by its
+    length, so a stream is not stalled by a command round trip per chunk.
+    '''
+    def __init__(self, index):
+        self.index = index
+        self.socket = None
+        
+        # Statistics for the throughput report
+        self.files = 0
+        self.bytesCopied = 0
+        self.bytesReceived = 0
+        self.startTime = None
+        self.stopTime = None
+
+    def _recv(self, size):
+        o = 0
+        sb = []
+        while o<size:
+            a = self.socket.recv(min(size-o,65536))
+            if len(a)==0:
+                raise IOError('EOF')
+            sb.append(a)
+            o += len(a)
+        self.bytesReceived += size
+        return "".join(sb)
+
+    def receive(self):
+        '''
+        Read the next chunk sent on this stream.
+        '''
+        size = struct.unpack('!I', self._recv(4))[0]
+        return self._recv(size)
+
+    def close(self):
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+
+    def __str__(self):
+        elapsed = (self.stopTime or time.time()) - self.startTime
+        byteRate = self.bytesCopied / elapsed if elapsed > 0 else 0.0
+        return ("Stream %d: %sB of %d file(s) copied in %.1f seconds at %sBps; %sB received" 
+                % (self.index, 
+                   formatSiBinary(self.bytesCopied), 
+                   self.files, 
+                   elapsed, 
+                   formatSiBinary(byteRate), 
+                   formatSiBinary(self.bytesReceived)))
+
+
 class RemotePysync:
     '''
     The RemotePysync class is the receiving end of the directory synchronization 
@@ -447,7 +510,8 @@ class RemotePysync:
     
     This class is *not* thread-safe; a single RemotePysync instance may be used 
     in a process and must be free to change the current working directory for the
-    duration of the synchronization operation.
+    duration of the synchronization operation.  Internally, copyData() copies files
+    using a thread per DataStream.
     '''
 
     def __init__(self):
@@ -629,115 +693,198 @@ class RemotePysync:
                     os.remove(name)
                 os.link(value[1],name)
 
-    def getData(self,name,offset,size):
-        if not self.socket:
-            ss = socket.socket(self.options.addrinfo[0])
-            ss.bind(self.options.addrinfo[4])
-            ss.listen(1)
-            self.doCommand('connect',ss.getsockname())
-            self.socket = ss.accept()[0]
-            ss.close()
-        s = self.doCommand('getData',name,offset,size)
-        o = 0
-        sb = []
-        while o<s:
-            a = self.socket.recv(min(s-o,65536))
-            if len(a)==0:
-                raise IOError('EOF')
-            sb.append(a)
-            o += len(a)
-        data = "".join(sb)
-        if self.options.compress:
-            data = zlib.decompress(data)
-        assert len(data)==size
-        return data
+    def _reportMessage(self, message):
+        '''
+        Report a message the way progress messages are reported.
+        '''
+        if self.options.sendProgress:
+            self._recordProgress(message)
+        else:
+            sys.stderr.write(message)
+            sys.stderr.write("\n")
 
-    def copyData(self,list):
-        fileMax = 0
-        byteMax = 0
-        for name,value in list.iteritems():
-            if value[0]=='-':
-                fileMax += 1
-                byteMax += value[2]
-        progress = Progress(byteMax,fileMax)
-        fileNow = 0
-        byteNow = 0
-        bytesTotal = 0
-        unchanged = 0
-        for name,value in list.iteritems():
-            if value[0]=='-':
-                f = None
-                if self.options.minusn:
-                    if os.path.lexists(name) and stat.S_ISREG(os.lstat(name).st_mode):
-                        f = open(name,'rb')
-                else:
-                    f = open(name,'r+b')
-                localSize = 0
-                if f:
-                    f.seek(0,2)
-                    localSize = f.tell()
-                offset = 0
-                bytesFile = 0
-                changed = value[2]!=value[3]
-                if not value[2]:
-                    # Zero-length files require little work
+    def connectStream(self,stream):
+        '''
+        Open the socket of a DataStream unless already open.  The local
+        peer connects to a socket listening on the destination address.
+        '''
+        if stream.socket:
+            return
+        ss = socket.socket(self.options.addrinfo[0])
+        ss.bind(self.options.addrinfo[4])
+        ss.listen(1)
+        self.doCommand('connect',stream.index,ss.getsockname())
+        stream.socket = ss.accept()[0]
+        ss.close()
+        stream.startTime = time.time()
+
+    def copyFile(self,stream,name,value):
+        '''
+        Copy the changed chunks of a regular file over a DataStream.
+        
+        The digests of up to DIGEST_BATCH chunks are requested with a single
+        'getDigests' command; the chunks that differ are then requested with
+        a single 'getData' command and read from the stream.
+        '''
+        f = None
+        if self.options.minusn:
+            if os.path.lexists(name) and stat.S_ISREG(os.lstat(name).st_mode):
+                f = open(name,'rb')
+        else:
+            f = open(name,'r+b')
+        try:
+            localSize = 0
+            if f:
+                f.seek(0,2)
+                localSize = f.tell()
+            offset = 0
+            bytesFile = 0
+            changed = value[2]!=value[3]
+            while offset<value[2] and not self.copyError:
+                chunks = []
+                while offset<value[2] and len(chunks)<DIGEST_BATCH:
+                    size = min(value[2]-offset,CHUNK_SIZE)
+                    chunks.append((name,offset,size))
+                    offset += size
+                
+                # The source digests are needed to compare the chunks present
+                # locally and to verify the chunks transferred.
+                digests = [None] * len(chunks)
+                if (chunks[0][1]+chunks[0][2]<=localSize 
+                        or not (self.options.insecure or self.options.minusn)):
+                    digests = self.doCommand('getDigests',chunks)
+                
+                transfer = []
+                for chunk,digest in zip(chunks,digests):
+                    o,size = chunk[1:]
+                    if o+size<=localSize:
+                        f.seek(o)
+                        b = f.read(size)
+                        assert len(b)==size
+                        m = hashlib.md5()
+                        m.update(b)
+                        if m.digest()==digest:
+                            if not self.options.minusn:
+                                self.syncProgress.update(fileBytesProcessed=size, processingFile=name)
+                            continue
+                    transfer.append((chunk,digest))
+                
+                if transfer:
+                    changed = True
                     if not self.options.minusn:
-                        self.syncProgress.update(processingFile=name)
-                else:
-                    while offset<value[2]:
-                        if self.options.verbose:
-                            progress.update('',name,byteNow,fileNow)
-                        size = min(value[2]-offset,CHUNK_SIZE)
-                        digest = None
-                        if offset+size<=localSize:
-                            with self.commLock:
-                                self.sendCommand('getDigest',name,offset,size)
-                                f.seek(offset)
-                                b = f.read(size)
-                                assert len(b)==size
-                                m = hashlib.md5()
-                                m.update(b)
-                                a = m.digest()
-                                digest = self.getAnswer()
-                            if a==digest:
-                                if not self.options.minusn:
-                                    self.syncProgress.update(fileBytesProcessed=size, processingFile=name)
-                                offset += size
-                                byteNow += size
-                                continue
-                        changed = True
-                        if not self.options.minusn:
-                            data = self.getData(name,offset,size)
+                        self.connectStream(stream)
+                        self.doCommand('getData',stream.index,[chunk for chunk,digest in transfer])
+                        for chunk,digest in transfer:
+                            o,size = chunk[1:]
+                            data = stream.receive()
+                            if self.options.compress:
+                                data = zlib.decompress(data)
+                            assert len(data)==size
                             if not self.options.insecure:
-                                if digest==None:
-                                    digest = self.doCommand('getDigest',name,offset,size)
                                 m = hashlib.md5()
                                 m.update(data)
                                 if m.digest()!=digest:
                                     raise Exception('Digest did not match.')
-                            f.seek(offset)
+                            f.seek(o)
                             f.write(data)
                             self.syncProgress.update(fileBytesProcessed=size, processingFile=name)
-                        bytesFile += size
-                        bytesTotal += size
-                        offset += size
-                        byteNow += size
-                if f:
-                    f.close()
-                if self.options.minusn and self.options.verbose:
-                    sys.stderr.write('%s %d\n'%(name,bytesFile))
-                if not changed:
+                        stream.stopTime = time.time()
+                    bytesFile += sum([chunk[2] for chunk,digest in transfer])
+                
+                with self.copyLock:
+                    self.byteNow += sum([chunk[2] for chunk in chunks])
                     if self.options.verbose:
-                        sys.stderr.write('%s is the same\n'%name)
-                    unchanged += 1
-                fileNow += 1
+                        self.progress.update('',name,self.byteNow,self.fileNow)
+        finally:
+            if f:
+                f.close()
+        
+        if not self.options.minusn:
+            self.syncProgress.update(processingFile=name, fileCompleted=True)
+        with self.copyLock:
+            if self.options.minusn and self.options.verbose:
+                sys.stderr.write('%s %d\n'%(name,bytesFile))
+            if not changed:
+                if self.options.verbose:
+                    sys.stderr.write('%s is the same\n'%name)
+                self.unchanged += 1
+            if bytesFile and not self.options.minusn:
+                stream.files += 1
+                stream.bytesCopied += bytesFile
+            self.bytesTotal += bytesFile
+            self.fileNow += 1
+
+    def copyFiles(self,stream,files):
+        '''
+        Copy the files taken from the files Queue over stream until the
+        queue is empty or another stream failed.
+        '''
+        try:
+            while not self.copyError:
+                try:
+                    name,value = files.get(False)
+                except Queue.Empty:
+                    break
+                self.copyFile(stream,name,value)
+        except:
+            with self.copyLock:
+                if not self.copyError:
+                    self.copyError = sys.exc_info()
+
+    def copyData(self,list):
+        '''
+        Copy the content of the regular files in list.  The files are
+        spread over up to options.streams DataStreams copying them
+        concurrently, largest files first.
+        '''
+        files = []
+        byteMax = 0
+        for name,value in list.iteritems():
+            if value[0]=='-':
+                files.append((name,value))
+                byteMax += value[2]
+        fileMax = len(files)
+        files.sort(key=lambda f: f[1][2], reverse=True)
+        queue = Queue.Queue()
+        for f in files:
+            queue.put(f)
+        
+        self.progress = Progress(byteMax,fileMax)
+        self.copyLock = threading.Lock()
+        self.copyError = None
+        self.fileNow = 0
+        self.byteNow = 0
+        self.bytesTotal = 0
+        self.unchanged = 0
+        
+        streams = [DataStream(i) for i in range(max(1, min(self.options.streams, fileMax)))]
+        threads = []
+        try:
+            for stream in streams:
+                t = threading.Thread(target=self.copyFiles, args=(stream,queue), 
+                                     name="DataStream%d" % stream.index)
+                t.setDaemon(True)
+                t.start()
+                threads.append(t)
+            for t in threads:
+                t.join()
+        finally:
+            for stream in streams:
+                stream.close()
+        if self.copyError:
+            raise self.copyError[0], self.copyError[1], self.copyError[2]
+        
         if self.options.verbose:
-            progress.update('','',byteNow,fileNow)
-        updated = fileMax - unchanged
+            self.progress.update('','',self.byteNow,self.fileNow)
+        updated = fileMax - self.unchanged
         if self.options.minusn or self.options.verbose:
             sys.stderr.write('%d out of %d file(s) updated.\n'%(updated, fileMax))
         if self.options.minusn:
-            sys.stderr.write('Total--%d byte%s\n'%(bytesTotal,bytesTotal!=1 and 's' or ''))
+            sys.stderr.write('Total--%d byte%s\n'%(self.bytesTotal,self.bytesTotal!=1 and 's' or ''))
+        else:
+            for stream in streams:
+                if stream.bytesCopied:
+                    self._reportMessage(str(stream))
 
     def fixPermissions(self,list):
         '''
@@ -749,7 +896,6 @@ class RemotePysync:
                 os.chmod(name,value[1]&01777)
 
     def run(self):
-        self.socket = None
         self.options = self.doCommand('getOptions')
         
         # TODO: Add a safety check for destDir
@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 import sys
 import pickle
-import traceback 
 
 class NullDevice():
     def write(self, s):
@@ -15,8 +14,24 @@ sys.stdout = NullDevice()
 from gppylib import gplog
 from gppylib.mainUtils import getProgramName
 from gppylib.commands import unix
+from gppylib.operations.agent import OperationAgent, format_remote_traceback
 hostname = unix.getLocalHostname()
 username = unix.getUserName()
+
+if len(sys.argv) > 1 and sys.argv[1] == '--agent':
+    # gpoperation.py --agent execname idle_timeout
+    # Serve the operations of a RemoteOperationAgentPool over stdin/stdout
+    gplog.setup_tool_logging(sys.argv[2], hostname, username)
+    from gppylib.gpcoverage import GpCoverage
+    coverage = GpCoverage()
+    coverage.start()
+    try:
+        OperationAgent(sys.stdin.fileno(), old_stdout, int(sys.argv[3])).serve()
+    finally:
+        coverage.stop()
+        coverage.generate_report()
+    sys.exit(0)
+
 execname = pickle.load(sys.stdin)
 gplog.setup_tool_logging(execname, hostname, username)
 logger = gplog.get_default_logger()
@@ -31,7 +46,6 @@ try:
     ret = operation.run()
 except Exception, e:
     exc_type, exc_value, exc_traceback = sys.exc_info()
-    tb_list = traceback.extract_tb(exc_traceback)
     try:
         # TODO: Build an ExceptionCapsule that can return the traceback
         # to RemoteOperation as well. See Pyro.
@@ -45,9 +59,7 @@ except Exception, e:
         # No hope of pickling a precise Exception back to RemoteOperation.
         # So, provide meaningful trace as text and provide a non-zero return code
         # to signal to RemoteOperation that its Command invocation of gpoperation.py has failed.
-        pretty_trace = str(e) + "\n"
-        pretty_trace += 'Traceback (most recent call last):\n'
-        pretty_trace += ''.join(traceback.format_list(tb_list))
+        pretty_trace = format_remote_traceback(e, exc_traceback)
         logger.critical(pretty_trace)
         print >> sys.stderr, pretty_trace
         sys.exit(2)                         # signal that gpoperation.py has hit unexpected error
@@ -1111,6 +1111,20 @@ formSegmentPsqlCommandLine(char** retVal, const char* inputFileSpec, bool compUs
 				strncat(pszCmdLine, netbackupBlockSize, strlen(netbackupBlockSize));
 			}
 		}
+		else if ((table_filter_file || schema_level_file) && role != ROLE_MASTER)
+		{
+			/*
+			 * Let the filter read the data dump file itself, so that it can
+			 * seek to the COPY blocks of the restored tables.
+			 */
+			strcpy(pszCmdLine, filter_script);
+			formFilterOptions(&pszCmdLine, table_filter_file, role, change_schema_file, schema_level_file);
+			strcat(pszCmdLine, " -f ");
+			strcat(pszCmdLine, inputFileSpec);
+			strcat(pszCmdLine, " | ");
+			strcat(pszCmdLine, psqlPg);
+			return;
+		}
 		else
 		{
 			strcpy(pszCmdLine, catPg);
@@ -1136,29 +1150,38 @@ formFilterCommandLine(char** retVal, const char* filter_script, const char* tabl
 	{
 		strcat(pszCmdLine, " | ");
 		strcat(pszCmdLine, filter_script);
+		formFilterOptions(retVal, table_filter_file, role, change_schema_file, schema_level_file);
+	}
+}
 
-		/* Add filter option for gprestore_filter.py to
-		 * process schemas only (no data) on master.
-		 */
-		if (role == ROLE_MASTER)
-			strcat(pszCmdLine, " -m");
+/* Add the options of gprestore_filter.py to the command line */
+void
+formFilterOptions(char** retVal, const char* table_filter_file,
+			int role, const char* change_schema_file, const char *schema_level_file)
+{
+	char* pszCmdLine = *retVal;
 
-		/* Add filter option with table file to filter specified tables. */
-		if (table_filter_file)
-		{
-			strcat(pszCmdLine, " -t ");
-			strcat(pszCmdLine, table_filter_file);
-		}
-		if (change_schema_file)
-		{
-			strcat(pszCmdLine, " -c ");
-			strcat(pszCmdLine, change_schema_file);
-		}
-		if (schema_level_file)
-		{
-			strcat(pszCmdLine, " -s ");
-			strcat(pszCmdLine, schema_level_file);
-		}
+	/* Add filter option for gprestore_filter.py to
+	 * process schemas only (no data) on master.
+	 */
+	if (role == ROLE_MASTER)
+		strcat(pszCmdLine, " -m");
+
+	/* Add filter option with table file to filter specified tables. */
+	if (table_filter_file)
+	{
+		strcat(pszCmdLine, " -t ");
+		strcat(pszCmdLine, table_filter_file);
+	}
+	if (change_schema_file)
+	{
+		strcat(pszCmdLine, " -c ");
+		strcat(pszCmdLine, change_schema_file);
+	}
+	if (schema_level_file)
+	{
+		strcat(pszCmdLine, " -s ");
+		strcat(pszCmdLine, schema_level_file);
 	}
 }
 
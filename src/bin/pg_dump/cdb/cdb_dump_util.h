@@ -181,6 +181,9 @@ extern void formPostDataSchemaOnlyPsqlCommandLine(char** retVal, const char* inp
 extern void formFilterCommandLine(char** retVal, const char* filter_script, const char* table_filter_file,
 				int role, const char* change_schema_file, const char *schema_level_file);
 
+extern void formFilterOptions(char** retVal, const char* table_filter_file,
+				int role, const char* change_schema_file, const char *schema_level_file);
+
 extern void formPostDataFilterCommandLine(char** retVal, const char* post_data_filter_script, const char* table_filter_file,
 					const char* change_schema_file, const char *schema_level_file);
 
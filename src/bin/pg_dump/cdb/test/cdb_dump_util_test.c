@@ -297,7 +297,7 @@ void test__formSegmentPsqlCommandLine3(void **state)
 							   psqlPg, catPg, gpNBURestorePg,
 							   netbackupServiceHost, netbackupBlockSize, NULL, NULL);
 
-	char *expected_output = "cat fileSpec | filter.py -t filter.conf | psql";
+	char *expected_output = "filter.py -t filter.conf -f fileSpec | psql";
 	assert_string_equal(cmdLine, expected_output);
 	free(cmdLine);
 }